@@ -0,0 +1,68 @@
+"""
+BytesFields with attachment=True are kept in CouchDB as attachments rather than base64 in the doc.
+
+A doc loaded from the db only has the attachment's stub, so the field holds an AttachmentStub
+until it is read, when the bytes are fetched. open_attachment gives them as a file like object
+instead, read from the response as it arrives.
+"""
+
+import io
+
+
+ATTACHMENT_CONTENT_TYPE = "application/octet-stream"
+
+
+class AttachmentStub(object):
+
+    __slots__ = ("name", "content_type", "length", "digest")
+
+    def __init__(self, name, meta):
+        self.name = name
+        self.content_type = meta.get("content_type")
+        self.length = meta.get("length")
+        self.digest = meta.get("digest")
+
+
+    def __eq__(self, other):
+        if not isinstance(other, AttachmentStub):
+            return False
+        return self.name == other.name and self.digest == other.digest
+
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+    def __repr__(self):
+        return "<AttachmentStub %s %s bytes>" % (self.name, self.length)
+
+
+class AttachmentReader(io.RawIOBase):
+    """A file like object over the body of a streamed response"""
+
+    def __init__(self, rsp, chunk_size=64 * 1024):
+        self.rsp = rsp
+        self.chunks = rsp.iter_content(chunk_size=chunk_size)
+        self.pending = b""
+
+
+    def readable(self):
+        return True
+
+
+    def readinto(self, buffer):
+        while not self.pending:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.pending = chunk
+        count = min(len(buffer), len(self.pending))
+        buffer[:count] = self.pending[:count]
+        self.pending = self.pending[count:]
+        return count
+
+
+    def close(self):
+        if not self.closed:
+            self.rsp.close()
+        super(AttachmentReader, self).close()
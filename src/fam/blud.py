@@ -1,17 +1,21 @@
-import simplejson as json
+import io
 import traceback
 import uuid
 import datetime
 import types
 import sys
+import time
 import six
 from copy import deepcopy
 
-from fam.fam_json import object_default
+from fam.fam_json import default_json
 
 from .constants import *
 from .exceptions import *
 from .fields import *
+from .records import record_class_for
+from .cascade import CascadePlan
+from .attachments import AttachmentStub
 
 __all__ = [
     "BoolField",
@@ -45,6 +49,244 @@ def current_xml_time():
 ## this provides a class based wrapper
 
 
+_NOT_FOUND = NotSet()
+
+
+class FieldAccessor(object):
+    """A data descriptor giving direct access to one field's value in _properties.
+
+    GenericMetaclass makes one of these for every field of a class so that reading or
+    writing a field is a single dict operation rather than a trip through __getattr__.
+    """
+
+    def __init__(self, name, field):
+        self.name = name
+        self.field = field
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        return obj._values.get(self.name)
+
+    def __set__(self, obj, value):
+        if self.field.immutable and obj._values.get(self.name, _NOT_FOUND) is not _NOT_FOUND:
+            raise FamImmutableError("You cannot change the immutable property %s" % self.name)
+        obj._update_property(self.name, self.coerce(value), self.field)
+
+    def coerce(self, value):
+        return value
+
+
+def _snapshot(value):
+    # a copy of a value to compare with later to see if it has been changed in place
+    if isinstance(value, dict):
+        return dict((k, _snapshot(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [_snapshot(v) for v in value]
+    if hasattr(value, "to_json"):
+        return _snapshot(value.to_json())
+    if isinstance(value, bytearray):
+        return bytes(value)
+    return value
+
+
+def _can_change_in_place(value):
+    return isinstance(value, (dict, list, bytearray)) or hasattr(value, "to_json")
+
+
+class MutableFieldAccessor(FieldAccessor):
+    """For lists, dicts and objects which can be changed in place without a set, so the
+    first read takes a snapshot of the value for changed_fields to compare it with."""
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj._values.get(self.name)
+        if value is not None and obj._changed is not None and self.name not in obj._snapshots:
+            obj._snapshots[self.name] = _snapshot(value)
+        return value
+
+
+class ObjectFieldAccessor(MutableFieldAccessor):
+
+    def coerce(self, value):
+        field = self.field
+        if isinstance(value, field.cls):
+            return value
+        if hasattr(field.cls, "from_json"):
+            return field.cls.from_json(value)
+        return field.from_json(value)
+
+
+class ListFieldAccessor(MutableFieldAccessor):
+
+    def coerce(self, value):
+        #cast the items in the list into a certain class
+        item_cls = self.field.item_cls
+        return [item_cls.from_json(i) for i in value]
+
+
+class AttachmentFieldAccessor(FieldAccessor):
+    """A BytesField kept as an attachment, the bytes are fetched the first time it is read"""
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj._values.get(self.name)
+        if isinstance(value, AttachmentStub):
+            if obj._db is None:
+                raise Exception("no db")
+            value = obj._db.get_attachment(obj.key, self.name)
+            # not a change, it is what is already stored
+            obj._values[self.name] = value
+        return value
+
+
+class ReferenceToAccessor(FieldAccessor):
+    """Resolves the object named by a ReferenceTo field, ie dog.owner for owner_id"""
+
+    def __init__(self, name, field, id_name):
+        super(ReferenceToAccessor, self).__init__(name, field)
+        self.id_name = id_name
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        ref_key = obj._values.get(self.id_name)
+        if ref_key is None:
+            return None
+        prefetched = obj.__dict__.get("_prefetched")
+        if prefetched is not None and self.name in prefetched:
+            prefetched_key, prefetched_obj = prefetched[self.name]
+            if prefetched_key == ref_key:
+                return prefetched_obj
+        if obj._db is None:
+            traceback.print_stack()
+            raise Exception("no db")
+        return obj._db.get(ref_key, class_name=self.field.refcls)
+
+    def __set__(self, obj, value):
+        if self.field.immutable and obj._values.get(self.id_name, _NOT_FOUND) is not _NOT_FOUND:
+            raise FamImmutableError("You cannot change the immutable property %s" % self.id_name)
+        obj._update_property(self.id_name, value.key, self.field)
+
+
+class ReferenceFromAccessor(FieldAccessor):
+    """Looks up the objects that refer to this one, ie person.dogs"""
+
+    def __init__(self, name, field, type_name):
+        super(ReferenceFromAccessor, self).__init__(name, field)
+        # the type of the class that declared the field, which is what the views are named after
+        self.type_name = type_name
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        prefetched = obj.__dict__.get("_prefetched")
+        if prefetched is not None and self.name in prefetched:
+            return list(prefetched[self.name])
+        if obj._db is None:
+            traceback.print_stack()
+            raise Exception("no db")
+        return obj._db.get_refs_from(obj.namespace, self.type_name, self.name, obj.key, self.field)
+
+
+class LazyValues(object):
+    """Stands in for _properties on an object loaded with lazy=True.
+
+    It keeps the doc as it came from the db and only decodes a value, with the class's codec
+    and the field's accessor, the first time it is read. Anything that uses _properties
+    as a whole gets every value decoded, see LazyPropertiesDescriptor.
+    """
+
+    __slots__ = ("raw", "decoded", "codec", "cls")
+
+    def __init__(self, raw, adapter, cls):
+        self.raw = raw
+        self.decoded = {}
+        self.codec = adapter.codec_for(cls) if adapter is not None else None
+        self.cls = cls
+        if self.codec is not None and self.codec.attachment_names:
+            self.codec.lift_attachments(raw)
+
+    def get(self, name, default=None):
+        decoded = self.decoded
+        if name in decoded:
+            return decoded[name]
+        if name in self.raw:
+            value = self._decode(name, self.raw.pop(name))
+        else:
+            field = self.cls.fields.get(name)
+            if field is None or field.default is None:
+                return default
+            value = field.get_default()
+        decoded[name] = value
+        return value
+
+    def __setitem__(self, name, value):
+        self.raw.pop(name, None)
+        self.decoded[name] = value
+
+    def _decode(self, name, value):
+        if self.codec is not None:
+            value = self.codec.decode_value(name, value)
+        accessor = self.cls._accessors.get(name)
+        if value is not None and accessor is not None:
+            value = accessor.coerce(value)
+        return value
+
+    def materialise(self):
+        decoded = self.decoded
+        for name, value in self.raw.items():
+            decoded[name] = self._decode(name, value)
+        self.raw = {}
+        for field_name, field in self.cls.fields.items():
+            if field.default is not None and not field_name in decoded:
+                decoded[field_name] = field.get_default()
+        return decoded
+
+
+class LazyPropertiesDescriptor(object):
+    """Only consulted when an object has no _properties of its own, which means it was
+    loaded lazily, so decodes everything and stores it as normal."""
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        values = obj.__dict__.get("_values")
+        if not isinstance(values, LazyValues):
+            raise AttributeError("Not found _properties")
+        properties = values.materialise()
+        obj.__dict__["_properties"] = properties
+        obj.__dict__["_values"] = properties
+        return properties
+
+
+def _make_accessors(fields, ref_types):
+    accessors = {}
+    for field_name, field in fields.items():
+        if isinstance(field, ReferenceFrom):
+            accessors[field_name] = ReferenceFromAccessor(field_name, field, ref_types.get(field_name))
+        elif isinstance(field, ObjectField):
+            accessors[field_name] = ObjectFieldAccessor(field_name, field)
+        elif isinstance(field, ListField) and field.item_cls is not None:
+            accessors[field_name] = ListFieldAccessor(field_name, field)
+        elif isinstance(field, (ListField, DictField)):
+            accessors[field_name] = MutableFieldAccessor(field_name, field)
+        elif isinstance(field, BytesField) and field.attachment:
+            accessors[field_name] = AttachmentFieldAccessor(field_name, field)
+        else:
+            accessors[field_name] = FieldAccessor(field_name, field)
+
+    # the object a ReferenceTo points at is available under the field name without _id
+    for field_name, field in fields.items():
+        if isinstance(field, ReferenceTo):
+            alias = field_name[:-3]
+            accessors[alias] = ReferenceToAccessor(alias, field, field_name)
+
+    return accessors
+
+
 class GenericMetaclass(type):
 
     def __new__(cls, name, bases, dct):
@@ -63,6 +305,19 @@ class GenericMetaclass(type):
             if isinstance(field, ReferenceTo) and not fieldname.endswith("_id"):
                 raise FamError("All ReferenceTo field names must end with _id, %s doesn't" % fieldname)
 
+        # work out which class in the hierarchy declared each field
+        ref_types = {}
+        for fieldname in attrs["fields"]:
+            if fieldname in attrs["cls_fields"]:
+                ref_types[fieldname] = name.lower()
+            else:
+                for b in bases:
+                    found = getattr(b, "_ref_types", {}).get(fieldname)
+                    if found:
+                        ref_types[fieldname] = found
+                        break
+        attrs["_ref_types"] = ref_types
+
         attrs[TYPE_STR] = name.lower()
         newcls = super(GenericMetaclass, cls).__new__(cls, name, bases, attrs)
         module = sys.modules[newcls.__module__]
@@ -70,6 +325,20 @@ class GenericMetaclass(type):
             attrs[NAMESPACE_STR] = module.NAMESPACE
         else:
             attrs[NAMESPACE_STR] = "genericbase"
+
+        accessors = _make_accessors(attrs["fields"], ref_types)
+        attrs["_accessors"] = accessors
+        # worked out once here for the trusted constructor used on docs from the db
+        attrs["_coercers"] = tuple((accessor_name, accessor.coerce) for accessor_name, accessor in accessors.items()
+                                   if type(accessor).coerce is not FieldAccessor.coerce)
+        attrs["_default_fields"] = tuple((field_name, field) for field_name, field in attrs["fields"].items()
+                                         if field.default is not None)
+        # install the accessors as class attributes unless that would hide something defined on the class
+        for accessor_name, accessor in accessors.items():
+            existing = getattr(newcls, accessor_name, _NOT_FOUND)
+            if existing is _NOT_FOUND or isinstance(existing, FieldAccessor):
+                attrs[accessor_name] = accessor
+
         newcls = super(GenericMetaclass, cls).__new__(cls, name, bases, attrs)
         return newcls
 
@@ -86,6 +355,12 @@ class FamObject(six.with_metaclass(GenericMetaclass)):
 
     fields = {}
     acl = None
+    # fields put in a view of their own so they can be read without loading whole docs, see projection
+    projected_fields = None
+    # number fields that get a _stats view, see aggregate
+    aggregated_fields = None
+
+    _properties = LazyPropertiesDescriptor()
 
     def __init__(self, key=None, rev=None, **kwargs):
 
@@ -98,12 +373,18 @@ class FamObject(six.with_metaclass(GenericMetaclass)):
             self.rev = rev
 
         self._properties = {}
+        # the names changed since it was loaded or saved, None until then as everything is new
+        self._changed = None
+        # copies of the values that can be changed in place as they were when loaded or saved
+        self._snapshots = {}
 
         for k, v in kwargs.items():
             if not k.startswith("_"):
                 setattr(self, k, v)
 
         self._db = None
+        # references loaded in bulk by db.prefetch
+        self._prefetched = {}
 
         if kwargs.get(TYPE_STR) is None:
             self._properties[TYPE_STR] = type_name
@@ -117,8 +398,8 @@ class FamObject(six.with_metaclass(GenericMetaclass)):
                 raise Exception("the given namespace doesn't match the class")
 
     @classmethod
-    def all(cls, db):
-        return db.get_all_type(cls.namespace, cls.type)
+    def all(cls, db, compact=False, lazy=False):
+        return db.get_all_type(cls.namespace, cls.type, compact=compact, lazy=lazy)
 
 
     def _get_namespace(self):
@@ -164,39 +445,196 @@ class FamObject(six.with_metaclass(GenericMetaclass)):
         return db.get_unique_instance(cls.namespace, type_name, field_name, value)
 
 
+    @classmethod
+    def query(cls, db, compact=False, lazy=False):
+        # a Query to build with where, order_by and limit, run by iterating over it
+        from fam.query import Query
+        return Query(cls, db, compact=compact, lazy=lazy)
+
+
+    @classmethod
+    def count_with_value(cls, db, field_name, value):
+        # how many have this value of a unique field, without loading them
+        field = cls.fields.get(field_name)
+        if field is None or not field.unique:
+            raise FamError("%s isn't a unique field of %s" % (field_name, cls.__name__))
+        return db.count_with_value(cls.namespace, cls._type_with_ref(field_name), field_name, value)
+
+
+    @classmethod
+    def aggregate(cls, db, field_name):
+        # the sum, count, min, max and sum of squares of one of the class's aggregated_fields
+        if not cls.aggregated_fields or field_name not in cls.aggregated_fields:
+            raise FamError("%s isn't one of the aggregated_fields of %s" % (field_name, cls.__name__))
+        return db.aggregate(cls.namespace, cls.type, field_name)
+
+
+    def count_refs(self, name):
+        # how many objects refer to this one through the ReferenceFrom field name, without loading them
+        field = self.fields.get(name)
+        if not isinstance(field, ReferenceFrom):
+            raise FamError("%s isn't a ReferenceFrom field of %s" % (name, self.__class__.__name__))
+        prefetched = self.__dict__.get("_prefetched")
+        if prefetched is not None and name in prefetched:
+            return len(prefetched[name])
+        if self._db is None:
+            raise Exception("no db")
+        return self._db.count_refs_from(self.namespace, self._type_with_ref(name), name, self.key, field)
+
+
     @classmethod
     def create(cls, db, key=None, **kwargs):
         obj = cls(key=key, **kwargs)
+        if db.is_async:
+            return db.create_object(obj)
         obj._pre_save_new_cb(db)
         created = db.set_object(obj)
+        db._invalidate(obj.key)
         if obj.use_rev and hasattr(created, "rev") and created.rev is not None:
             obj.rev = created.rev
         obj._post_save_new_cb(db)
         obj._db = db
+        obj._mark_saved()
         return obj
 
 
+    @classmethod
+    def bulk_create(cls, db, rows):
+        # makes an object from each dict of properties and writes them all at once, returns a BulkResult for each
+        objs = [cls(**row) for row in rows]
+        return db.put_many(objs)
+
+
     def save_without_checks(self, db):
         self._pre_save_new_cb(db)
         created = db.set_object(self)
+        db._invalidate(self.key)
         if self.use_rev and hasattr(created, "rev") and created.rev is not None:
             self.rev = created.rev
         self._post_save_new_cb(db)
         self._db = db
+        self._mark_saved()
+
+
+    def open_attachment(self, name):
+        # an attachment BytesField as a file like object, streamed from the db if it hasn't been read yet
+        value = self._values.get(name)
+        if isinstance(value, AttachmentStub):
+            return self._db.get_attachment(self.key, name, stream=True)
+        return None if value is None else io.BytesIO(value)
+
+
+    @property
+    def changed_fields(self):
+        if self._changed is None:
+            return set(self._properties.keys())
+        changed = set(self._changed)
+        values = self._values
+        for name, snapshot in self._snapshots.items():
+            if name not in changed and _snapshot(values.get(name)) != snapshot:
+                changed.add(name)
+        return changed
+
+
+    def mark_changed(self, *names):
+        # for changes made straight to _properties
+        if self._changed is not None:
+            self._changed.update(names)
+
+
+    def _unchanged_in(self, db):
+        # loaded from or saved to db and not changed since, so it is there as it is
+        return self._changed is not None and self._db is db and not self.changed_fields
+
+
+    def _mark_saved(self):
+        # values that were written or read can still be changed in place through a reference to them
+        names = set(self._snapshots)
+        names.update(self._properties.keys() if self._changed is None else self._changed)
+        values = self._values
+        self._changed = set()
+        self._snapshots = {}
+        for name in names:
+            value = values.get(name)
+            if _can_change_in_place(value):
+                self._snapshots[name] = _snapshot(value)
 
 
     def save(self, db):
 
-        if db.check_on_save:
+        if db.is_async:
+            # a coroutine to await
+            return db.save_object(self)
+
+        if self._unchanged_in(db):
+            # nothing has changed since it was loaded from or saved to this db, so it is there as it is
+            return True
+
+        previous_db = self._db
+        try:
+            if db.check_on_save:
+                if db.optimistic_save and self.use_rev and self.rev is not None:
+                    return self.save_optimistic(db)
+                return self.save_with_checks(db)
+            else:
+                return self.save_without_checks(db)
+        except Exception:
+            # it isn't in db as it is so the next save mustn't be skipped
+            self._db = previous_db
+            raise
+
+
+    def save_optimistic(self, db):
+        # puts the update with the rev we already have and only gets the existing doc if that conflicts.
+        # the field accessors stop immutable fields being changed once they have a value, but not
+        # an object made with a key and rev or one changed through _properties, so those are checked
+
+        if hasattr(self, "pre_save_update_cb"):
+            # it needs the old properties so there is no saving a get
             return self.save_with_checks(db)
-        else:
-            return self.save_without_checks(db)
+
+        if self._changed is None or any(self.fields[name].immutable for name in self.changed_fields if name in self.fields):
+            # there may be an immutable value to check against the stored doc
+            return self.save_with_checks(db)
+
+        self._db = db
+
+        try:
+            result = db.set_object(self, rev=self.rev)
+        except FamRevisionConflict:
+            db._invalidate(self.key)
+            existing = FamObject.get(db, self.key, class_name=self.type)
+            if existing is None:
+                # it has been deleted under us so put it back, as a new doc like save_with_checks
+                self._pre_save_new_cb(db)
+                result = db.set_object(self, partial=False, existing=None)
+                db._invalidate(self.key)
+                if hasattr(result, "rev"):
+                    self.rev = result.rev
+                self._mark_saved()
+                self._post_save_new_cb(db)
+                return False
+            self._check_immutable(existing)
+            if not self.resolve_write_conflict(existing, existing.rev):
+                raise FamResourceConflict("bad rev id: %s, rev: %s db_rev: %s" % (self.key, self.rev, existing.rev))
+            result = db.set_object(self, rev=existing.rev, existing=existing)
+
+        db._invalidate(self.key)
+
+        if hasattr(result, "rev"):
+            self.rev = result.rev
+
+        self._mark_saved()
+        self._post_save_update_cb(db)
+        return True
 
 
     def save_with_checks(self, db):
 
         self._db = db
 
+        # don't let the identity map hand back this object as the existing one
+        db._invalidate(self.key)
         existing = FamObject.get(db, self.key, class_name=self.type)
 
         if existing:
@@ -212,7 +650,7 @@ class FamObject(six.with_metaclass(GenericMetaclass)):
 
             self._pre_save_update_cb(db, existing._properties)
             # just force the rev if not using it
-            result = db.set_object(self, rev=self.rev if self.use_rev else rev)
+            result = db.set_object(self, rev=self.rev if self.use_rev else rev, existing=existing)
 
             if self.use_rev and hasattr(result, "rev"):
                 self.rev = result.rev
@@ -221,10 +659,14 @@ class FamObject(six.with_metaclass(GenericMetaclass)):
             updated = True
         else:
             self._pre_save_new_cb(db)
-            result = db.set_object(self)
+            # it may have been loaded from this db and deleted since, so write all of it
+            result = db.set_object(self, partial=False, existing=None)
             self._post_save_new_cb(db)
             updated = False
 
+        db._invalidate(self.key)
+        self._mark_saved()
+
         if self.use_rev and hasattr(result, "rev"):
             self.rev = result.rev
 
@@ -235,15 +677,25 @@ class FamObject(six.with_metaclass(GenericMetaclass)):
         return False
 
 
-    def delete(self, db):
-        self._pre_delete_cb(db)
-        db._delete(self.key, self.rev, self.type)
-        self._post_delete_cb(db)
+    def delete(self, db, dry_run=False):
+        if db.is_async and not dry_run:
+            return db.delete_object(self)
+        if dry_run:
+            # just say what would be deleted or changed
+            return CascadePlan.build(db, [self])
+        self._delete_doc(db)
         self.delete_references(db)
         self._post_delete_references_cb(db)
         # db.sync_up()
 
 
+    def _delete_doc(self, db):
+        self._pre_delete_cb(db)
+        db._delete_object(self)
+        db._invalidate(self.key)
+        self._post_delete_cb(db)
+
+
     @classmethod
     def delete_key(cls, db, key):
         obj = cls.get(db, key)
@@ -252,28 +704,11 @@ class FamObject(six.with_metaclass(GenericMetaclass)):
 
 
     def delete_references(self, db):
-        fields_set = list(self.__class__.fields.items())
-        for field_name, field in fields_set:
-            if isinstance(field, ReferenceTo):
-                if field.cascade_delete:
-                    if field_name.endswith("_id"):
-                        obj = getattr(self, field_name[:-3])
-                        if obj is not None:
-                            obj.delete(db)
-                    else:
-                        raise Exception("should have _id")
-
-            if isinstance(field, ReferenceFrom):
-                type_name = self.__class__._type_with_ref(field_name)
-                objs = self._db.get_refs_from(self.namespace, type_name, field_name, self.key, field)
-
-                if field.cascade_delete:
-                    for obj in objs:
-                        obj.delete(db)
-                else:
-                    for obj in objs:
-                        del obj._properties[field.fkey]
-                        obj.save(db)
+        # works out the whole cascade first then deletes and clears references in bulk
+        plan = CascadePlan.build(db, [self], include_roots=False)
+        for result in plan.apply():
+            if not result.ok:
+                raise result.error
 
     def __str__(self):
         return self.as_json()
@@ -297,7 +732,7 @@ class FamObject(six.with_metaclass(GenericMetaclass)):
         d["_id"] = self.key
         if self.rev is not None:
             d["_rev"] = self.rev
-        return json.dumps(d, sort_keys=True, indent=4, default=object_default, separators=(',', ': '))
+        return default_json.dumps(d, pretty=True)
 
 
     def __eq__(self, other):
@@ -324,10 +759,17 @@ class FamObject(six.with_metaclass(GenericMetaclass)):
     def get(cls, db, key, class_name=None):
         # ugly thing to get around cache double dispatch
         cn = class_name if class_name is not None else cls.__name__.lower()
+        if getattr(db, "is_async", False):
+            return db.get(key, class_name=cn)
         if not hasattr(db, "_get"):
             #this will call back here but using the correct db
             return db.get(key, class_name=cn)
 
+        if db.identity_map is not None:
+            cached = db.identity_map.lookup(key)
+            if cached is not None:
+                return cached
+
         result = db._get(key, class_name=cn)
         if result is None:
             return None
@@ -345,15 +787,98 @@ class FamObject(six.with_metaclass(GenericMetaclass)):
         if "_rev" in doc.keys():
             del doc["_rev"]
 
+        identity_map = db.identity_map
+        if identity_map is not None:
+            cached = identity_map.lookup(key, rev)
+            if cached is not None:
+                return cached
+
         correctCls = db.class_for_type_name(doc.get(TYPE_STR), doc.get(NAMESPACE_STR))
         if correctCls is None:
             raise Exception("couldn't find class {} for key {}".format(doc.get(TYPE_STR), key))
 
-        obj = correctCls(key=key, rev=rev, **doc)
-        obj._db = db
+        obj = correctCls._from_trusted(db, key, rev, doc)
+        if identity_map is not None:
+            identity_map.add(obj)
+        return obj
+
+
+    @classmethod
+    def _from_trusted(cls, db, key, rev, doc):
+        # docs from the db have already been checked so this skips __init__ and takes doc as the properties
+        for name in [name for name in doc if name.startswith("_")]:
+            del doc[name]
+        for name, coerce in cls._coercers:
+            value = doc.get(name)
+            if value is not None:
+                doc[name] = coerce(value)
+        for name, field in cls._default_fields:
+            if name not in doc:
+                doc[name] = field.get_default()
+        if TYPE_STR not in doc:
+            doc[TYPE_STR] = cls.type
+        if NAMESPACE_STR not in doc:
+            doc[NAMESPACE_STR] = cls.namespace
+
+        obj = cls.__new__(cls)
+        attrs = obj.__dict__
+        attrs["key"] = key
+        if rev is not None:
+            attrs["rev"] = rev
+        attrs["_properties"] = doc
+        attrs["_values"] = doc
+        attrs["_changed"] = set()
+        attrs["_snapshots"] = {}
+        attrs["_db"] = db
+        attrs["_prefetched"] = {}
+        return obj
+
+
+    @classmethod
+    def _lazy_from_doc(cls, db, key, rev, doc):
+        # like _from_doc but doc hasn't been through the data adapter and is decoded a field at a time
+        doc.pop("_id", None)
+        doc.pop("_rev", None)
+
+        identity_map = db.identity_map
+        if identity_map is not None:
+            cached = identity_map.lookup(key, rev)
+            if cached is not None:
+                return cached
+
+        correctCls = db.class_for_type_name(doc.get(TYPE_STR), doc.get(NAMESPACE_STR))
+        if correctCls is None:
+            raise Exception("couldn't find class {} for key {}".format(doc.get(TYPE_STR), key))
+
+        obj = correctCls.__new__(correctCls)
+        attrs = obj.__dict__
+        attrs["key"] = key
+        if rev is not None:
+            attrs["rev"] = rev
+        attrs["_values"] = LazyValues(doc, getattr(db, "data_adapter", None), correctCls)
+        attrs["_changed"] = set()
+        attrs["_snapshots"] = {}
+        attrs["_db"] = db
+        attrs["_prefetched"] = {}
+        if identity_map is not None:
+            identity_map.add(obj)
         return obj
 
 
+    @classmethod
+    def _record_from_doc(cls, db, key, rev, doc):
+        # a compact read only alternative to _from_doc for bulk loads
+        correctCls = db.class_for_type_name(doc.get(TYPE_STR), doc.get(NAMESPACE_STR))
+        if correctCls is None:
+            raise Exception("couldn't find class {} for key {}".format(doc.get(TYPE_STR), key))
+        return record_class_for(correctCls)(key, rev, doc)
+
+
+    @classmethod
+    def record_class(cls):
+        return record_class_for(cls)
+
+
     @classmethod
     def from_json(cls, db, as_json):
         key = as_json["key"]
@@ -410,38 +935,143 @@ class FamObject(six.with_metaclass(GenericMetaclass)):
 
 
     @classmethod
-    def view(cls, db, view_name, **kwargs):
-        if db.database_type in ["sync_gateway", "null"]:
+    def _from_doc_for(cls, compact, lazy):
+        # compact gives read only FamRecords and lazy objects that decode fields as they are read
+        if compact:
+            return GenericObject._record_from_doc
+        if lazy:
+            return GenericObject._lazy_from_doc
+        return GenericObject._from_doc
+
+
+    @classmethod
+    def view(cls, db, view_name, compact=False, lazy=False, stream=False, **kwargs):
+        if db.database_type == "null" and not stream:
+            if lazy:
+                kwargs["lazy"] = True
             rows = db.view(view_name, **kwargs)
-            return [GenericObject._from_doc(db, row.key, row.rev, row.value) for row in rows]
+            from_doc = cls._from_doc_for(compact, lazy)
+            return [from_doc(db, row.key, row.rev, row.value) for row in rows]
+        elif db.database_type == "sync_gateway" and not stream:
+            return list(cls.view_iterator(db, view_name, compact=compact, lazy=lazy, **kwargs))
+        else:
+            return cls.view_iterator(db, view_name, compact=compact, lazy=lazy, stream=stream, **kwargs)
+
+
+    @classmethod
+    def view_iterator(cls, db, view_name, compact=False, lazy=False, stream=False, page_size=None, max_page_size=None, **kwargs):
+
+        from_doc = cls._from_doc_for(compact, lazy)
+        if lazy:
+            # the rows come back undecoded
+            kwargs["lazy"] = True
+
+        if stream:
+            # one request, parsed a row at a time as it arrives, so there is no need to page
+            rows = db.view(view_name, stream=True, **kwargs)
         else:
-            return cls.view_iterator(db, view_name, **kwargs)
+            rows = cls._view_rows(db, view_name, page_size, max_page_size, **kwargs)
+
+        for row in rows:
+            yield from_doc(db, row.key, row.rev, row.value)
 
 
     @classmethod
-    def view_iterator(cls, db, view_name, **kwargs):
+    def view_values(cls, db, view_name, page_size=None, max_page_size=None, **kwargs):
+        # the key of each doc in a view with the value the view emitted for it, without fetching the docs.
+        # fam's own views emit the doc's rev so for them these are the keys and revs
+        for row in cls._view_rows(db, view_name, page_size, max_page_size, include_docs=False, **kwargs):
+            yield row.key, row.value
 
+
+    @classmethod
+    def projection(cls, db, page_size=None, max_page_size=None, **kwargs):
+        # dicts of just the class's projected_fields with the key and rev, read from the projection view
+        if not cls.projected_fields:
+            raise FamError("%s has no projected_fields" % cls.__name__)
+        view_name = "%s/%s_projection" % (cls.namespace.replace("/", "_"), cls.type)
+        codec = db.data_adapter.codec_for(cls)
+        for row in cls._view_rows(db, view_name, page_size, max_page_size, include_docs=False, **kwargs):
+            value = codec.decode(row.value)
+            value["key"] = row.key
+            value["rev"] = value.pop("_rev", None)
+            yield value
+
+
+    @classmethod
+    def _view_rows(cls, db, view_name, page_size=None, max_page_size=None, **kwargs):
         if "limit" in kwargs:
-            rows = db.view(view_name, **kwargs)
-            for row in rows:
-                yield GenericObject._from_doc(db, row.key, row.rev, row.value)
+            return db.view(view_name, **kwargs)
+        elif "keys" in kwargs:
+            return cls._view_pages_by_skip(db, view_name, page_size or VIEW_PAGE_SIZE, **kwargs)
         else:
+            return cls._view_pages(db, view_name, page_size or VIEW_PAGE_SIZE, max_page_size or VIEW_MAX_PAGE_SIZE, **kwargs)
+
 
-            limit = 100
-            skip = 0
+    @classmethod
+    def _view_pages(cls, db, view_name, page_size, max_page_size, **kwargs):
+        # each page starts at the last row of the one before, by its key and doc id, rather than
+        # skipping over all the rows so far, which CouchDB has to read through to get to the page.
+        # The page size doubles while pages come back full and quickly, and halves if they are slow.
+        if "key" in kwargs:
+            key = kwargs.pop("key")
+            kwargs["startkey"] = key
+            kwargs["endkey"] = key
+
+        min_page_size = min(page_size, VIEW_MIN_PAGE_SIZE)
+        last = None
+        while True:
+            started = time.monotonic()
+            if last is None:
+                limit = page_size
+                rows = db.view(view_name, limit=limit, **kwargs)
+            else:
+                # the first row is the last one again unless it has gone since
+                kwargs["startkey"] = last.view_key
+                kwargs["startkey_docid"] = last.key
+                limit = page_size + 1
+                rows = db.view(view_name, limit=limit, **kwargs)
+                if rows and rows[0].key == last.key and rows[0].view_key == last.view_key:
+                    rows = rows[1:]
+            seconds = time.monotonic() - started
+
+            for row in rows:
+                yield row
 
-            while True:
-                rows =  db.view(view_name, limit=limit, skip=skip, **kwargs)
-                if len(rows) == 0:
-                    break
-                skip += limit
-                for row in rows:
-                    yield GenericObject._from_doc(db, row.key, row.rev, row.value)
+            if len(rows) < page_size:
+                break
+            last = rows[-1]
 
+            if seconds < VIEW_PAGE_SECONDS:
+                page_size = min(page_size * 2, max_page_size)
+            elif seconds > VIEW_PAGE_SECONDS * 2:
+                page_size = max(page_size // 2, min_page_size)
 
 
     @classmethod
-    def changes(cls, db, **kwargs):
+    def _view_pages_by_skip(cls, db, view_name, page_size, **kwargs):
+        # rows for many keys can't be paged by key, so these use skip where the db has it
+        if not getattr(db, "supports_skip", True):
+            for row in db.view(view_name, **kwargs):
+                yield row
+            return
+
+        skip = 0
+        while True:
+            rows = db.view(view_name, limit=page_size, skip=skip, **kwargs)
+            if len(rows) == 0:
+                break
+            skip += page_size
+            for row in rows:
+                yield row
+
+
+
+    @classmethod
+    def changes(cls, db, stream=False, **kwargs):
+        if stream:
+            return StreamedChanges(db, db._changes(stream=True, **kwargs))
+
         last_seq, rows = db._changes(**kwargs)
 
         changeset = []
@@ -469,58 +1099,22 @@ class FamObject(six.with_metaclass(GenericMetaclass)):
 
     @classmethod
     def _type_with_ref(cls, name):
-
-        if name in cls.cls_fields.keys():
-            return cls.type
-
-        for base in cls.__bases__:
-            found = base._type_with_ref(name)
-            if found:
-                return found
-
-        return None
-
+        return cls._ref_types.get(name)
 
 
     def __getattr__(self, name):
-        field = self.__class__.fields.get(name)
-        if isinstance(field, ReferenceFrom):
-            if self._db is None:
-                traceback.print_stack()
-                raise Exception("no db")
-            # look at super class gypes to find clas with ref
-            type_name = self.__class__._type_with_ref(name)
-            return self._db.get_refs_from(self.namespace, type_name, name, self.key, field)
-
-
-        if "%s_id" % name in self.properties.keys():
-            id_name = "%s_id" % name
-            ref = self.__class__.fields.get(id_name)
-            if isinstance(ref, ReferenceTo):
-                if self._db is None:
-                    traceback.print_stack()
-                    raise Exception("no db")
-                # return GenericObject.get(self._db, self._properties[id_name])
-                return self._db.get(self._properties[id_name], class_name=ref.refcls)
-
-        if name in self._properties.keys():
-            # print("found in properties", name)
-            # if it is a subclass of stringfield for string formats
-            # if isinstance(field, StringField) and not field.__class__ == StringField:
-            #     if hasattr(field, "from_json"):
-            #         return field.from_json(self._properties[name])
-            return self._properties[name]
-
-
-        if name in self.__class__.fields:
-            return None
-        elif "%s_id" % name in self.__class__.fields:
-            return None
-        elif name == "rev":
+        # fields are served by the accessors made in GenericMetaclass so this only sees
+        # additional properties and unknown names
+        if name == "rev":
             return None
-        else:
-            # print("self: ", self, name)
-            raise AttributeError("Not found %s" % name)
+        values = self.__dict__.get("_values")
+        if values is not None:
+            value = values.get(name, _NOT_FOUND)
+            if value is not _NOT_FOUND:
+                if isinstance(value, (list, dict)) and self._changed is not None and name not in self._snapshots:
+                    self._snapshots[name] = _snapshot(value)
+                return value
+        raise AttributeError("Not found %s" % name)
 
 
     def update(self, values, db=None):
@@ -534,8 +1128,15 @@ class FamObject(six.with_metaclass(GenericMetaclass)):
 
         if hasattr(use_db, "update"):
             use_db.update(self.namespace, self.type, self.key, values)
+            use_db._invalidate(self.key)
             for k, v in values.items():
                 setattr(self, k, v)
+            # these are already saved
+            if self._changed is not None:
+                self._changed.difference_update(values.keys())
+                for k in values.keys():
+                    if k in self._snapshots:
+                        self._snapshots[k] = _snapshot(self._values.get(k))
         else:
             for k, v in values.items():
                 setattr(self, k, v)
@@ -544,41 +1145,24 @@ class FamObject(six.with_metaclass(GenericMetaclass)):
     def _update_property(self, key, value, field):
 
         self._properties[key] = value
+        if self._changed is not None:
+            self._changed.add(key)
 
 
     def __setattr__(self, name, value):
 
-        if name in RESERVED_PROPERTY_NAMES:
+        accessor = self._accessors.get(name)
+        if accessor is not None:
+            accessor.__set__(self, value)
+        elif name in RESERVED_PROPERTY_NAMES:
             self.__dict__[name] = value
-            return
-
-        field = self.fields.get(name)
-
-        alias = "%s_id" % name
-        if alias in self.fields.keys():
-            self._update_property(alias, value.key, field)
-
-        elif name in self.fields or name in ("type", "namespace", "schema", "update_seconds", "update_nanos") or self.additional_properties :
-            if field is not None:
-                if field.immutable and name in self._properties:
-                    raise FamImmutableError("You cannot change the immutable property %s" % name)
-                if isinstance(field, ObjectField) and not isinstance(value, field.cls):
-                    if hasattr(field.cls, "from_json"):
-                        value = field.cls.from_json(value)
-                    else:
-                        value = field.from_json(value)
-
-                if isinstance(field, ListField) and field.item_cls is not None:
-                    #cast the items in the list into a certain class
-                    value = [field.item_cls.from_json(i) for i in value]
-
-                # if issubclass(field.__class__, StringField) and not (isinstance(value, str) or value is None):
-                #     value = field.to_json(value)
-
-            self._update_property(name, value, field)
+            if name == "_properties":
+                # the accessors read the same dict through _values
+                self.__dict__["_values"] = value
+        elif name in METADATA_PROPERTY_NAMES or self.additional_properties:
+            self._update_property(name, value, None)
         elif name.startswith("_"):
             self.__dict__[name] = value
-            return
         else:
             raise FamValidationError("""You cant use the property name %s on the class %s
             If you would like to set additional properties on this class that are not specified
@@ -592,3 +1176,20 @@ class FamObject(six.with_metaclass(GenericMetaclass)):
 
 
 GenericObject = FamObject
+
+
+class StreamedChanges(object):
+    """What changes returns with stream=True, yields an object for each change as it is parsed.
+    last_seq is only known once it has all been read."""
+
+    def __init__(self, db, rows):
+        self.db = db
+        self.rows = rows
+
+    @property
+    def last_seq(self):
+        return self.rows.last_seq
+
+    def __iter__(self):
+        for row in self.rows:
+            yield GenericObject._from_doc(self.db, row.key, row.rev, row.value)
@@ -0,0 +1,131 @@
+"""
+Works out everything that deleting some objects touches before changing anything.
+
+The graph is walked a level at a time so that each level costs one batched get per referenced
+class and one batched reference query per ReferenceFrom field, however many objects are in it.
+The plan is then applied with bulk writes, or just looked at for a dry run.
+"""
+
+from .fields import ReferenceFrom, ReferenceTo
+
+
+class CascadePlan(object):
+
+    def __init__(self, db):
+        self.db = db
+        # the objects to delete, in the order they were found
+        self.deletes = []
+        # key -> (object, set of foreign key names to remove from it)
+        self.updates = {}
+        self.levels = 0
+        self._seen = set()
+
+
+    @classmethod
+    def build(cls, db, objects, include_roots=True):
+        plan = cls(db)
+        level = plan._start(objects, include_roots)
+        while level:
+            level = plan._next_level(level)
+        plan._finish()
+        return plan
+
+
+    def _start(self, objects, include_roots):
+        level = []
+        for obj in objects:
+            if obj.key not in self._seen:
+                self._seen.add(obj.key)
+                level.append(obj)
+                if include_roots:
+                    self.deletes.append(obj)
+        return level
+
+
+    def _finish(self):
+        # there is no need to clear the references of anything that is being deleted anyway
+        for key in self._seen:
+            self.updates.pop(key, None)
+
+
+    def _next_level(self, objs):
+        ref_to_keys, ref_from_keys = self._wanted(objs)
+
+        from_doc = objs[0].__class__._from_doc
+        found = []
+        for class_name, keys in ref_to_keys.items():
+            for key, result in self.db._get_many(list(keys), class_name=class_name).items():
+                found.append(from_doc(self.db, key, result.rev, result.value))
+
+        refs_by_field = []
+        for (namespace, type_name, field_name), (field, keys) in ref_from_keys.items():
+            refs_by_field.append((field, self.db.get_refs_from_many(namespace, type_name, field_name, keys, field)))
+
+        return self._take(found, refs_by_field)
+
+
+    def _wanted(self, objs):
+        # the keys of the objects referred to with cascade_delete, by class name, and the keys
+        # to look up in each ReferenceFrom view, which are what the next level is made from
+        self.levels += 1
+        ref_to_keys = {}
+        ref_from_keys = {}
+
+        for obj in objs:
+            for field_name, field in obj.fields.items():
+                if isinstance(field, ReferenceTo):
+                    if field.cascade_delete:
+                        ref_key = obj._values.get(field_name)
+                        if ref_key is not None and ref_key not in self._seen:
+                            ref_to_keys.setdefault(field.refcls, set()).add(ref_key)
+                elif isinstance(field, ReferenceFrom):
+                    view_key = (obj.namespace, obj._type_with_ref(field_name), field_name)
+                    ref_from_keys.setdefault(view_key, (field, []))[1].append(obj.key)
+
+        return ref_to_keys, ref_from_keys
+
+
+    def _take(self, found, refs_by_field):
+        # adds what was found to the plan and returns the objects new to it
+        for field, refs in refs_by_field:
+            if field.cascade_delete:
+                found += refs
+            else:
+                for ref in refs:
+                    self.updates.setdefault(ref.key, (ref, set()))[1].add(field.fkey)
+
+        next_level = []
+        for obj in found:
+            if obj.key not in self._seen:
+                self._seen.add(obj.key)
+                self.deletes.append(obj)
+                next_level.append(obj)
+        return next_level
+
+
+    def apply(self):
+        # does the deletes then clears the references, returns a BulkResult for each object touched
+        results = self.db.delete_many(self.deletes, cascade=False) if self.deletes else []
+
+        to_save = []
+        for obj, fkeys in self.updates.values():
+            for fkey in fkeys:
+                obj._properties.pop(fkey, None)
+            obj.mark_changed(*fkeys)
+            to_save.append(obj)
+        if to_save:
+            results += self.db.put_many(to_save)
+
+        for result in results[:len(self.deletes)]:
+            if result.ok:
+                result.obj._post_delete_references_cb(self.db)
+
+        return results
+
+
+    def __len__(self):
+        return len(self.deletes) + len(self.updates)
+
+
+    def __repr__(self):
+        return "<CascadePlan %s deletes %s updates over %s levels>" % (len(self.deletes), len(self.updates), self.levels)
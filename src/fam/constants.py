@@ -1,5 +1,5 @@
 
-RESERVED_PROPERTY_NAMES = ("key", "rev", "_properties", "_db")
+RESERVED_PROPERTY_NAMES = ("key", "rev", "_properties", "_db", "_prefetched", "_changed", "_snapshots")
 
 # NAMESPACE_STR = "namespace"
 NAMESPACE_STR = "namespace"
@@ -7,3 +7,12 @@ TYPE_STR = "type"
 
 FIELD_REQUIRED = "required"
 FIELD_UPDATE_ACL = "update_acl"
+
+# top level properties that any object may carry as well as its fields
+METADATA_PROPERTY_NAMES = ("type", "namespace", "schema", "update_seconds", "update_nanos")
+
+# views are read a page at a time, starting at VIEW_PAGE_SIZE rows and growing while pages come back quickly
+VIEW_PAGE_SIZE = 100
+VIEW_MAX_PAGE_SIZE = 1000
+VIEW_MIN_PAGE_SIZE = 10
+VIEW_PAGE_SECONDS = 0.5
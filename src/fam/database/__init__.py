@@ -1,6 +1,11 @@
 from .couchdb import CouchDBWrapper
 from .sync_gateway import SyncGatewayWrapper
 from .firestore import FirestoreWrapper
+try:
+    # needs httpx
+    from .async_couchdb import AsyncCouchDBWrapper
+except ImportError:
+    pass
 try:
     from fam.database.couchbase_server import CouchbaseWrapper
 except Exception as e:
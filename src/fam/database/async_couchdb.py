@@ -0,0 +1,471 @@
+"""
+An asyncio CouchDB wrapper on an httpx AsyncClient so gets, saves and views don't block the event loop.
+
+Its methods are coroutines and so are get, save and delete on objects given it, ie
+dog = await Dog.get(db, key) and await dog.save(db). Requests share a pool of connections
+so many can be run at once with asyncio.gather. Anything that fails to connect or gets a
+5xx or 429 back is retried with an exponential backoff. References aren't followed
+lazily as that would need a request in an attribute lookup, get them with db.get.
+
+The httpx transport can be passed in, ie an httpx.MockTransport to test without a server.
+"""
+
+import asyncio
+
+import httpx
+import jsonschema
+
+from fam.exceptions import *
+from fam.constants import *
+from fam.fam_json import get_json_backend
+from fam.blud import GenericObject
+from fam.cascade import CascadePlan
+from .base import BaseDatabase, FamDbAuthException
+from .couchdb import CouchDBWrapper, ResultWrapper, DESIGN_FINGERPRINT
+from .couchdb_adapter import CouchDBDataAdapter
+
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# the POSTs that only read so are safe to retry
+RETRY_POST_PATHS = ("/_all_docs", "/_view/", "/_find")
+
+
+class AsyncCouchDBWrapper(BaseDatabase):
+
+    VIEW_URL = CouchDBWrapper.VIEW_URL
+
+    database_type = "couchdb"
+    is_async = True
+    check_on_save = True
+
+    def __init__(self, mapper,
+                 db_url,
+                 db_name,
+                 validator=None,
+                 read_only=False,
+                 json_backend=None,
+                 transport=None,
+                 max_connections=100,
+                 timeout=30.0,
+                 retries=5,
+                 backoff_seconds=0.1,
+                 view_update=None
+                 ):
+
+        self.mapper = mapper
+        self.validator = validator
+        self.read_only = read_only
+        self.db_name = db_name
+        self.db_url = db_url
+        self.data_adapter = CouchDBDataAdapter(mapper)
+        self.json = get_json_backend(json_backend)
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.view_update = view_update
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.client = httpx.AsyncClient(transport=transport, limits=limits, timeout=timeout)
+
+
+    async def close(self):
+        await self.client.aclose()
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+    async def _request(self, method, url, retry=None, **kwargs):
+        rsp, attempts = await self._send(method, url, retry=retry, **kwargs)
+        return rsp
+
+
+    async def _send(self, method, url, retry=None, **kwargs):
+        # retries with a backoff doubling each time, the last failure is returned or raised.
+        # by default only reads are retried, a write that failed may still have been made.
+        # returns the response and how many times it was retried
+        if retry is None:
+            retry = method == "GET" or (method == "POST" and any(part in url for part in RETRY_POST_PATHS))
+        attempt = 0
+        while True:
+            try:
+                rsp = await self.client.request(method, url, **kwargs)
+                if not retry or rsp.status_code not in RETRY_STATUS_CODES or attempt >= self.retries:
+                    return rsp, attempt
+            except httpx.TransportError:
+                if not retry or attempt >= self.retries:
+                    raise
+            await asyncio.sleep(self.backoff_seconds * 2 ** attempt)
+            attempt += 1
+
+
+    async def ensure_database(self, reset=False):
+        url = "%s/%s" % (self.db_url, self.db_name)
+        if reset:
+            rsp = await self._request("DELETE", url, retry=True)
+            if rsp.status_code not in (200, 202, 404):
+                raise Exception("Error deleting CB database: %s %s" % (rsp.status_code, rsp.text))
+        rsp = await self._request("PUT", url, retry=True)
+        if rsp.status_code not in (201, 202, 412):
+            raise Exception("Unknown Error creating cb database: %s %s" % (rsp.status_code, rsp.text))
+
+
+    async def update_designs(self):
+        # like CouchDBWrapper only the design docs whose fingerprints have changed are written
+        docs = CouchDBWrapper._design_docs(self)
+        existing = await self._get_many([doc["_id"] for doc in docs])
+        updated = []
+        for doc in docs:
+            doc[DESIGN_FINGERPRINT] = CouchDBWrapper._design_fingerprint(self, doc)
+            current = existing.get(doc["_id"])
+            if current is None or current.value.get(DESIGN_FINGERPRINT) != doc[DESIGN_FINGERPRINT]:
+                key = doc.pop("_id")
+                await self._set(key, doc, rev=None if current is None else current.rev)
+                updated.append(key)
+        return updated
+
+
+    async def ensure_design_doc(self, key, doc):
+        doc = dict(doc)
+        doc[DESIGN_FINGERPRINT] = CouchDBWrapper._design_fingerprint(self, doc)
+        existing = await self._get(key)
+        if existing is not None and existing.value.get(DESIGN_FINGERPRINT) == doc[DESIGN_FINGERPRINT]:
+            return False
+        await self._set(key, doc, rev=None if existing is None else existing.rev)
+        return True
+
+
+#################################
+
+    # the object surface, these are what FamObject.get, save and delete use with this db
+
+    async def get(self, key, class_name=None):
+        result = await self._get(key, class_name=class_name)
+        if result is None:
+            return None
+        return GenericObject._from_doc(self, result.key, result.rev, result.value)
+
+
+    async def put(self, thing):
+        return await self.save_object(thing)
+
+
+    async def delete(self, thing):
+        return await self.delete_object(thing)
+
+
+    async def save_object(self, obj):
+        # like FamObject.save_with_checks, the callbacks are called but not awaited
+        if obj._unchanged_in(self):
+            return True
+        existing = await self.get(obj.key, class_name=obj.type)
+        if existing is not None:
+            obj._check_immutable(existing)
+            if obj.use_rev and existing.rev != obj.rev:
+                if not obj.resolve_write_conflict(existing, existing.rev):
+                    raise FamResourceConflict("bad rev id: %s, rev: %s db_rev: %s" % (obj.key, obj.rev, existing.rev))
+            obj._pre_save_update_cb(self, existing._properties)
+            result = await self.set_object(obj, rev=obj.rev if obj.use_rev else existing.rev)
+            obj._post_save_update_cb(self)
+        else:
+            obj._pre_save_new_cb(self)
+            result = await self.set_object(obj)
+            obj._post_save_new_cb(self)
+
+        # only once it is written, as it is taken to be there as it is after this
+        obj._db = self
+        obj._mark_saved()
+        if obj.use_rev:
+            obj.rev = result.rev
+        return existing is not None
+
+
+    async def create_object(self, obj):
+        obj._pre_save_new_cb(self)
+        created = await self.set_object(obj)
+        if obj.use_rev:
+            obj.rev = created.rev
+        obj._post_save_new_cb(self)
+        obj._db = self
+        obj._mark_saved()
+        return obj
+
+
+    async def delete_object(self, obj):
+        # like FamObject.delete, the doc then the cascade
+        obj._pre_delete_cb(self)
+        await self._delete(obj.key, obj.rev, obj.type)
+        obj._post_delete_cb(self)
+        plan = await self._cascade_plan(obj)
+        await self._apply_cascade(plan)
+        obj._post_delete_references_cb(self)
+
+
+    async def _cascade_plan(self, obj):
+        # builds the CascadePlan that FamObject.delete_references would, a level at a time
+        plan = CascadePlan(self)
+        level = plan._start([obj], include_roots=False)
+        while level:
+            ref_to_keys, ref_from_keys = plan._wanted(level)
+            found = []
+            for class_name, keys in ref_to_keys.items():
+                for key, result in (await self._get_many(list(keys), class_name=class_name)).items():
+                    found.append(GenericObject._from_doc(self, key, result.rev, result.value))
+            refs_by_field = []
+            for (namespace, type_name, field_name), (field, keys) in ref_from_keys.items():
+                view_name = "%s/%s_%s" % (namespace.replace("/", "_"), type_name, field_name)
+                refs_by_field.append((field, await self.query_view(view_name, keys=list(keys), update="true")))
+            level = plan._take(found, refs_by_field)
+        plan._finish()
+        return plan
+
+
+    async def _apply_cascade(self, plan):
+        # the deletes then the cleared references, at the same time as each other
+        async def delete(obj):
+            obj._pre_delete_cb(self)
+            await self._delete(obj.key, obj.rev, obj.type)
+            obj._post_delete_cb(self)
+
+        await asyncio.gather(*[delete(obj) for obj in plan.deletes])
+
+        to_save = []
+        for obj, fkeys in plan.updates.values():
+            for fkey in fkeys:
+                obj._properties.pop(fkey, None)
+            obj.mark_changed(*fkeys)
+            to_save.append(obj)
+        await asyncio.gather(*[self.save_object(obj) for obj in to_save])
+
+        for obj in plan.deletes:
+            obj._post_delete_references_cb(self)
+
+
+    async def set_object(self, obj, rev=None, partial=True):
+        properties, attachments = CouchDBWrapper._split_attachments(self, obj)
+        return await self._set(obj.key, properties, rev=rev, attachments=attachments)
+
+
+    async def query_view(self, view_name, compact=False, lazy=False, **kwargs):
+        from_doc = GenericObject._from_doc_for(compact, lazy)
+        return [from_doc(self, row.key, row.rev, row.value) for row in await self.view(view_name, lazy=lazy, **kwargs)]
+
+
+    async def iter_view(self, view_name, page_size=VIEW_PAGE_SIZE, compact=False, lazy=False, **kwargs):
+        # an async iterator over the objects in a view, paged by key like FamObject.view_iterator
+        from_doc = GenericObject._from_doc_for(compact, lazy)
+        if "key" in kwargs:
+            kwargs["startkey"] = kwargs["endkey"] = kwargs.pop("key")
+        last = None
+        while True:
+            if last is None:
+                rows = await self.view(view_name, lazy=lazy, limit=page_size, **kwargs)
+            else:
+                kwargs["startkey"] = last.view_key
+                kwargs["startkey_docid"] = last.key
+                rows = await self.view(view_name, lazy=lazy, limit=page_size + 1, **kwargs)
+                if rows and rows[0].key == last.key and rows[0].view_key == last.view_key:
+                    rows = rows[1:]
+            for row in rows:
+                yield from_doc(self, row.key, row.rev, row.value)
+            if len(rows) < page_size:
+                break
+            last = rows[-1]
+
+
+    async def changes(self, since=None, channels=None, limit=None, feed=None, timeout=None, filter=None):
+        last_seq, rows = await self._changes(since=since, channels=channels, limit=limit, feed=feed, timeout=timeout, filter=filter)
+        if rows is None:
+            return last_seq, None
+        return last_seq, [GenericObject._from_doc(self, row.key, row.rev, row.value) for row in rows]
+
+
+#################################
+
+    # the async versions of CouchDBWrapper's requests
+
+    async def _get(self, key, class_name=None):
+        rsp = await self._request("GET", "%s/%s/%s" % (self.db_url, self.db_name, key))
+        if rsp.status_code == 200:
+            return ResultWrapper.from_couchdb_json(self.data_adapter.deserialise(self.json.loads(rsp.content)))
+        if rsp.status_code == 404:
+            return None
+        if rsp.status_code == 401:
+            raise FamDbAuthException(" %s %s" % (rsp.status_code, rsp.text))
+        raise Exception("Unknown Error getting cb doc: %s %s" % (rsp.status_code, rsp.text))
+
+
+    async def _get_many(self, keys, class_name=None):
+        rsp = await self._request("POST", "%s/%s/_all_docs" % (self.db_url, self.db_name),
+                                  params={"include_docs": "true"},
+                                  content=self.json.encode({"keys": list(keys)}),
+                                  headers={"Content-Type": "application/json", "Accept": "application/json"})
+        if rsp.status_code != 200:
+            raise Exception("Unknown Error getting cb docs: %s %s" % (rsp.status_code, rsp.text))
+        results = {}
+        for row in self.json.loads(rsp.content)["rows"]:
+            doc = row.get("doc")
+            if doc is not None:
+                result = ResultWrapper.from_couchdb_json(self.data_adapter.deserialise(doc))
+                results[result.key] = result
+        return results
+
+
+    async def _set(self, key, input_value, rev=None, attachments=None):
+
+        if self.read_only:
+            raise Exception("This db is read only")
+
+        value = self.data_adapter.serialise(input_value)
+
+        if "type" in value:
+            await self._check_uniqueness(key, value)
+
+        self._validate(value)
+
+        value["_id"] = key
+        if rev:
+            value["_rev"] = rev
+        if attachments:
+            value["_attachments"] = attachments
+
+        body = self.json.encode(value)
+        rsp, attempts = await self._send("PUT", "%s/%s/%s" % (self.db_url, self.db_name, key), retry=True,
+                                         content=body,
+                                         headers={"Content-Type": "application/json", "Accept": "application/json"})
+
+        new_rev = None
+        if rsp.status_code == 200 or rsp.status_code == 201:
+            new_rev = self.json.loads(rsp.content)["rev"]
+        elif rsp.status_code == 409 and attempts:
+            # an attempt that seemed to fail may have been written, if so the conflict is with itself
+            new_rev = await self._written_rev(key, body)
+
+        if new_rev is not None:
+            result = dict(input_value)
+            if "schema" in value:
+                result["schema"] = value["schema"]
+            return ResultWrapper(key, new_rev, result)
+        elif rsp.status_code == 409:
+            raise FamRevisionConflict("Conflict setting CBLite doc: %s %s" % (rsp.status_code, rsp.text))
+        else:
+            raise FamResourceConflict("Unknown Error setting CBLite doc: %s %s" % (rsp.status_code, rsp.text))
+
+
+    async def _written_rev(self, key, body):
+        # the rev of the doc if it is the one in body, attachments aside
+        rsp = await self._request("GET", "%s/%s/%s" % (self.db_url, self.db_name, key))
+        if rsp.status_code != 200:
+            return None
+        doc = self.json.loads(rsp.content)
+        sent = self.json.loads(body)
+        for name in ("_id", "_rev", "_attachments"):
+            sent.pop(name, None)
+        rev = doc.pop("_rev")
+        doc.pop("_id")
+        doc.pop("_attachments", None)
+        return rev if doc == sent else None
+
+
+    def _validate(self, value):
+        if self.validator is not None:
+            if "namespace" in value and not "schema" in value:
+                schema_id = self.validator.schema_id_for(value["namespace"], value["type"])
+                if schema_id is not None:
+                    value["schema"] = schema_id
+            try:
+                self.validator.validate(value)
+            except jsonschema.ValidationError as e:
+                raise FamValidationError(e)
+
+
+    async def _delete(self, key, rev, classname):
+        if self.read_only:
+            raise Exception("This db is read only")
+        url = "%s/%s/%s" % (self.db_url, self.db_name, key)
+        rsp, attempts = await self._send("DELETE", url, retry=True, params={"rev": rev})
+        if rsp.status_code == 200 or rsp.status_code == 202:
+            return
+        if attempts and rsp.status_code in (404, 409):
+            # an earlier attempt may have deleted it
+            if (await self._request("GET", url)).status_code == 404:
+                return
+        raise FamResourceConflict("Unknown Error deleting cb doc: %s %s" % (rsp.status_code, rsp.text))
+
+
+    async def view(self, name, raw=False, lazy=False, include_docs=True, reduce=False, update=None, **kwargs):
+        design_doc_id, view_name = name.split("/")
+        CouchDBWrapper._set_view_update(self, update if update is not None else self.view_update, kwargs)
+        kwargs["include_docs"] = "true" if include_docs and not reduce else "false"
+        kwargs["reduce"] = "true" if reduce else "false"
+
+        url = self.VIEW_URL % (self.db_url, self.db_name, design_doc_id, view_name)
+        keys = kwargs.pop("keys", None)
+        params = CouchDBWrapper._encode_for_view_query(self, kwargs)
+        if keys is None:
+            rsp = await self._request("GET", url, params=params)
+        else:
+            rsp = await self._request("POST", url, params=params, content=self.json.encode({"keys": keys}),
+                                      headers={"Content-Type": "application/json", "Accept": "application/json"})
+
+        if rsp.status_code != 200:
+            raise FamViewError("Unknown Error view cb doc: %s %s %s" % (rsp.status_code, rsp.text, url))
+
+        results = self.json.loads(rsp.content)
+        if raw:
+            return results
+        if not include_docs:
+            return [ResultWrapper.from_view_row_json(row) for row in results["rows"]]
+        if lazy:
+            return [ResultWrapper.from_couchdb_view_json(row) for row in results["rows"]]
+        return [CouchDBWrapper._wrapper_from_view_json(self, row) for row in results["rows"]]
+
+
+    async def _changes(self, since=None, channels=None, limit=1000, feed=None, timeout=None, filter=None):
+        params = {"include_docs": "true"}
+        if since is not None:
+            params["since"] = self.json.dumps(since)
+        if filter is not None and channels is not None:
+            raise Exception("you can't specify both filter and channels")
+        if filter is not None:
+            params["filter"] = filter
+        if channels is not None:
+            params["filter"] = "sync_gateway/bychannel"
+            params["channels"] = ",".join(channels)
+        if limit is not None:
+            params["limit"] = limit
+        if feed is not None:
+            if feed == "continuous":
+                raise FamError("A continuous changes feed isn't one json response")
+            params["feed"] = feed
+            if feed == "longpoll":
+                params["timeout"] = 60000 if timeout is None else timeout
+
+        rsp = await self._request("GET", "%s/%s/_changes" % (self.db_url, self.db_name), params=params)
+        if rsp.status_code == 200:
+            results = self.json.loads(rsp.content)
+            rows = [ResultWrapper.from_couchdb_json(self.data_adapter.deserialise(row["doc"])) for row in results["results"]
+                    if row.get("doc") is not None and row["doc"].get(TYPE_STR) is not None]
+            return results.get("last_seq"), rows
+        if rsp.status_code == 404:
+            return None, None
+        if rsp.status_code == 403:
+            raise FamDbAuthException()
+        raise Exception("Unknown Error getting CB doc: %s %s" % (rsp.status_code, rsp.text))
+
+
+    async def _check_uniqueness(self, key, value):
+        cls = self.mapper.get_class(value["type"], value["namespace"])
+        if cls is None:
+            return
+        for field_name, field in cls.fields.items():
+            this_value = value.get(field_name)
+            if field.unique and this_value:
+                type_name = cls._type_with_ref(field_name)
+                view_name = "%s/%s_%s" % (value["namespace"].replace("/", "_"), type_name, field_name)
+                rows = await self.view(view_name, key=this_value, include_docs=False, update="true")
+                if set(row.key for row in rows) - {key}:
+                    raise FamUniqueError("more than {} with a {} of value {}".format(type_name, field_name, this_value))
@@ -1,19 +1,64 @@
-from fam.blud import ReferenceFrom, GenericObject
+from contextlib import contextmanager
+from fam.blud import ReferenceFrom, GenericObject, ReferenceToAccessor, ReferenceFromAccessor
+from fam.exceptions import FamError
+from fam.cascade import CascadePlan
+from .identity_map import IdentityMap
 import json
 
 class FamDbAuthException(Exception):
     pass
 
+
+class BulkResult(object):
+    """What happened to one object in a put_many or delete_many, error is None if it worked"""
+
+    def __init__(self, obj, error=None):
+        self.obj = obj
+        self.error = error
+
+    @property
+    def key(self):
+        return self.obj.key
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return "<BulkResult %s %s>" % (self.key, "ok" if self.ok else repr(self.error))
+
+
 class BaseDatabase(object):
 
     FOREIGN_KEY_MAP_STRING = '''function(doc) {
     var resources = %s;
     if (resources.indexOf(doc.type) != -1 && doc.namespace == \"%s\"){
-        emit(doc.%s, null);
+        emit(doc.%s, doc._rev);
+    }
+}'''
+
+    # aggregated views emit a number field for a _stats reduce
+    AGGREGATE_MAP_STRING = '''function(doc) {
+    var resources = %s;
+    if (resources.indexOf(doc.type) != -1 && doc.namespace == \"%s\" && typeof doc.%s == \"number\"){
+        emit(doc.type, doc.%s);
+    }
+}'''
+
+    # projected views emit the listed fields so they can be read without the docs
+    PROJECTION_MAP_STRING = '''function(doc) {
+    var resources = %s;
+    if (resources.indexOf(doc.type) != -1 && doc.namespace == \"%s\"){
+        emit(doc.type, {%s});
     }
 }'''
 
     check_on_save = True
+    # the async wrappers' methods are coroutines, and so are get, save and delete on objects given them
+    is_async = False
+    # put updates straight away with the known rev and only get the existing doc on a conflict
+    optimistic_save = False
+    identity_map = None
 
 ###################################
 
@@ -31,15 +76,159 @@ class BaseDatabase(object):
     def delete_key(self, key):
         return GenericObject.delete_key(self, key)
 
-    def query_view(self, view_name, **kwargs):
-        return GenericObject.view(self, view_name, **kwargs)
-
-    def changes(self, since=None, channels=None, limit=None, feed=None, timeout=None, filter=None):
-        return GenericObject.changes(self, since=since, channels=channels, limit=limit, feed=feed, timeout=timeout, filter=filter)
+    def _delete_object(self, obj):
+        # backends override this to use what they already know about the object
+        self._delete(obj.key, obj.rev, obj.type)
+
+    def put_many(self, objects):
+        # backends override this to write them all at once
+        results = []
+        for obj in objects:
+            result = BulkResult(obj)
+            try:
+                obj.save(self)
+            except Exception as e:
+                result.error = e
+            results.append(result)
+        return results
+
+    def delete_many(self, objects, cascade=True):
+        results = []
+        for obj in objects:
+            result = BulkResult(obj)
+            try:
+                if cascade:
+                    obj.delete(self)
+                else:
+                    obj._delete_doc(self)
+            except Exception as e:
+                result.error = e
+            results.append(result)
+        return results
+
+    def _cascade_many(self, deleted):
+        # one cascade plan for all the deleted objects in a bulk delete
+        if not deleted:
+            return
+        plan = CascadePlan.build(self, [result.obj for result in deleted], include_roots=False)
+        errors = [result.error for result in plan.apply() if not result.ok]
+        for result in deleted:
+            if errors:
+                result.error = errors[0]
+            else:
+                result.obj._post_delete_references_cb(self)
+
+    def query_view(self, view_name, compact=False, lazy=False, **kwargs):
+        return GenericObject.view(self, view_name, compact=compact, lazy=lazy, **kwargs)
+
+    def changes(self, since=None, channels=None, limit=None, feed=None, timeout=None, filter=None, stream=False):
+        return GenericObject.changes(self, since=since, channels=channels, limit=limit, feed=feed, timeout=timeout, filter=filter, stream=stream)
 
 
 #################################
 
+    @contextmanager
+    def identity_session(self):
+        """
+        Within this context gets, reference lookups and view rows for a key that has already
+        been loaded return the same object without another request. Yields the IdentityMap
+        which has hits and misses counters.
+
+        It isn't called session because the CouchDB wrappers already use that for their http session.
+        """
+        previous = self.identity_map
+        self.identity_map = IdentityMap()
+        try:
+            yield self.identity_map
+        finally:
+            self.identity_map = previous
+
+    def prefetch(self, objects, *names):
+        """
+        Loads the named references of all the objects in as few requests as possible and
+        attaches them to each object, so prefetch(dogs, "owner") then dog.owner doesn't
+        make a request per dog. Works for both ReferenceTo and ReferenceFrom names.
+        """
+        objects = [obj for obj in objects if obj is not None]
+        for name in names:
+            ref_tos = {}
+            ref_froms = {}
+            for obj in objects:
+                accessor = obj._accessors.get(name)
+                if isinstance(accessor, ReferenceToAccessor):
+                    ref_tos.setdefault(accessor.field.refcls, []).append(obj)
+                elif isinstance(accessor, ReferenceFromAccessor):
+                    ref_froms.setdefault(accessor, []).append(obj)
+                else:
+                    raise FamError("%s has no reference called %s" % (obj.__class__.__name__, name))
+
+            for class_name, objs in ref_tos.items():
+                self._prefetch_ref_to(objs, name, class_name)
+
+            for accessor, objs in ref_froms.items():
+                self._prefetch_ref_from(objs, name, accessor)
+
+        return objects
+
+
+    def _prefetch_ref_to(self, objs, name, class_name):
+        id_name = objs[0]._accessors[name].id_name
+        keys = set(obj._values.get(id_name) for obj in objs)
+        keys.discard(None)
+
+        found = {}
+        if self.identity_map is not None:
+            for key in keys:
+                cached = self.identity_map.lookup(key)
+                if cached is not None:
+                    found[key] = cached
+
+        to_get = [key for key in keys if key not in found]
+        if to_get:
+            for key, result in self._get_many(to_get, class_name=class_name).items():
+                found[key] = GenericObject._from_doc(self, key, result.rev, result.value)
+
+        for obj in objs:
+            ref_key = obj._values.get(id_name)
+            # keep the key too so a later change to the id isn't hidden by the prefetched object
+            obj._prefetched[name] = (ref_key, found.get(ref_key))
+
+
+    def _prefetch_ref_from(self, objs, name, accessor):
+        field = accessor.field
+        keys = [obj.key for obj in objs]
+        refs = self.get_refs_from_many(objs[0].namespace, accessor.type_name, name, keys, field)
+
+        by_key = {}
+        for ref in refs:
+            by_key.setdefault(ref._values.get(field.fkey), []).append(ref)
+
+        for obj in objs:
+            obj._prefetched[name] = by_key.get(obj.key, [])
+
+
+    def _get_many(self, keys, class_name=None):
+        # backends override this to get all the keys in one request
+        results = {}
+        for key in keys:
+            result = self._get(key, class_name=class_name)
+            if result is not None:
+                results[key] = result
+        return results
+
+
+    def get_refs_from_many(self, namespace, type_name, name, keys, field):
+        # backends override this to query for all the keys at once
+        refs = []
+        for key in keys:
+            refs += self.get_refs_from(namespace, type_name, name, key, field)
+        return refs
+
+
+    def _invalidate(self, key):
+        if self.identity_map is not None:
+            self.identity_map.invalidate(key)
+
     def class_for_type_name(self, type_name, namespace_name):
         return self.mapper.get_class(type_name, namespace_name)
 
@@ -3,12 +3,16 @@ import pytz
 import base64
 import re
 
-from copy import deepcopy
+from copy import copy
 import datetime
 from fam.extra_types.lat_long import LatLong
 from fractions import Fraction
 from decimal import Decimal
 from google.cloud.firestore_v1 import GeoPoint
+from fam.constants import TYPE_STR, NAMESPACE_STR
+from fam.attachments import AttachmentStub
+from fam.fields import StringField, BoolField, NumberField, ReferenceTo, ReferenceFrom, DateTimeField, \
+    LatLongField, BytesField, DecimalField, FractionField
 
 
 if sys.version_info[0] < 3:
@@ -17,18 +21,187 @@ else:
     PYTHON_VERSION = 3
 
 
-class BaseDataAdapter(object):
+# keys every doc has that are never encoded
+PLAIN_KEYS = (TYPE_STR, NAMESPACE_STR, "_id", "_rev")
+
+
+class ClassCodec(object):
+    """Encodes and decodes docs of one fam class with a function per field.
+
+    The functions are picked from the field types once, so a StringField is never scanned
+    for tags and a DateTimeField goes straight to the datetime codec. Values a field
+    doesn't expect, DictFields, ListFields, ObjectFields and additional properties
+    all fall back to the adapter's generic walk.
+    """
+
+    def __init__(self, adapter, cls):
+        self.adapter = adapter
+        self.cls = cls
+        self.encoders = {}
+        self.decoders = {}
+        self.attachment_names = tuple(name for name, field in cls.fields.items()
+                                      if isinstance(field, BytesField) and field.attachment)
+        for key in PLAIN_KEYS:
+            self.encoders[key] = _plain
+            self.decoders[key] = _plain
+        for name, field in cls.fields.items():
+            if isinstance(field, ReferenceFrom):
+                continue
+            codec = adapter.field_codec(field)
+            if codec is not None:
+                self.encoders[name], self.decoders[name] = codec
+        for name in self.attachment_names:
+            self.decoders[name] = _checked(AttachmentStub, _plain, self.decoders[name])
+
+
+    def encode(self, doc):
+        encoders = self.encoders
+        generic = self.adapter._serialise_value
+        result = {}
+        for name, value in doc.items():
+            result[name] = None if value is None else encoders.get(name, generic)(value)
+        return result
+
+
+    def decode(self, doc):
+        # decodes in place, only values that change are replaced
+        if self.attachment_names:
+            self.lift_attachments(doc)
+        decoders = self.decoders
+        generic = self.adapter.deserialise_value
+        for name, value in doc.items():
+            if value is not None:
+                decoded = decoders.get(name, generic)(value)
+                if decoded is not value:
+                    doc[name] = decoded
+        return doc
+
+
+    def lift_attachments(self, doc):
+        # puts a stub for each attachment that backs a field under the field's name
+        attachments = doc.get("_attachments")
+        if not attachments:
+            return doc
+        for name in self.attachment_names:
+            meta = attachments.pop(name, None)
+            if meta is not None:
+                doc[name] = AttachmentStub(name, meta)
+        if not attachments:
+            del doc["_attachments"]
+        return doc
+
+
+    def decode_value(self, name, value):
+        if value is None:
+            return None
+        return self.decoders.get(name, self.adapter.deserialise_value)(value)
+
+
+def _plain(value):
+    return value
 
-    # a fam doc to serialise into firestore
-    def serialise(self, doc):
-        dup = deepcopy(doc)
-        return self._serialise_walk(dup)
 
-    def deserialise(self, doc):
-        dup = deepcopy(doc)
-        result = self._deserialise_walk(dup)
+def _checked(types, encode, fallback):
+    # only use the field's codec on values of the type the field expects
+    def codec(value):
+        if isinstance(value, types):
+            return encode(value)
+        return fallback(value)
+    return codec
+
+
+class BaseDataAdapter(object):
+
+    def __init__(self, mapper=None):
+        self.mapper = mapper
+        self.codecs = {}
+        if mapper is not None:
+            for cls in mapper:
+                self.codec_for(cls)
+
+
+    def codec_for(self, cls):
+        codec = self.codecs.get((cls.namespace, cls.type))
+        if codec is None:
+            codec = ClassCodec(self, cls)
+            self.codecs[(cls.namespace, cls.type)] = codec
+        return codec
+
+
+    def _codec_for_doc(self, doc, cls):
+        if cls is not None:
+            return self.codec_for(cls)
+        return self.codecs.get((doc.get(NAMESPACE_STR), doc.get(TYPE_STR)))
+
+
+    # a fam doc to serialise into the db, cls is only needed when the doc has no type and namespace.
+    # the doc is left alone, the result is a new dict but shares any nested containers that didn't change
+    def serialise(self, doc, cls=None):
+        codec = self._codec_for_doc(doc, cls)
+        if codec is not None:
+            return codec.encode(doc)
+        result = self._serialise_value(doc)
+        if result is doc:
+            result = copy(doc)
         return result
 
+    # a doc freshly parsed from the db, it is decoded in place so pass a copy if you need the original
+    def deserialise(self, doc, cls=None):
+        codec = self._codec_for_doc(doc, cls)
+        if codec is not None:
+            return codec.decode(doc)
+        return self._deserialise_walk(doc)
+
+    # a single value that the caller owns so it can be decoded in place
+    def deserialise_value(self, value):
+        return self._deserialise_walk(value)
+
+
+    def _serialise_value(self, node):
+        # like _serialise_walk but copies a container only if something in it changes
+        if isinstance(node, dict):
+            result = None
+            for k, v in node.items():
+                encoded = self._serialise_value(v)
+                if encoded is not v:
+                    if result is None:
+                        result = dict(node)
+                    result[k] = encoded
+            return node if result is None else result
+        if isinstance(node, list):
+            result = None
+            for i, v in enumerate(node):
+                encoded = self._serialise_value(v)
+                if encoded is not v:
+                    if result is None:
+                        result = list(node)
+                    result[i] = encoded
+            return node if result is None else result
+        return self._serialise_walk(node)
+
+
+    def field_codec(self, field):
+        # an (encode, decode) pair for a field or None to always use the generic walk
+        serialise = self._serialise_value
+        deserialise = self.deserialise_value
+        if isinstance(field, (StringField, ReferenceTo)):
+            return _checked(str, _plain, serialise), _checked(str, _plain, deserialise)
+        if isinstance(field, (BoolField, NumberField)):
+            # Field.__init__ empties _types on the instance so use the class's
+            types = tuple(field.__class__._types)
+            return _checked(types, _plain, serialise), _checked(types, _plain, deserialise)
+        if isinstance(field, DateTimeField):
+            return _checked(datetime.datetime, self.serialise_date_time, serialise), self.decode_date_time
+        if isinstance(field, LatLongField):
+            return _checked(LatLong, self.serialise_lat_long, serialise), self.decode_lat_long
+        if isinstance(field, BytesField):
+            return _checked((bytes, bytearray), self.serialise_bytes, serialise), self.decode_bytes
+        if isinstance(field, DecimalField):
+            return _checked(Decimal, self.serialise_decimal, serialise), self.decode_decimal
+        if isinstance(field, FractionField):
+            return _checked(Fraction, self.serialise_fraction, serialise), self.decode_fraction
+        return None
+
 
     def is_a_string(self, node):
 
@@ -173,4 +346,44 @@ class BaseDataAdapter(object):
         if self.is_a_number(node):
             return node
 
-        raise Exception("FirestoreDataAdapter can't deserialise this value: %s", node)
\ No newline at end of file
+        raise Exception("FirestoreDataAdapter can't deserialise this value: %s", node)
+
+
+    # the decoders for single typed fields, anything they don't recognise goes to the generic walk
+
+    def decode_date_time(self, value):
+        if self.is_a_string(value):
+            if value.startswith("::datetime::"):
+                return self._parse_date_time(value[len("::datetime::"):])
+            if self.is_legacy_datetime(value):
+                return self._parse_date_time(value)
+        return self.deserialise_value(value)
+
+    def decode_lat_long(self, value):
+        if self.is_a_string(value) and value.startswith("::latlong::"):
+            lat, long = value[len("::latlong::"):].split(",")
+            return LatLong(float(lat), float(long))
+        return self.deserialise_value(value)
+
+    def decode_bytes(self, value):
+        if self.is_a_string(value) and value.startswith("::bytes::"):
+            return base64.b64decode(value[len("::bytes::"):])
+        return self.deserialise_value(value)
+
+    def decode_decimal(self, value):
+        if self.is_a_string(value) and value.startswith("::decimal::"):
+            return Decimal(value[len("::decimal::"):])
+        return self.deserialise_value(value)
+
+    def decode_fraction(self, value):
+        if self.is_a_string(value) and value.startswith("::fraction::"):
+            num, denom = value[len("::fraction::"):].split("/")
+            return Fraction(int(num), int(denom))
+        return self.deserialise_value(value)
+
+    def _parse_date_time(self, stripped):
+        if "." in stripped:
+            dt = datetime.datetime.strptime(stripped, '%Y-%m-%dT%H:%M:%S.%fZ')
+        else:
+            dt = datetime.datetime.strptime(stripped, '%Y-%m-%dT%H:%M:%SZ')
+        return dt.replace(tzinfo=pytz.utc)
@@ -170,7 +170,7 @@ class CouchbaseWrapper(BaseDatabase):
 
 
 
-    def set_object(self, obj, rev=None):
+    def set_object(self, obj, rev=None, partial=True, existing=None):
 
         return self._set(obj.key, obj._properties, rev=rev)
 
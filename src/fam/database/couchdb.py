@@ -1,29 +1,51 @@
 import simplejson as json
-import copy
+import base64
+import threading
+import hashlib
 
 
-from fam.fam_json import object_default
+from fam.fam_json import get_json_backend
 import jsonschema
-from copy import deepcopy
 
 from fam.exceptions import *
 from fam.constants import *
-from fam.utils import requests_shim as requests
-from fam.database.base import BaseDatabase, FamDbAuthException
+from fam.database.base import BaseDatabase, FamDbAuthException, BulkResult
+from fam.blud import GenericObject
 
 from fam.utils.backoff import http_backoff
+from fam.utils.pooled_session import PooledSession
 from .couchdb_adapter import CouchDBDataAdapter
+from .json_stream import iter_array_items, STREAM_CHUNK_SIZE
+from fam.attachments import AttachmentStub, AttachmentReader, ATTACHMENT_CONTENT_TYPE
 
 
 JSON_KEY_STRINGS = ["endkey", "end_key", "key", "keys", "startkey", "start_key"]
 
+# how many docs to send to _bulk_docs in one go
+BULK_DOCS_CHUNK_SIZE = 1000
+
+# how a view query waits for its index: "true" brings it up to date first, "lazy" answers
+# straight away and updates it after, and "false" answers from it as it is
+VIEW_UPDATE_POLICIES = ("true", "lazy", "false")
+
+# design docs are stamped with a hash of their content so unchanged ones aren't written again
+DESIGN_FINGERPRINT = "fam_fingerprint"
+
+# the key of the doc reserving a value of a unique field, from the type, field name and value
+UNIQUE_RESERVATION_KEY = "unique:%s:%s:%s"
+
+# for when a save hasn't already got the doc it is replacing
+_NOT_LOOKED_UP = object()
+
 
 class ResultWrapper(object):
 
-    def __init__(self, key, rev, value):
+    def __init__(self, key, rev, value, view_key=None):
         self.key = key
         self.rev = rev
         self.value = value
+        # the key the row was emitted with, for paging on from it
+        self.view_key = view_key
 
 
     @classmethod
@@ -52,14 +74,21 @@ class ResultWrapper(object):
         return cls(key, rev, value)
 
 
+    # these take ownership of the parsed row and use its doc as the value rather than copying it
+
     @classmethod
     def from_couchdb_view_json(cls, as_json):
         key = as_json["id"]
-        rev = as_json["doc"]["_rev"]
-        value = deepcopy(as_json["doc"])
+        value = as_json["doc"]
+        rev = value.pop("_rev")
         del value["_id"]
-        del value["_rev"]
-        return cls(key, rev, value)
+        return cls(key, rev, value, as_json.get("key"))
+
+
+    @classmethod
+    def from_view_row_json(cls, as_json):
+        # a row without its doc, the value is whatever the view emitted
+        return cls(as_json["id"], None, as_json.get("value"), as_json.get("key"))
 
 
     @classmethod
@@ -67,14 +96,13 @@ class ResultWrapper(object):
         # the format of this seems to be changing quite a bit
         try:
             key = as_json["id"]
-            value = deepcopy(as_json["value"])
+            value = as_json["value"]
             sync = value.get("_sync")
             if sync is not None:
                 rev = sync["rev"]
                 del value["_sync"]
             elif value.get("_rev"):
-                rev = as_json["value"]["_rev"]
-                del value["_rev"]
+                rev = value.pop("_rev")
             else:
                 rev = None
         except KeyError as e:
@@ -86,15 +114,74 @@ class ResultWrapper(object):
         #     print as_json
 
 
-        return cls(key, rev, value)
+        return cls(key, rev, value, as_json.get("key"))
+
+
+MANGO_OPERATORS = {
+    "==": "$eq",
+    "!=": "$ne",
+    "<": "$lt",
+    "<=": "$lte",
+    ">": "$gt",
+    ">=": "$gte",
+    "in": "$in",
+    "not-in": "$nin"
+}
+
+
+def seq_number(seq):
+    # CouchDB 2's sequences are strings like "123-g1AAAA", the number before the dash counts the changes
+    if seq is None:
+        return None
+    if isinstance(seq, list):
+        seq = seq[0]
+    if isinstance(seq, int):
+        return seq
+    return int(str(seq).split("-")[0])
+
+
+def combine_stats(all_stats):
+    # adds together _stats results, ie from several reduced rows
+    combined = {"sum": 0, "count": 0, "min": None, "max": None, "sumsqr": 0}
+    for stats in all_stats:
+        combined["sum"] += stats["sum"]
+        combined["count"] += stats["count"]
+        combined["sumsqr"] += stats.get("sumsqr", 0)
+        combined["min"] = stats["min"] if combined["min"] is None else min(combined["min"], stats["min"])
+        combined["max"] = stats["max"] if combined["max"] is None else max(combined["max"], stats["max"])
+    return combined
+
+
+class ChangesStream(object):
+    """
+    What _changes returns with stream=True, iterate it for a ResultWrapper per changed doc as
+    they are parsed. last_seq is only known once it has all been read.
+    """
+
+    def __init__(self, db, rsp):
+        self.db = db
+        self.rsp = rsp
+        self.meta = {}
+
+    @property
+    def last_seq(self):
+        return self.meta.get("last_seq")
+
+    def __iter__(self):
+        deserialise = self.db.data_adapter.deserialise
+        for row in self.db._stream_items(self.rsp, "results", self.meta):
+            doc = row.get("doc")
+            if doc is not None and doc.get(TYPE_STR) is not None:
+                yield ResultWrapper.from_couchdb_json(deserialise(doc))
 
 
 def auth(func):
     def func_wrapper(instance, *args, **kwargs):
+        generation = instance._auth_generation
         try:
             return func(instance, *args, **kwargs)
         except FamDbAuthException:
-            instance.authenticate()
+            instance._refresh_auth(generation)
             return func(instance, *args, **kwargs)
     return func_wrapper
 
@@ -117,6 +204,13 @@ class CouchDBWrapper(BaseDatabase):
     database_type = "couchdb"
     supports_skip = True
     check_on_save = True
+    thread_safe = False
+    # claim unique values with reservation docs rather than checking the unique views
+    unique_reservations = False
+    # the update policy for view queries that don't give one, None waits for the index
+    view_update = None
+    # bumped each time authenticate is called so threads that failed together only do it once
+    _auth_generation = 0
 
     def __init__(self, mapper,
                  db_url,
@@ -125,20 +219,35 @@ class CouchDBWrapper(BaseDatabase):
                  remote_url=None,
                  continuous=False,
                  validator=None,
-                 read_only=False
+                 read_only=False,
+                 optimistic_save=False,
+                 json_backend=None,
+                 thread_safe=False,
+                 pool_connections=10,
+                 pool_maxsize=10,
+                 pool_block=False,
+                 keep_alive=True,
+                 connect_timeout=None,
+                 read_timeout=None,
+                 unique_reservations=False,
+                 view_update=None
                  ):
 
         self.mapper = mapper
         self.validator = validator
         self.read_only = read_only
+        self.optimistic_save = optimistic_save
+        self.unique_reservations = unique_reservations
+        self.view_update = view_update
 
         self.cookies = {}
 
         self.remote_url = remote_url
         self.db_name = db_name
         self.db_url = db_url
-        self.session = requests.Session()
-        self.data_adapter = CouchDBDataAdapter()
+        self._init_session(thread_safe, pool_connections, pool_maxsize, pool_block, keep_alive, connect_timeout, read_timeout)
+        self.data_adapter = CouchDBDataAdapter(mapper)
+        self.json = get_json_backend(json_backend)
 
         url = "%s/%s" % (db_url, db_name)
 
@@ -175,6 +284,54 @@ class CouchDBWrapper(BaseDatabase):
 
 
 
+    def _init_session(self, thread_safe=False, pool_connections=10, pool_maxsize=10, pool_block=False,
+                      keep_alive=True, connect_timeout=None, read_timeout=None):
+        # one pooled session for every thread using this wrapper
+        if connect_timeout is None and read_timeout is None:
+            timeout = None
+        else:
+            timeout = (connect_timeout, read_timeout)
+        self.session = PooledSession(pool_connections=pool_connections,
+                                     pool_maxsize=pool_maxsize,
+                                     pool_block=pool_block,
+                                     timeout=timeout,
+                                     keep_alive=keep_alive)
+        self._auth_lock = threading.Lock()
+        self.thread_safe = thread_safe
+        if thread_safe:
+            self._local = threading.local()
+
+
+    @property
+    def identity_map(self):
+        # in thread safe mode each thread has its own identity_session
+        if self.thread_safe:
+            return getattr(self._local, "identity_map", None)
+        return self.__dict__.get("identity_map")
+
+
+    @identity_map.setter
+    def identity_map(self, identity_map):
+        if self.thread_safe:
+            self._local.identity_map = identity_map
+        else:
+            self.__dict__["identity_map"] = identity_map
+
+
+    @property
+    def pool_metrics(self):
+        """The number of connections taken from the pool and the total, max and mean seconds waited for them"""
+        return self.session.metrics.snapshot()
+
+
+    def _refresh_auth(self, generation):
+        # only the first of the threads that got an auth error with the same credentials authenticates
+        with self._auth_lock:
+            if self._auth_generation == generation:
+                self.authenticate()
+                self._auth_generation += 1
+
+
     def info(self):
 
         url = "%s/%s" % (self.db_url, self.db_name)
@@ -201,7 +358,7 @@ class CouchDBWrapper(BaseDatabase):
         # print "_get: ", url
         rsp = self.session.get(url)
         if rsp.status_code == 200:
-            return ResultWrapper.from_couchdb_json(self.data_adapter.deserialise(rsp.json()))
+            return ResultWrapper.from_couchdb_json(self.data_adapter.deserialise(self.json.loads(rsp.content)))
         if rsp.status_code == 404:
             # print "not found: ", key
             return None
@@ -210,37 +367,167 @@ class CouchDBWrapper(BaseDatabase):
         raise Exception("Unknown Error getting cb doc: %s %s" % (rsp.status_code, rsp.text))
 
 
+    @auth
+    def _get_many(self, keys, class_name=None):
+        url = "%s/%s/_all_docs" % (self.db_url, self.db_name)
+        rsp = self.session.post(url, params={"include_docs": "true"},
+                                data=self.json.encode({"keys": list(keys)}),
+                                headers={"Content-Type": "application/json", "Accept": "application/json"})
+        if rsp.status_code == 200:
+            results = {}
+            for row in self.json.loads(rsp.content)["rows"]:
+                # missing docs have an error and deleted ones a null doc
+                doc = row.get("doc")
+                if doc is not None:
+                    result = ResultWrapper.from_couchdb_json(self.data_adapter.deserialise(doc))
+                    results[result.key] = result
+            return results
+        if rsp.status_code == 401:
+            raise FamDbAuthException(" %s %s" % (rsp.status_code, rsp.text))
+        raise Exception("Unknown Error getting cb docs: %s %s" % (rsp.status_code, rsp.text))
+
+
     def get_refs_from(self, namespace, type_name, name, key, field):
         view_namespace = namespace.replace("/", "_")
         view_name = "%s/%s_%s" % (view_namespace, type_name, name)
         return self.query_view(view_name, key=key)
 
 
+    def get_refs_from_many(self, namespace, type_name, name, keys, field):
+        view_namespace = namespace.replace("/", "_")
+        view_name = "%s/%s_%s" % (view_namespace, type_name, name)
+        # cascades use these so they have to see the latest writes
+        return self.query_view(view_name, keys=list(keys), update="true")
+
+
+    def count_refs_from(self, namespace, type_name, name, key, field):
+        view_namespace = namespace.replace("/", "_")
+        view_name = "%s/%s_%s" % (view_namespace, type_name, name)
+        return self._count_key(view_name, key)
+
+
+    def count_with_value(self, namespace, type_name, field_name, value):
+        if self.unique_reservations:
+            # there can only be the one
+            return 0 if self.get_unique_instance(namespace, type_name, field_name, value) is None else 1
+        view_namespace = namespace.replace("/", "_")
+        view_name = "%s/%s_%s" % (view_namespace, type_name, field_name)
+        return self._count_key(view_name, value)
+
+
+    def _count_key(self, view_name, key):
+        if not self.mapper.counts:
+            # without the _count reduce the rows have to be counted, though not their docs
+            return len(self.view(view_name, key=key, include_docs=False))
+        rows = self.view(view_name, raw=True, reduce=True, group="true", key=key)["rows"]
+        return rows[0]["value"] if rows else 0
+
+
+    def aggregate(self, namespace, type_name, field_name):
+        # the _stats of a number field over a class and its sub classes, one reduced row for each type
+        view_namespace = namespace.replace("/", "_")
+        view_name = "%s/%s_%s_stats" % (view_namespace, type_name, field_name)
+        rows = self.view(view_name, raw=True, reduce=True, group="true")["rows"]
+        return combine_stats(row["value"] for row in rows)
+
+
     def get_with_value(self, namespace, type_name, field_name, value):
         view_namespace = namespace.replace("/", "_")
         view_name = "%s/%s_%s" % (view_namespace, type_name, field_name)
         return self.query_view(view_name, key=value)
 
-    def get_all_type(self, namespace, type_name):
-        return self.query_view("raw/all", key=type_name)
-
+    def get_all_type(self, namespace, type_name, compact=False, lazy=False):
+        return self.query_view("raw/all", key=type_name, compact=compact, lazy=lazy)
+
+
+    def set_object(self, obj, rev=None, partial=True, existing=_NOT_LOOKED_UP):
+        # existing is the object as it is in the db, or None if it isn't, when the save has already got it
+        properties, attachments = self._split_attachments(obj)
+        return self._set(obj.key, properties, rev=rev, attachments=attachments, existing=existing)
+
+
+    def _split_attachments(self, obj):
+        # takes attachment BytesFields out of the properties and works out the _attachments to send for them
+        names = self.data_adapter.codec_for(obj.__class__).attachment_names
+        if not names:
+            return obj._properties, None
+        properties = dict(obj._properties)
+        attachments = {}
+        changed = obj.changed_fields if obj._changed is not None else None
+        for name in names:
+            value = properties.pop(name, None)
+            if value is None:
+                # leaving it out deletes it
+                continue
+            if isinstance(value, AttachmentStub) or (changed is not None and name not in changed):
+                # what is stored already
+                attachments[name] = {"stub": True}
+            else:
+                attachments[name] = {"content_type": ATTACHMENT_CONTENT_TYPE,
+                                     "data": base64.b64encode(value).decode("ascii")}
+        return properties, attachments
 
-    def set_object(self, obj, rev=None):
 
-        return self._set(obj.key, obj._properties, rev=rev)
+    @auth
+    def get_attachment(self, key, name, stream=False):
+        # the bytes of an attachment or with stream=True a file like object reading them from the response
+        url = "%s/%s/%s/%s" % (self.db_url, self.db_name, key, name)
+        rsp = self.session.get(url, stream=stream)
+        if rsp.status_code == 200:
+            return AttachmentReader(rsp) if stream else rsp.content
+        rsp.close()
+        if rsp.status_code == 404:
+            return None
+        if rsp.status_code == 401:
+            raise FamDbAuthException(" %s %s" % (rsp.status_code, rsp.text))
+        raise Exception("Unknown Error getting attachment: %s %s" % (rsp.status_code, rsp.text))
 
 
     @http_backoff
-    def _set(self, key, input_value, rev=None, backoff=False):
+    def _set(self, key, input_value, rev=None, backoff=False, attachments=None, existing=_NOT_LOOKED_UP):
 
         value = self.data_adapter.serialise(input_value)
 
         if self.read_only:
             raise Exception("This db is read only")
 
-        if "type" in value:
+        if "type" in value and not self.unique_reservations:
             self._check_uniqueness(key, value)
 
+        self._validate(value)
+
+        value["_id"] = key
+        if rev:
+            value["_rev"] = rev
+        if attachments:
+            value["_attachments"] = attachments
+
+        claimed, released = [], []
+        if "type" in value and self.unique_reservations:
+            claimed, released = self._reserve_for_set(value, existing)
+
+        url = "%s/%s/%s" % (self.db_url, self.db_name, key)
+
+        rsp = self.session.put(url, data=self.json.encode(value),
+                               headers={"Content-Type": "application/json", "Accept": "application/json"})
+
+        # give back the values claimed if it wasn't saved, or the ones it had if it was
+        self._release_reservations(released if rsp.status_code in (200, 201) else claimed)
+
+        if rsp.status_code == 200 or rsp.status_code == 201:
+            new_rev = self.json.loads(rsp.content)["rev"] if rsp.content else rev
+            # what was sent is the input encoded so there is no need to decode it again
+            result = dict(input_value)
+            if "schema" in value:
+                result["schema"] = value["schema"]
+            return ResultWrapper(key, new_rev, result)
+        elif rsp.status_code == 409:
+            raise FamRevisionConflict("Conflict setting CBLite doc: %s %s" % (rsp.status_code, rsp.text))
+        else:
+            raise FamResourceConflict("Unknown Error setting CBLite doc: %s %s" % (rsp.status_code, rsp.text))
+
+
+    def _validate(self, value):
         if self.validator is not None:
             if "namespace" in value and not "schema" in value:
                 schema_id = self.validator.schema_id_for(value["namespace"], value["type"])
@@ -252,74 +539,390 @@ class CouchDBWrapper(BaseDatabase):
                 raise FamValidationError(e)
 
 
-        value["_id"] = key
-        if rev:
-            value["_rev"] = rev
+    def put_many(self, objects, chunk_size=BULK_DOCS_CHUNK_SIZE):
+        if self.read_only:
+            raise Exception("This db is read only")
+        objects = list(objects)
+        results = []
+        for i in range(0, len(objects), chunk_size):
+            results += self._put_chunk(objects[i:i + chunk_size])
+        return results
+
+
+    def _put_chunk(self, objects):
+
+        results = [BulkResult(obj) for obj in objects]
+        # the results still to write and whether each is an update
+        pending = []
+
+        existing_docs = {}
+        if self.check_on_save:
+            for obj in objects:
+                self._invalidate(obj.key)
+            existing_docs = self._get_many([obj.key for obj in objects])
+
+        for result in results:
+            obj = result.obj
+            if obj._unchanged_in(self):
+                # nothing to save
+                continue
+            try:
+                existing_doc = existing_docs.get(obj.key)
+                if existing_doc is None:
+                    obj._pre_save_new_cb(self)
+                    rev = None
+                else:
+                    existing = GenericObject._from_doc(self, existing_doc.key, existing_doc.rev, existing_doc.value)
+                    obj._check_immutable(existing)
+                    if obj.use_rev and existing.rev != obj.rev:
+                        if not obj.resolve_write_conflict(existing, existing.rev):
+                            raise FamResourceConflict("bad rev id: %s, rev: %s db_rev: %s" % (obj.key, obj.rev, existing.rev))
+                    obj._pre_save_update_cb(self, existing._properties)
+                    rev = obj.rev if obj.use_rev else existing.rev
+                properties, attachments = self._split_attachments(obj)
+                value = self.data_adapter.serialise(properties)
+                self._validate(value)
+                value["_id"] = obj.key
+                if rev:
+                    value["_rev"] = rev
+                if attachments:
+                    value["_attachments"] = attachments
+                pending.append((result, value, existing_doc is not None))
+            except Exception as e:
+                result.error = e
+
+        claimed, released = {}, {}
+        if self.unique_reservations:
+            # without check_on_save the values they had aren't known so aren't released
+            unique_errors, claimed, released = self._reserve_unique_values([value for result, value, updated in pending], existing_docs)
+        else:
+            # uniqueness is checked with one view query per unique field rather than per object
+            unique_errors = self._check_uniqueness_many([value for result, value, updated in pending])
+        for result, value, updated in pending:
+            if value["_id"] in unique_errors:
+                result.error = unique_errors[value["_id"]]
+        pending = [p for p in pending if p[0].error is None]
+
+        if not pending:
+            return results
+
+        rows = self._bulk_docs([value for result, value, updated in pending])
+
+        to_release = []
+        for (result, value, updated), row in zip(pending, rows):
+            obj = result.obj
+            self._invalidate(obj.key)
+            if "error" in row:
+                result.error = self._bulk_error(row)
+                to_release += claimed.get(obj.key, [])
+                continue
+            to_release += released.get(obj.key, [])
+            if obj.use_rev:
+                obj.rev = row["rev"]
+            obj._db = self
+            obj._mark_saved()
+            if updated:
+                obj._post_save_update_cb(self)
+            else:
+                obj._post_save_new_cb(self)
 
-        url = "%s/%s/%s" % (self.db_url, self.db_name, key)
+        self._release_reservations(to_release)
 
-        rsp = self.session.put(url, data=json.dumps(value,
-                                                    indent=4,
-                                                    sort_keys=True,
-                                                    default=object_default),
-                               headers={"Content-Type": "application/json", "Accept": "application/json"})
+        return results
 
-        if rsp.status_code == 200 or rsp.status_code == 201:
-            if rsp.content:
-                value["_rev"] = rsp.json()["rev"]
 
-            return ResultWrapper.from_couchdb_json(self.data_adapter.deserialise(value))
-        else:
-            raise FamResourceConflict("Unknown Error setting CBLite doc: %s %s" % (rsp.status_code, rsp.text))
+    def delete_many(self, objects, cascade=True, chunk_size=BULK_DOCS_CHUNK_SIZE):
+        if self.read_only:
+            raise Exception("This db is read only")
+        objects = list(objects)
+        results = []
+        for i in range(0, len(objects), chunk_size):
+            results += self._delete_chunk(objects[i:i + chunk_size], cascade)
+        return results
+
+
+    def _delete_chunk(self, objects, cascade):
+
+        results = [BulkResult(obj) for obj in objects]
+        pending = []
+        for result in results:
+            try:
+                result.obj._pre_delete_cb(self)
+                pending.append(result)
+            except Exception as e:
+                result.error = e
+
+        if not pending:
+            return results
+
+        reservations = {}
+        if self.unique_reservations:
+            reservations = self._reservations_held(self.data_adapter.serialise(r.obj.as_dict()) for r in pending)
+
+        rows = self._bulk_docs([{"_id": r.obj.key, "_rev": r.obj.rev, "_deleted": True} for r in pending])
+
+        deleted = []
+        to_release = []
+        for result, row in zip(pending, rows):
+            obj = result.obj
+            self._invalidate(obj.key)
+            if "error" in row:
+                result.error = self._bulk_error(row)
+                continue
+            to_release += reservations.get(obj.key, [])
+            try:
+                obj._post_delete_cb(self)
+                deleted.append(result)
+            except Exception as e:
+                result.error = e
+
+        self._release_reservations(to_release)
+
+        if cascade:
+            self._cascade_many(deleted)
 
+        return results
 
-    def _delete(self, key, rev, classname):
 
+    @auth
+    def _bulk_docs(self, docs):
+        url = "%s/%s/_bulk_docs" % (self.db_url, self.db_name)
+        rsp = self.session.post(url, data=self.json.encode({"docs": docs}),
+                                headers={"Content-Type": "application/json", "Accept": "application/json"})
+        if rsp.status_code == 201 or rsp.status_code == 200:
+            return self.json.loads(rsp.content)
+        if rsp.status_code == 401:
+            raise FamDbAuthException(" %s %s" % (rsp.status_code, rsp.text))
+        raise FamWriteError("Unknown Error in bulk docs: %s %s" % (rsp.status_code, rsp.text))
+
+
+    def _bulk_error(self, row):
+        if row["error"] == "conflict":
+            return FamRevisionConflict("Conflict setting doc %s: %s" % (row.get("id"), row.get("reason")))
+        return FamWriteError("Error setting doc %s: %s %s" % (row.get("id"), row["error"], row.get("reason")))
+
+
+    def _delete_object(self, obj):
+        value = None
+        if self.unique_reservations:
+            unique_names = set(name for name, field in obj.fields.items() if field.unique)
+            if unique_names and not unique_names & obj.changed_fields:
+                # its unique values are the ones in the db at its rev, which is the only one it can delete
+                value = self.data_adapter.serialise(obj.as_dict())
+        self._delete(obj.key, obj.rev, obj.type, value=value)
+
+
+    def _delete(self, key, rev, classname, value=None):
+        # value is the serialised doc being deleted if it is known, for the unique values it holds
         if self.read_only:
             raise Exception("This db is read only")
 
+        reservations = {}
+        if self.unique_reservations:
+            if value is None:
+                existing = self._get_many([key]).get(key)
+                if existing is not None and TYPE_STR in existing.value:
+                    value = self._reservation_value(existing)
+            if value is not None:
+                reservations = self._reservations_held([value])
+
         rsp = self.session.delete("%s/%s/%s?rev=%s" % (self.db_url, self.db_name, key, rev))
         if rsp.status_code == 200 or rsp.status_code == 202:
+            self._release_reservations(reservations.get(key, []))
             return
         raise FamResourceConflict("Unknown Error deleting cb doc: %s %s" % (rsp.status_code, rsp.text))
 
 
     def _wrapper_from_view_json(self, as_json):
-        return ResultWrapper.from_couchdb_view_json(self.data_adapter.deserialise(as_json))
+        # only the doc is used so only it needs decoding, and that can use the class's codec
+        as_json["doc"] = self.data_adapter.deserialise(as_json["doc"])
+        return ResultWrapper.from_couchdb_view_json(as_json)
+
+
+    def _raw_wrapper_from_view_json(self, as_json):
+        # for lazy loads, the doc is left for the object to decode as it's read
+        return ResultWrapper.from_couchdb_view_json(as_json)
 
 
     def _encode_for_view_query(self, kwargs):
         encoded = {}
         for k, v in kwargs.items():
-            encoded[k] = json.dumps(v) if k in JSON_KEY_STRINGS else v
+            encoded[k] = self.json.dumps(v) if k in JSON_KEY_STRINGS else v
         return encoded
 
 
     # @ensure_views
-    def view(self, name, raw=False, **kwargs):
+    def view(self, name, raw=False, lazy=False, stream=False, include_docs=True, reduce=False, update=None, **kwargs):
+        # with stream=True the rows are a generator that parses them as the response arrives
+        # and with include_docs=False each row's value is what the view emitted rather than the doc
+        # update is one of VIEW_UPDATE_POLICIES and overrides the db's view_update
         design_doc_id, view_name = name.split("/")
 
-        kwargs["include_docs"] = "true"
+        self._set_view_update(update if update is not None else self.view_update, kwargs)
+
+        kwargs["include_docs"] = "true" if include_docs and not reduce else "false"
+        # views may have a reduce so say whether it is wanted
+        kwargs["reduce"] = "true" if reduce else "false"
 
         url = self.VIEW_URL % (self.db_url, self.db_name, design_doc_id, view_name)
-        rsp = self.session.get(url, params=self._encode_for_view_query(kwargs))
+        keys = kwargs.pop("keys", None)
+        if keys is None:
+            rsp = self.session.get(url, params=self._encode_for_view_query(kwargs), stream=stream)
+        else:
+            # lots of keys won't fit in a url so post them
+            rsp = self.session.post(url, params=self._encode_for_view_query(kwargs),
+                                    data=self.json.encode({"keys": keys}),
+                                    headers={"Content-Type": "application/json", "Accept": "application/json"},
+                                    stream=stream)
 
         if rsp.status_code == 200:
-            results = rsp.json()
+            if not include_docs:
+                wrap = ResultWrapper.from_view_row_json
+            else:
+                wrap = self._raw_wrapper_from_view_json if lazy else self._wrapper_from_view_json
+            if stream and not raw:
+                return (wrap(row) for row in self._stream_items(rsp, "rows"))
+            results = self.json.loads(rsp.content)
             if raw:
                 return results
-            rows = results["rows"]
-            return [self._wrapper_from_view_json(row) for row in rows]
+            return [wrap(row) for row in results["rows"]]
 
         raise FamViewError("Unknown Error view cb doc: %s %s %s" % (rsp.status_code, rsp.text, url))
 
 
+    def _set_view_update(self, update, params):
+        if update is None:
+            return
+        if update not in VIEW_UPDATE_POLICIES:
+            raise FamError("view update should be one of %s not %s" % (", ".join(VIEW_UPDATE_POLICIES), update))
+        params["update"] = update
+
+
+    def view_lag(self, name):
+        """
+        How many changes behind the db a view's index is, without updating it. None if the
+        server doesn't give the sequences.
+        """
+        results = self.view(name, raw=True, limit=0, update="false", update_seq="true")
+        info = self.info()
+        if info is None or results.get("update_seq") is None:
+            return None
+        return max(0, seq_number(info.get("update_seq")) - seq_number(results["update_seq"]))
+
+
+    def run_query(self, query):
+        # pages through _find with its bookmark, FamObject.query makes the query
+        url = "%s/%s/_find" % (self.db_url, self.db_name)
+        body = self._mango_query(query)
+        from_doc = GenericObject._from_doc_for(query.compact, query.lazy)
+        wanted = body.pop("limit", None)
+        count = 0
+        while wanted is None or count < wanted:
+            body["limit"] = VIEW_PAGE_SIZE if wanted is None else min(VIEW_PAGE_SIZE, wanted - count)
+            rsp = self.session.post(url, data=self.json.encode(body), headers={"Content-Type": "application/json"})
+            if rsp.status_code != 200:
+                raise FamViewError("Unknown Error finding docs: %s %s %s" % (rsp.status_code, rsp.text, body))
+            results = self.json.loads(rsp.content)
+            docs = results["docs"]
+            for doc in docs:
+                # lazy objects decode their own fields as they are read
+                if not query.lazy:
+                    doc = self.data_adapter.deserialise(doc)
+                row = ResultWrapper.from_couchdb_json(doc)
+                yield from_doc(self, row.key, row.rev, row.value)
+            count += len(docs)
+            if len(docs) < body["limit"]:
+                break
+            body["bookmark"] = results["bookmark"]
+
+
+    def explain_query(self, query):
+        url = "%s/%s/_explain" % (self.db_url, self.db_name)
+        rsp = self.session.post(url, data=self.json.encode(self._mango_query(query)), headers={"Content-Type": "application/json"})
+        if rsp.status_code != 200:
+            raise FamViewError("Unknown Error explaining query: %s %s" % (rsp.status_code, rsp.text))
+        return self.json.loads(rsp.content)
+
+
+    def create_query_index(self, cls, field_names):
+        """
+        Makes a Mango index on the fields for the class and its sub classes, which a query
+        ordered by them needs, and returns the [design doc, name] to give use_index.
+        It does nothing if the index is already there.
+        """
+        ddoc, name = self._query_index_name(cls, field_names)
+        body = {
+            "ddoc": ddoc,
+            "name": name,
+            "type": "json",
+            "index": {
+                "fields": list(field_names),
+                # only the class's docs are in it
+                "partial_filter_selector": self._type_selector(cls)
+            }
+        }
+        url = "%s/%s/_index" % (self.db_url, self.db_name)
+        rsp = self.session.post(url, data=self.json.encode(body), headers={"Content-Type": "application/json"})
+        if rsp.status_code != 200:
+            raise FamViewError("Unknown Error creating index: %s %s" % (rsp.status_code, rsp.text))
+        return [ddoc, name]
+
+
+    def _query_index_name(self, cls, field_names):
+        return ["fam_query", "%s_%s__%s" % (cls.namespace.replace("/", "_"), cls.type, "_".join(field_names))]
+
+
+    def _type_selector(self, cls):
+        type_names = sorted(self.mapper.get_all_subclass_names(cls.namespace, cls.type))
+        return {
+            "type": type_names[0] if len(type_names) == 1 else {"$in": type_names},
+            "namespace": cls.namespace
+        }
+
+
+    def _mango_query(self, query):
+        selector = self._type_selector(query.cls)
+        for field_name, op, value in query.encoded_conditions(self.data_adapter):
+            condition = selector.setdefault(field_name, {})
+            if op == "array-contains":
+                condition.setdefault("$all", []).append(value)
+            elif op == "array-contains-any":
+                condition["$elemMatch"] = {"$in": value}
+            else:
+                condition[MANGO_OPERATORS[op]] = value
+
+        body = {"selector": selector}
+        if query.ordering:
+            body["sort"] = [{field_name: "desc" if descending else "asc"} for field_name, descending in query.ordering]
+            for field_name, descending in query.ordering:
+                # an index is only used for fields in the selector
+                selector.setdefault(field_name, {"$exists": True})
+        if query.max_results is not None:
+            body["limit"] = query.max_results
+        if query.index is not None:
+            body["use_index"] = query.index
+        elif query.ordering:
+            # the one create_query_index makes, being partial it isn't picked unless asked for
+            body["use_index"] = self._query_index_name(query.cls, [field_name for field_name, descending in query.ordering])
+        return body
+
+
+    def _stream_items(self, rsp, array_name, meta=None):
+        try:
+            for item in iter_array_items(rsp.iter_content(chunk_size=STREAM_CHUNK_SIZE), array_name, meta):
+                yield item
+        finally:
+            rsp.close()
+
+
     def authenticate(self):
         pass
 
 
     @auth
-    def _changes(self, since=None, channels=None, limit=1000, feed=None, timeout=None, filter=None):
+    def _changes(self, since=None, channels=None, limit=1000, feed=None, timeout=None, filter=None, stream=False):
+        if stream and feed == "continuous":
+            raise FamError("A continuous changes feed isn't one json response so can't be streamed")
         url = "%s/%s/_changes" % (self.db_url, self.db_name)
         params = {"include_docs":"true"}
         if since is not None:
@@ -340,10 +943,12 @@ class CouchDBWrapper(BaseDatabase):
                     params["timeout"] = 60000
                 else:
                     params["timeout"] = timeout
-        rsp = self.session.get(url, params=params, cookies=self.cookies)
+        rsp = self.session.get(url, params=params, cookies=self.cookies, stream=stream)
         # rsp = self.session.get(url, cookies=self.cookies)
+        if rsp.status_code == 200 and stream:
+            return ChangesStream(self, rsp)
         if rsp.status_code == 200:
-            results = rsp.json()
+            results = self.json.loads(rsp.content)
             last_seq = results.get("last_seq")
             rows = results.get("results")
             return last_seq, [ResultWrapper.from_couchdb_json(self.data_adapter.deserialise(row["doc"])) for row in rows if "doc" in row.keys() and row["doc"].get(TYPE_STR) is not None]
@@ -464,32 +1069,49 @@ class CouchDBWrapper(BaseDatabase):
 
 
     def ensure_design_doc(self, key, doc):
-        if self.read_only:
-            raise Exception("This db is read only")
+        doc = dict(doc)
+        doc["_id"] = key
+        return key in self._sync_design_docs([doc])
 
-        # first put it into dev
-        dev_key = key.replace("_design/", "_design/dev_")
-        dev_doc = copy.deepcopy(doc)
-        dev_doc["_id"] = dev_key
 
-        previous_dev = self._get(dev_key)
+    def _design_fingerprint(self, doc):
+        content = dict((k, v) for k, v in doc.items() if k not in ("_id", "_rev", DESIGN_FINGERPRINT))
+        return hashlib.sha1(json.dumps(content, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
 
-        # print "self.db_url: ", self.db_url, self.db_name
 
-        self._set(dev_key, dev_doc, rev=None if previous_dev is None else previous_dev.rev)
+    def _sync_design_docs(self, docs):
+        """
+        Writes the design docs whose fingerprint doesn't match the one in the db, checking
+        them all with one _all_docs request and writing those that changed with one _bulk_docs.
+        Returns the keys of the ones written.
+        """
+        if self.read_only:
+            raise Exception("This db is read only")
 
-        # then get it back again to compare
-        existing = self._get(key)
-        existing_dev = self._get(dev_key)
+        for doc in docs:
+            doc[DESIGN_FINGERPRINT] = self._design_fingerprint(doc)
 
-        if existing == existing_dev:
-            pass
-            # print("************  designs up to date ************")
-        else:
-            # print("************  updating designs ************")
-            # print("new_design: ", doc)
-            self._set(key, doc, rev=None if existing is None else existing.rev)
+        existing = self._get_many([doc["_id"] for doc in docs])
+        changed = []
+        for doc in docs:
+            current = existing.get(doc["_id"])
+            if current is None:
+                changed.append(doc)
+            elif current.value.get(DESIGN_FINGERPRINT) != doc[DESIGN_FINGERPRINT]:
+                doc["_rev"] = current.rev
+                changed.append(doc)
 
+        if not changed:
+            return []
+
+        for doc, row in zip(changed, self._bulk_docs(changed)):
+            if "error" in row:
+                # another process may have just written the same one
+                current = self._get_many([doc["_id"]]).get(doc["_id"])
+                if current is None or current.value.get(DESIGN_FINGERPRINT) != doc[DESIGN_FINGERPRINT]:
+                    raise self._bulk_error(row)
+
+        return [doc["_id"] for doc in changed]
 
 
     def _raw_design_doc(self):
@@ -497,7 +1119,7 @@ class CouchDBWrapper(BaseDatabase):
         design_doc = {
             "views": {
                 "all": {
-                    "map": "function(doc) {emit(doc.type, null);}"
+                    "map": "function(doc) {emit(doc.type, doc._rev);}"
                 }
             }
         }
@@ -505,38 +1127,82 @@ class CouchDBWrapper(BaseDatabase):
         return design_doc
 
 
-    def update_designs(self):
+    def _design_docs(self):
 
         ## simple type index
         doc = self._raw_design_doc()
-        key = "_design/raw"
-
-        doc["_id"] = key
-
-        self.ensure_design_doc(key, doc)
-
+        doc["_id"] = "_design/raw"
+        docs = [doc]
 
         ## relational indexes
         for namespace_name, namespace in self.mapper.namespaces.items():
 
             view_namespace = namespace_name.replace("/", "_")
-            key = "_design/%s" % view_namespace
-
-            doc = self.mapper.get_design(namespace, namespace_name, self.FOREIGN_KEY_MAP_STRING)
-            doc["_id"] = key
-            self.ensure_design_doc(key, doc)
+            doc = self.mapper.get_design(namespace, namespace_name, self.FOREIGN_KEY_MAP_STRING,
+                                         self.PROJECTION_MAP_STRING, self.AGGREGATE_MAP_STRING)
+            doc["_id"] = "_design/%s" % view_namespace
+            docs.append(doc)
 
         # ## extra indexes
         # for doc in self.mapper.extra_design_docs():
-        #     key = doc["_id"]
-        #     self.ensure_design_doc(key, doc)
+        #     docs.append(doc)
+
+        return docs
+
+
+    def update_designs(self, warm=False):
+        """
+        Brings the design docs up to date, writing only the ones that have changed, and returns
+        their keys. With warm=True their indexes start building in the background, see index_progress.
+        """
+        updated = self._sync_design_docs(self._design_docs())
+        if warm and updated:
+            self.warm_views(updated)
+        return updated
+
+
+    def warm_views(self, keys=None):
+        # update=lazy returns straight away and builds the index after, one view builds the whole design doc
+        if keys is None:
+            keys = [doc["_id"] for doc in self._design_docs()]
+        for doc in self._get_many(keys).values():
+            views = doc.value.get("views")
+            if views:
+                view_name = sorted(views)[0]
+                url = self.VIEW_URL % (self.db_url, self.db_name, doc.key[len("_design/"):], view_name)
+                params = {"limit": 0, "update": "lazy"}
+                if "reduce" in views[view_name]:
+                    params["reduce"] = "false"
+                self.session.get(url, params=params)
+
+
+    def index_progress(self):
+        """
+        The indexes being built for this db from _active_tasks, a dict of design doc key to
+        how far through it is as a percentage. Empty once they are all built.
+        """
+        rsp = self.session.get("%s/_active_tasks" % self.db_url)
+        if rsp.status_code != 200:
+            raise Exception("Unknown Error getting active tasks: %s %s" % (rsp.status_code, rsp.text))
+        progress = {}
+        for task in self.json.loads(rsp.content):
+            # in a cluster the database is a shard, ie shards/00000000-1fffffff/test.1234567890
+            database = task.get("database", "").split("/")[-1].split(".")[0]
+            if task.get("type") == "indexer" and database == self.db_name:
+                # each shard reports its own, so an index is as far as its slowest shard
+                design = task.get("design_document")
+                progress[design] = min(progress.get(design, 100), task.get("progress", 0))
+        return progress
 
 
     def get_unique_instance(self, namespace, type_name, field_name, value):
 
+        if self.unique_reservations:
+            return self._reserved_instance(type_name, field_name, value)
+
         view_namespace = namespace.replace("/", "_")
         view_name = "%s/%s_%s" % (view_namespace, type_name, field_name)
-        all_existing = self.query_view(view_name, key=value)
+        all_existing = self.query_view(view_name, key=value, update="true")
         all_non_null = [o for o in all_existing if getattr(o, field_name, None)]
         how_many_existing = len(all_non_null)
 
@@ -548,6 +1214,41 @@ class CouchDBWrapper(BaseDatabase):
             return None
 
 
+    def _check_uniqueness_many(self, values):
+        # returns a dict of key to FamUniqueError for the values that clash with the db or each other
+        errors = {}
+        wanted = {}
+        for value in values:
+            if "type" not in value:
+                continue
+            cls = self.mapper.get_class(value["type"], value["namespace"])
+            for field_name, field in cls.fields.items():
+                if field.unique and value.get(field_name) is not None:
+                    view_key = (value["namespace"], cls._type_with_ref(field_name), field_name)
+                    wanted.setdefault(view_key, []).append(value)
+
+        for (namespace, type_name, field_name), field_values in wanted.items():
+            view_namespace = namespace.replace("/", "_")
+            view_name = "%s/%s_%s" % (view_namespace, type_name, field_name)
+            keys = list(set(value[field_name] for value in field_values))
+            owners = {}
+            # the rows' keys are the values so the docs aren't needed
+            for row in self.view(view_name, keys=keys, include_docs=False, update="true"):
+                if row.view_key is not None:
+                    owners.setdefault(row.view_key, set()).add(row.key)
+
+            for value in field_values:
+                this_value = value[field_name]
+                others = owners.setdefault(this_value, set())
+                if others - {value["_id"]}:
+                    errors[value["_id"]] = FamUniqueError("more than {} with a {} of value {}".format(type_name, field_name, this_value))
+                else:
+                    # later ones in the same batch clash with this one
+                    others.add(value["_id"])
+
+        return errors
+
+
     def _check_uniqueness(self, key, value):
 
 
@@ -565,7 +1266,203 @@ class CouchDBWrapper(BaseDatabase):
                         continue
 
                     type_name = cls._type_with_ref(field_name)
-                    existing = self.get_unique_instance(namespace, type_name, field_name, this_value)
+                    others = self._unique_owner_keys(namespace, type_name, field_name, this_value) - {key}
+                    if others:
+                        raise FamUniqueError("more than {} with a {} of value {}".format(type_name, field_name, this_value))
+
 
-                    if existing and existing.key != key:
-                        raise FamUniqueError("more than {} with a {} of value {}".format(type_name, field_name, this_value))
\ No newline at end of file
+    def _unique_owner_keys(self, namespace, type_name, field_name, value):
+        # the keys of the docs with this value, just the keys so none of the docs are fetched
+        if not value:
+            # like get_unique_instance empty values are never taken
+            return set()
+        view_namespace = namespace.replace("/", "_")
+        view_name = "%s/%s_%s" % (view_namespace, type_name, field_name)
+        return set(row.key for row in self.view(view_name, key=value, include_docs=False, update="true"))
+
+
+#################################
+
+    # unique values claimed with reservation docs, like the type__field docs on Firestore
+
+    def _reservation_key(self, type_name, field_name, value):
+        return UNIQUE_RESERVATION_KEY % (type_name, field_name, value)
+
+
+    def _unique_reservations(self, value):
+        # the reservation keys for the unique values of a serialised doc, to their type, field name and value
+        reservations = {}
+        cls = self.mapper.get_class(value[TYPE_STR], value[NAMESPACE_STR])
+        if cls is None:
+            return reservations
+        for field_name, field in cls.fields.items():
+            this_value = value.get(field_name)
+            # like get_unique_instance empty values are never taken
+            if field.unique and this_value:
+                type_name = cls._type_with_ref(field_name)
+                reservations[self._reservation_key(type_name, field_name, this_value)] = (type_name, field_name, this_value)
+        return reservations
+
+
+    def _reservation_value(self, result):
+        # a doc read from the db serialised again so its values match the ones being saved
+        value = self.data_adapter.serialise(result.value)
+        value["_id"] = result.key
+        return value
+
+
+    def _reserved_instance(self, type_name, field_name, value):
+        if not value:
+            return None
+        reservation = self._get_many([self._reservation_key(type_name, field_name, value)])
+        if not reservation:
+            return None
+        owner = self.get(list(reservation.values())[0].value["owner"])
+        # a reservation left behind by a doc that has since changed doesn't count
+        if owner is None or getattr(owner, field_name, None) != value:
+            return None
+        return owner
+
+
+    def _reserve_for_set(self, value, existing=_NOT_LOOKED_UP):
+        cls = self.mapper.get_class(value[TYPE_STR], value[NAMESPACE_STR])
+        if cls is None or not any(field.unique for field in cls.fields.values()):
+            return [], []
+        key = value["_id"]
+        if existing is _NOT_LOOKED_UP:
+            existing_docs = self._get_many([key])
+        elif existing is None:
+            existing_docs = {}
+        else:
+            existing_docs = {key: ResultWrapper(existing.key, existing.rev, existing._properties)}
+        errors, claimed, released = self._reserve_unique_values([value], existing_docs)
+        if key in errors:
+            raise errors[key]
+        return claimed.get(key, []), released.get(key, [])
+
+
+    def _reserve_unique_values(self, values, existing_docs):
+        """
+        Claims the reservation docs for the unique values of the serialised docs in values before
+        they are saved, existing_docs being the ResultWrappers of those already in the db by key.
+        A reservation is only ever created without a rev so of two writers claiming a value at
+        once just one gets it. One whose owner no longer has the value is taken over.
+
+        Returns a dict of key to FamUniqueError for those that can't have their values, and dicts
+        of key to the deletions that give back the reservations each claimed, for if its save
+        fails, and the ones for the values it used to have, for once it is saved.
+        """
+        wanted = {}
+        had = {}
+        for value in values:
+            key = value["_id"]
+            wanted[key] = self._unique_reservations(value)
+            existing = existing_docs.get(key)
+            if existing is not None and TYPE_STR in existing.value:
+                had[key] = set(self._unique_reservations(self._reservation_value(existing))) - set(wanted[key])
+
+        reservation_keys = set(rkey for reservations in wanted.values() for rkey in reservations)
+        reservation_keys.update(rkey for rkeys in had.values() for rkey in rkeys)
+        if not reservation_keys:
+            return {}, {}, {}
+        current = self._get_many(list(reservation_keys))
+
+        errors = {}
+        claims = []
+        taken_by_others = []
+        batch_owners = {}
+        for value in values:
+            key = value["_id"]
+            for rkey, (type_name, field_name, this_value) in wanted[key].items():
+                error = FamUniqueError("more than {} with a {} of value {}".format(type_name, field_name, this_value))
+                if batch_owners.setdefault(rkey, key) != key:
+                    # an earlier one in the same batch has it
+                    errors[key] = error
+                    continue
+                reservation = current.get(rkey)
+                if reservation is not None and reservation.value.get("owner") == key:
+                    continue
+                doc = {"_id": rkey, "owner": key, "type_name": type_name, "field": field_name, "value": this_value}
+                if reservation is None:
+                    claims.append((key, doc, error))
+                else:
+                    doc["_rev"] = reservation.rev
+                    taken_by_others.append((reservation.value.get("owner"), key, doc, error))
+
+        if taken_by_others:
+            owners = self._get_many(list(set(owner for owner, key, doc, error in taken_by_others)))
+            for owner, key, doc, error in taken_by_others:
+                owner_doc = owners.get(owner)
+                if owner_doc is not None and self._reservation_value(owner_doc).get(doc["field"]) == doc["value"]:
+                    errors[key] = error
+                else:
+                    claims.append((key, doc, error))
+
+        claims = [claim for claim in claims if claim[0] not in errors]
+        claimed = {}
+        if claims:
+            rows = self._bulk_docs([doc for key, doc, error in claims])
+            for (key, doc, error), row in zip(claims, rows):
+                if "error" in row:
+                    # someone else claimed it first
+                    errors[key] = error if row["error"] == "conflict" else self._bulk_error(row)
+                else:
+                    claimed.setdefault(key, []).append({"_id": row["id"], "_rev": row["rev"], "_deleted": True})
+
+        # those that failed give back what they did get
+        self._release_reservations([doc for key in errors for doc in claimed.pop(key, [])])
+
+        released = {}
+        for key, rkeys in had.items():
+            if key in errors:
+                continue
+            released[key] = [{"_id": rkey, "_rev": current[rkey].rev, "_deleted": True} for rkey in rkeys
+                             if rkey in current and current[rkey].value.get("owner") == key]
+
+        return errors, claimed, released
+
+
+    def _reservations_held(self, values):
+        # the deletions of the reservations held by these serialised docs, by key
+        wanted = {}
+        for value in values:
+            if TYPE_STR in value:
+                for rkey in self._unique_reservations(value):
+                    wanted[rkey] = value["_id"]
+        if not wanted:
+            return {}
+        held = {}
+        for rkey, reservation in self._get_many(list(wanted)).items():
+            if reservation.value.get("owner") == wanted[rkey]:
+                held.setdefault(wanted[rkey], []).append({"_id": rkey, "_rev": reservation.rev, "_deleted": True})
+        return held
+
+
+    def _release_reservations(self, deletions):
+        # failures are left, a reservation whose owner doesn't have the value is taken over anyway
+        if deletions:
+            self._bulk_docs(deletions)
+
+
+    def reserve_existing_unique_values(self):
+        """
+        Makes the reservation docs for the unique values already in the db, from the unique
+        views, to use once before turning on unique_reservations for an existing database.
+        """
+        docs = []
+        for namespace_name, namespace in self.mapper.namespaces.items():
+            view_namespace = namespace_name.replace("/", "_")
+            for type_name, cls in namespace.items():
+                for field_name, field in cls.cls_fields.items():
+                    if not field.unique:
+                        continue
+                    view_name = "%s/%s_%s" % (view_namespace, type_name, field_name)
+                    for row in self.view(view_name, include_docs=False, reduce=False, update="true"):
+                        if row.view_key:
+                            docs.append({"_id": self._reservation_key(type_name, field_name, row.view_key),
+                                         "owner": row.key, "type_name": type_name, "field": field_name,
+                                         "value": row.view_key})
+        # those already reserved come back as conflicts and are left as they are
+        for i in range(0, len(docs), BULK_DOCS_CHUNK_SIZE):
+            self._bulk_docs(docs[i:i + BULK_DOCS_CHUNK_SIZE])
+        return len(docs)
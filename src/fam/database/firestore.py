@@ -3,6 +3,8 @@ import time
 import sys
 import copy
 import os
+import heapq
+import itertools
 
 import requests
 from requests.exceptions import HTTPError
@@ -11,11 +13,12 @@ import firebase_admin
 from firebase_admin import credentials, auth, firestore
 from google.cloud.firestore import transactional
 from google.cloud.firestore_v1 import aggregation
+from google.cloud.firestore_v1.query_profile import ExplainOptions
 from google.api_core.exceptions import PermissionDenied
 
 from fam.exceptions import *
 from fam.constants import *
-from fam.database.base import BaseDatabase
+from fam.database.base import BaseDatabase, BulkResult
 from fam.database.couchdb import ResultWrapper
 from fam.database.firestore_adapter import FirestoreDataAdapter
 
@@ -64,6 +67,12 @@ def refresh_check(func):
     return func_wrapper
 
 
+def _order_key(snapshot, field_names):
+    # Firestore puts nulls first, and they can't be compared with values
+    values = [snapshot.get(name) for name in field_names]
+    return tuple((0, 0) if value is None else (1, value) for value in values)
+
+
 def raise_detailed_error(request_object):
     try:
         request_object.raise_for_status()
@@ -73,6 +82,12 @@ def raise_detailed_error(request_object):
         raise HTTPError(e, request_object.text)
 
 
+# the most values firestore allows in an in query
+FIRESTORE_IN_LIMIT = 30
+# the most writes firestore allows in a batch
+FIRESTORE_BATCH_LIMIT = 500
+
+
 class FirestoreWrapper(BaseDatabase):
 
     def query_view(self, view_name, **kwargs):
@@ -108,7 +123,7 @@ class FirestoreWrapper(BaseDatabase):
         self.api_key = api_key
         self.namespace = namespace
         self.expires = None
-        self.data_adapter = FirestoreDataAdapter()
+        self.data_adapter = FirestoreDataAdapter(mapper)
 
         # Use a service account
         options = copy.deepcopy(default_options)
@@ -190,10 +205,174 @@ class FirestoreWrapper(BaseDatabase):
         oauth_creds.token = request_object_json["id_token"]
 
 
-    def set_object(self, obj, rev=None):
+    def set_object(self, obj, rev=None, partial=True, existing=None):
+        # partial=False when it may not be in the db so has to be written whole, existing isn't
+        # needed as unique values are checked in their own transaction
+        changed = obj.changed_fields if obj._changed is not None else None
+        if partial and changed and self._same_db(obj._db):
+            # it is already in this db so only send what has changed
+            return self._update_changed(obj, changed)
         return self._set(obj.key, obj._properties)
 
 
+    def _same_db(self, db):
+        return db is self
+
+
+    def put_many(self, objects):
+        if self.read_only:
+            raise Exception("This db is read only")
+        objects = list(objects)
+        results = []
+        for i in range(0, len(objects), FIRESTORE_BATCH_LIMIT):
+            results += self._put_chunk(objects[i:i + FIRESTORE_BATCH_LIMIT])
+        return results
+
+
+    def _put_chunk(self, objects):
+        # imported here as the contexts subclass this wrapper
+        from .firestore_contexts import FirestoreBatchContext
+
+        results = [BulkResult(obj) for obj in objects]
+        to_save = [result for result in results
+                   if not result.obj._unchanged_in(self)]
+        if not to_save:
+            return results
+
+        # one read for all of them to tell the new ones from the updates
+        for result in to_save:
+            self._invalidate(result.obj.key)
+        doc_refs = [self.db.collection(result.obj.type).document(result.obj.key) for result in to_save]
+        existing_docs = {}
+        for snapshot in self._get_all_refs(doc_refs):
+            if snapshot.exists:
+                existing_doc = ResultWrapper.from_couchdb_json(self.value_from_snapshot(snapshot))
+                existing_docs[existing_doc.key] = existing_doc
+
+        batched = []
+        # the results written and whether each is an update
+        written = []
+        batch_db = FirestoreBatchContext(self)
+
+        try:
+            with batch_db:
+                for result in to_save:
+                    obj = result.obj
+                    try:
+                        existing_doc = existing_docs.get(obj.key)
+                        if existing_doc is None:
+                            obj._pre_save_new_cb(self)
+                        else:
+                            existing = GenericObject._from_doc(self, existing_doc.key, existing_doc.rev, existing_doc.value)
+                            obj._check_immutable(existing)
+                            if obj.use_rev and existing.rev != obj.rev:
+                                if not obj.resolve_write_conflict(existing, existing.rev):
+                                    raise FamResourceConflict("bad rev id: %s, rev: %s db_rev: %s" % (obj.key, obj.rev, existing.rev))
+                            obj._pre_save_update_cb(self, existing._properties)
+                        # new ones may have been loaded from here and deleted since so are written whole
+                        partial = existing_doc is not None
+                        if self._has_unique_values(obj):
+                            # these need their own transactions to claim the unique values
+                            self.set_object(obj, partial=partial)
+                        else:
+                            batch_db.set_object(obj, partial=partial)
+                            batched.append(result)
+                        written.append((result, existing_doc is not None))
+                    except Exception as e:
+                        result.error = e
+        except Exception as e:
+            # the batch commit failed so none of it was written
+            for result in batched:
+                result.error = e
+
+        for result, updated in written:
+            obj = result.obj
+            if result.error is None:
+                self._invalidate(obj.key)
+                obj._db = self
+                obj._mark_saved()
+                if updated:
+                    obj._post_save_update_cb(self)
+                else:
+                    obj._post_save_new_cb(self)
+
+        return results
+
+
+    def _has_unique_values(self, obj):
+        return any(field.unique and obj._properties.get(name) is not None for name, field in obj.fields.items())
+
+
+    def delete_many(self, objects, cascade=True):
+        if self.read_only:
+            raise Exception("This db is read only")
+        objects = list(objects)
+        results = []
+        for i in range(0, len(objects), FIRESTORE_BATCH_LIMIT):
+            results += self._delete_chunk(objects[i:i + FIRESTORE_BATCH_LIMIT], cascade)
+        return results
+
+
+    @refresh_check
+    def _delete_chunk(self, objects, cascade):
+
+        results = [BulkResult(obj) for obj in objects]
+        batched = []
+        deleted = []
+        batch = self.db.batch()
+
+        for result in results:
+            obj = result.obj
+            try:
+                obj._pre_delete_cb(self)
+                if any(field.unique for field in obj.fields.values()):
+                    # these have to clear their unique docs in a transaction
+                    self._delete(obj.key, obj.rev, obj.type)
+                else:
+                    batch.delete(self.db.collection(obj.type).document(obj.key))
+                    batched.append(result)
+                deleted.append(result)
+            except Exception as e:
+                result.error = e
+
+        try:
+            batch.commit()
+        except Exception as e:
+            for result in batched:
+                result.error = e
+
+        for result in deleted:
+            if result.error is not None:
+                continue
+            obj = result.obj
+            self._invalidate(obj.key)
+            try:
+                obj._post_delete_cb(self)
+            except Exception as e:
+                result.error = e
+
+        if cascade:
+            self._cascade_many([result for result in deleted if result.error is None])
+
+        return results
+
+
+    def _update_changed(self, obj, changed):
+        values = {}
+        deleted = []
+        for name in changed:
+            if name in obj._properties:
+                values[name] = obj._properties[name]
+            else:
+                deleted.append(name)
+
+        self.update(obj.namespace, obj.type, obj.key, values, deleted=deleted)
+
+        as_json = copy.copy(obj._properties)
+        as_json["_id"] = obj.key
+        return ResultWrapper.from_couchdb_json(as_json)
+
+
     @refresh_check
     def _set(self, key, input_value, rev=None):
 
@@ -217,9 +396,7 @@ class FirestoreWrapper(BaseDatabase):
             #     raise FamValidationError(e)
 
         value["_id"] = key
-        sans_metadata = copy.deepcopy(value)
-        del sans_metadata["type"]
-        del sans_metadata["namespace"]
+        sans_metadata = {k: v for k, v in value.items() if k != TYPE_STR and k != NAMESPACE_STR}
 
         unique_field_names = self._check_for_unique_fields(namespace, type_name, value)
 
@@ -251,6 +428,13 @@ class FirestoreWrapper(BaseDatabase):
     def _get_doc_ref(self, doc_ref):
         return doc_ref.get()
 
+    @catch_permission
+    def _get_all_refs(self, doc_refs):
+        return self._get_all_doc_refs(doc_refs)
+
+    def _get_all_doc_refs(self, doc_refs):
+        return self.db.get_all(doc_refs)
+
     @catch_permission
     def _set_ref(self, doc_ref, value):
         self._set_doc_ref(doc_ref, value)
@@ -294,17 +478,20 @@ class FirestoreWrapper(BaseDatabase):
         return ResultWrapper.from_couchdb_json(as_json)
 
 
-    def value_from_snapshot(self, snapshot):
-        as_json = self.data_adapter.deserialise(snapshot.to_dict())
+    def value_from_snapshot(self, snapshot, decode=True):
+        # lazy objects decode their own values as they are read
+        as_json = snapshot.to_dict()
         # as_json["_id"] = snapshot.reference.id
         as_json["type"] = snapshot.reference.parent.id
         as_json["namespace"] = self.namespace
+        if decode:
+            as_json = self.data_adapter.deserialise(as_json)
         return as_json
 
 
-    def _get_refs_from(self, key, type_name, field_name):
+    def _get_refs_from(self, key, type_name, field_name, op=u'=='):
         type_ref = self.db.collection(type_name)
-        query_ref = type_ref.where(field_name, u'==', key)
+        query_ref = type_ref.where(field_name, op, key)
         snapshots = self._stream_ref(query_ref)
         rows = [ResultWrapper.from_couchdb_json(self.value_from_snapshot(snapshot)) for snapshot in snapshots]
         objs = [GenericObject._from_doc(self, row.key, row.rev, row.value) for row in rows]
@@ -312,21 +499,24 @@ class FirestoreWrapper(BaseDatabase):
 
 
     @refresh_check
-    def get_all_type(self, namespace, type_name):
+    def get_all_type(self, namespace, type_name, compact=False, lazy=False):
         all_sub_class_names = self.mapper.get_all_subclass_names(namespace, type_name)
 
         objs = []
         for type_name in all_sub_class_names:
-            objs += self.get_single_type(namespace, type_name)
+            objs += self.get_single_type(namespace, type_name, compact=compact, lazy=lazy)
         return objs
 
 
     @refresh_check
-    def get_single_type(self, namespace, type_name):
+    def get_single_type(self, namespace, type_name, compact=False, lazy=False):
         type_ref = self.db.collection(type_name)
         snapshots = self._stream_ref(type_ref)
-        rows = [ResultWrapper.from_couchdb_json(self.value_from_snapshot(snapshot)) for snapshot in snapshots]
-        objs = [GenericObject._from_doc(self, row.key, row.rev, row.value) for row in rows]
+        from_doc = GenericObject._from_doc_for(compact, lazy)
+        objs = []
+        for snapshot in snapshots:
+            row = ResultWrapper.from_couchdb_json(self.value_from_snapshot(snapshot, decode=not lazy))
+            objs.append(from_doc(self, row.key, row.rev, row.value))
         return objs
 
 
@@ -339,6 +529,62 @@ class FirestoreWrapper(BaseDatabase):
         return objs
 
 
+    @refresh_check
+    def get_refs_from_many(self, namespace, type_name, name, keys, field):
+        all_sub_class_names = self.mapper.get_all_subclass_names(namespace, field.refcls)
+        keys = list(keys)
+        objs = []
+        for class_name in all_sub_class_names:
+            for i in range(0, len(keys), FIRESTORE_IN_LIMIT):
+                objs += self._get_refs_from(keys[i:i + FIRESTORE_IN_LIMIT], class_name, field.fkey, op=u'in')
+        return objs
+
+
+    @refresh_check
+    def _get_many(self, keys, class_name=None):
+        doc_refs = [self.db.collection(self._work_out_class(key, class_name)).document(key) for key in keys]
+        results = {}
+        for snapshot in self._get_all_refs(doc_refs):
+            if snapshot.exists:
+                result = ResultWrapper.from_couchdb_json(self.value_from_snapshot(snapshot))
+                results[result.key] = result
+        return results
+
+
+    @refresh_check
+    def count_refs_from(self, namespace, type_name, name, key, field):
+        all_sub_class_names = self.mapper.get_all_subclass_names(namespace, field.refcls)
+        return sum(self._count_where(class_name, field.fkey, u'==', key) for class_name in all_sub_class_names)
+
+
+    @refresh_check
+    def count_with_value(self, namespace, type_name, field_name, value):
+        return self._count_where(type_name, field_name, u'==', value)
+
+
+    @refresh_check
+    def aggregate(self, namespace, type_name, field_name):
+        # firestore aggregation only does count and sum
+        count = 0
+        total = 0
+        for class_name in self.mapper.get_all_subclass_names(namespace, type_name):
+            query = self.db.collection(class_name).where(field_name, u'>=', float("-inf"))
+            aggregate_query = aggregation.AggregationQuery(query)
+            aggregate_query.count(alias="count")
+            aggregate_query.sum(field_name, alias="sum")
+            for result in aggregate_query.get():
+                for value in result:
+                    if value.alias == "count":
+                        count += value.value
+                    else:
+                        total += value.value
+        return {"sum": total, "count": count}
+
+
+    def _count_where(self, type_name, field_name, op, value):
+        return self.query_count(self.db.collection(type_name).where(field_name, op, value)) or 0
+
+
     @refresh_check
     def get_with_value(self, namespace, type_name, field_name, value):
         return self._get_refs_from(value, type_name, field_name)
@@ -374,20 +620,21 @@ class FirestoreWrapper(BaseDatabase):
         coll_ref = self.db.collection(type_name)
         self._delete_collection(coll_ref, 10)
 
-    def _query_items_simple(self, firebase_query):
+    def _query_items_simple(self, firebase_query, compact=False, lazy=False):
+        from_doc = GenericObject._from_doc_for(compact, lazy)
         snapshots = self._stream_ref(firebase_query)
         results = []
         for snapshot in snapshots:
-            wrapper = ResultWrapper.from_couchdb_json(self.value_from_snapshot(snapshot))
-            results.append(GenericObject.from_row(self, wrapper))
+            wrapper = ResultWrapper.from_couchdb_json(self.value_from_snapshot(snapshot, decode=not lazy))
+            results.append(from_doc(self, wrapper.key, wrapper.rev, wrapper.value))
         return results
 
 
-    def query_items(self, firebase_query, batch_size=None, order_by=u'_id'):
+    def query_items(self, firebase_query, batch_size=None, order_by=u'_id', compact=False, lazy=False):
         if batch_size is not None:
-            return self.query_items_iterator(firebase_query, batch_size=batch_size, order_by=order_by)
+            return self.query_items_iterator(firebase_query, batch_size=batch_size, order_by=order_by, compact=compact, lazy=lazy)
         else:
-            return self._query_items_simple(firebase_query)
+            return self._query_items_simple(firebase_query, compact=compact, lazy=lazy)
 
     def query_count(self, firebase_query):
         aggregate_query = aggregation.AggregationQuery(firebase_query)
@@ -399,6 +646,59 @@ class FirestoreWrapper(BaseDatabase):
         for result in results:
             return result[0].value
 
+    def run_query(self, query):
+        # a query for each collection of the class and its sub classes, merged if they are ordered
+        from_doc = GenericObject._from_doc_for(query.compact, query.lazy)
+        streams = [self._stream_ref(firebase_query) for firebase_query in self._firestore_queries(query).values()]
+        if len(streams) == 1:
+            snapshots = streams[0]
+        elif query.ordering:
+            directions = set(descending for field_name, descending in query.ordering)
+            if len(directions) > 1:
+                raise FamError("Queries on sub classes can only be ordered in one direction")
+            field_names = [field_name for field_name, descending in query.ordering]
+            snapshots = heapq.merge(*streams, key=lambda snapshot: _order_key(snapshot, field_names),
+                                    reverse=directions.pop())
+        else:
+            snapshots = itertools.chain(*streams)
+        if query.max_results is not None:
+            snapshots = itertools.islice(snapshots, query.max_results)
+
+        for snapshot in snapshots:
+            wrapper = ResultWrapper.from_couchdb_json(self.value_from_snapshot(snapshot, decode=not query.lazy))
+            yield from_doc(self, wrapper.key, wrapper.rev, wrapper.value)
+
+
+    def create_query_index(self, cls, field_names):
+        # Firestore's composite indexes are made in its console or with the cli, it says which when a query needs one
+        return None
+
+
+    def explain_query(self, query):
+        # the indexes each collection's query would use
+        plans = {}
+        for class_name, firebase_query in self._firestore_queries(query).items():
+            results = firebase_query.get(explain_options=ExplainOptions(analyze=False))
+            plans[class_name] = results.get_explain_metrics().plan_summary.indexes_used
+        return plans
+
+
+    def _firestore_queries(self, query):
+        conditions = query.encoded_conditions(self.data_adapter)
+        queries = {}
+        for class_name in sorted(self.mapper.get_all_subclass_names(query.cls.namespace, query.cls.type)):
+            firebase_query = self.db.collection(class_name)
+            for field_name, op, value in conditions:
+                firebase_query = firebase_query.where(field_name, op, value)
+            for field_name, descending in query.ordering:
+                direction = firestore.Query.DESCENDING if descending else firestore.Query.ASCENDING
+                firebase_query = firebase_query.order_by(field_name, direction=direction)
+            if query.max_results is not None:
+                firebase_query = firebase_query.limit(query.max_results)
+            queries[class_name] = firebase_query
+        return queries
+
+
     def get_page_items(self, firebase_query, offset, limit, order_by=u'_id', descending=False):
         direction = firestore.Query.DESCENDING if descending else firestore.Query.ASCENDING
         query = firebase_query.order_by(order_by, direction=direction).offset(offset).limit(limit)
@@ -408,12 +708,12 @@ class FirestoreWrapper(BaseDatabase):
         return self.query_snapshots_iterator(firebase_query, batch_size=batch_size)
 
 
-    def query_items_iterator(self, firebase_query, batch_size, order_by=u'_id'):
+    def query_items_iterator(self, firebase_query, batch_size, order_by=u'_id', compact=False, lazy=False):
 
+        from_doc = GenericObject._from_doc_for(compact, lazy)
         for snapshot in self.query_snapshots_iterator(firebase_query, batch_size=batch_size, order_by=order_by):
-            wrapper = ResultWrapper.from_couchdb_json(self.value_from_snapshot(snapshot))
-            obj = GenericObject.from_row(self, wrapper)
-            yield obj
+            wrapper = ResultWrapper.from_couchdb_json(self.value_from_snapshot(snapshot, decode=not lazy))
+            yield from_doc(self, wrapper.key, wrapper.rev, wrapper.value)
 
 
     def query_snapshots_iterator(self, firebase_query, batch_size, order_by=u'_id'):
@@ -436,14 +736,18 @@ class FirestoreWrapper(BaseDatabase):
 
 
     @refresh_check
-    def update(self, namespace, type_name, key, input_value):
+    def update(self, namespace, type_name, key, input_value, deleted=None):
 
         if self.read_only:
             raise Exception("This db is read only")
 
-        values = self.data_adapter.serialise(input_value)
+        values = self.data_adapter.serialise(input_value, self.mapper.get_class(type_name, namespace))
         unique_field_names = self._check_for_unique_fields(namespace, type_name, values)
 
+        if deleted:
+            for name in deleted:
+                values[name] = firestore.DELETE_FIELD
+
         if unique_field_names:
             transaction = self.db.transaction()
             update_with_unique_fields(transaction, self.db, type_name, key, values, unique_field_names)
@@ -59,4 +59,20 @@ class FirestoreDataAdapter(BaseDataAdapter):
         if node is None:
             return node
 
-        raise Exception("FirestoreDataAdapter can't deserialise this value: %s" % node)
\ No newline at end of file
+        raise Exception("FirestoreDataAdapter can't deserialise this value: %s" % node)
+
+
+    def decode_date_time(self, value):
+        if isinstance(value, datetime.datetime):
+            return value
+        return self.deserialise_value(value)
+
+    def decode_lat_long(self, value):
+        if isinstance(value, GeoPoint):
+            return LatLong(latitude=value.latitude, longitude=value.longitude)
+        return self.deserialise_value(value)
+
+    def decode_bytes(self, value):
+        if isinstance(value, bytes):
+            return value
+        return self.deserialise_value(value)
@@ -23,10 +23,14 @@ class FirestoreBatchContext(FirestoreWrapper):
         self.app = wrapper.app
         self.user = wrapper.user
         self.expires = wrapper.expires
+        self.identity_map = wrapper.identity_map
 
     def _get_batch(self, client):
         return client.batch()
 
+    def _same_db(self, db):
+        return db is self or db is self.wrapper
+
     def _set_doc_ref(self, doc_ref, value):
         self.batch.set(doc_ref, value)
 
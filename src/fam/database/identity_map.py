@@ -0,0 +1,44 @@
+
+
+class IdentityMap(object):
+    """
+    Keeps one python object per document key for the life of a db session so repeated
+    gets and reference lookups don't go back to the database.
+
+    Entries are matched on key, and on rev too when the caller knows it, and are dropped
+    when the object is saved, updated or deleted through fam.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key, rev=None):
+        obj = self.objects.get(key)
+        if obj is None:
+            return None
+        if rev is not None and obj.rev != rev:
+            return None
+        self.hits += 1
+        return obj
+
+    def add(self, obj):
+        self.misses += 1
+        self.objects[obj.key] = obj
+
+    def invalidate(self, key):
+        self.objects.pop(key, None)
+
+    def clear(self):
+        self.objects.clear()
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __contains__(self, key):
+        return key in self.objects
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.objects)}
@@ -0,0 +1,161 @@
+"""
+Incremental parsing of the big json responses CouchDB sends for views and changes.
+
+They are an object with one long array in it, rows for views and results for changes, so
+the items of that array are decoded and yielded one at a time as the bytes arrive rather
+than holding the whole body, the parsed tree and all the objects at once. Everything
+else in the object, like total_rows or last_seq, is put in a dict once it has been read.
+"""
+
+import re
+import json
+import codecs
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = " \t\n\r"
+_decoder = json.JSONDecoder()
+# what can follow an item in the array
+_ITEM_END = _WHITESPACE + ",]"
+_SCALAR_END = re.compile(r'[\s,\]]')
+_STRUCTURAL = re.compile(r'["\\{}\[\]]')
+_INCOMPLETE = object()
+
+
+def iter_array_items(chunks, array_name, meta=None):
+    # chunks is an iterable of bytes, meta if given gets the other top level values
+    text = _iter_text(chunks)
+    start = re.compile(r'"%s"\s*:\s*\[' % re.escape(array_name))
+
+    buffer = ""
+    match = None
+    for piece in text:
+        buffer += piece
+        match = start.search(buffer)
+        if match is not None:
+            break
+    if match is None:
+        raise ValueError("No %s array in the response" % array_name)
+
+    head = buffer[:match.start()]
+    pos = match.end()
+
+    while True:
+        # skip to the next item or the end of the array
+        while True:
+            while pos < len(buffer) and (buffer[pos] in _WHITESPACE or buffer[pos] == ","):
+                pos += 1
+            if pos < len(buffer):
+                break
+            buffer = ""
+            pos = 0
+            piece = next(text, None)
+            if piece is None:
+                raise ValueError("The response ended in the middle of the %s array" % array_name)
+            buffer = piece
+
+        if buffer[pos] == "]":
+            pos += 1
+            break
+
+        try:
+            item, end = _decoder.raw_decode(buffer, pos)
+        except ValueError:
+            item = _INCOMPLETE
+        else:
+            # a number split at a chunk boundary decodes as the part before it, ie 12 from 12.5
+            if end == len(buffer) or buffer[end] not in _ITEM_END:
+                item = _INCOMPLETE
+
+        if item is _INCOMPLETE:
+            # not all here yet, read on until it must be and decode it just the once more
+            buffer = _read_item(text, buffer[pos:])
+            pos = 0
+            item, end = _decoder.raw_decode(buffer, pos)
+
+        yield item
+        pos = end
+        if pos > STREAM_CHUNK_SIZE:
+            buffer = buffer[pos:]
+            pos = 0
+
+    if meta is not None:
+        tail = buffer[pos:] + "".join(text)
+        meta.update(_parse_rest(head, tail))
+
+
+def _read_item(text, buffer):
+    # adds pieces to the buffer, which starts with an item, until the end of the item is in it.
+    # each piece is only scanned once so a big item doesn't get parsed over and over
+    pieces = [buffer]
+    if buffer[0] in "{[\"":
+        state = [0, 0, False]
+        ended = _scan_nested(buffer, state)
+        while not ended:
+            piece = next(text, None)
+            if piece is None:
+                break
+            pieces.append(piece)
+            ended = _scan_nested(piece, state)
+    else:
+        # a number, true, false or null ends at whatever comes after it
+        ended = _SCALAR_END.search(buffer) is not None
+        while not ended:
+            piece = next(text, None)
+            if piece is None:
+                break
+            pieces.append(piece)
+            ended = _SCALAR_END.search(piece) is not None
+    return "".join(pieces)
+
+
+def _scan_nested(piece, state):
+    # whether an object, array or string ends in this piece. state is how many characters
+    # to skip at the start after an escape, how deeply nested it is and whether it is in a string
+    pos, depth, in_string = state
+    while True:
+        match = _STRUCTURAL.search(piece, pos)
+        if match is None:
+            state[:] = [max(0, pos - len(piece)), depth, in_string]
+            return False
+        c = match.group()
+        pos = match.end()
+        if in_string:
+            if c == "\\":
+                pos += 1
+            elif c == '"':
+                in_string = False
+                if depth == 0:
+                    return True
+        elif c == '"':
+            in_string = True
+        elif c in "{[":
+            depth += 1
+        elif c in "}]":
+            depth -= 1
+            if depth == 0:
+                return True
+
+
+def _iter_text(chunks):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        if chunk:
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+def _parse_rest(head, tail):
+    # head is like {"total_rows":3,"offset":0, and tail like ,"last_seq":"5-abc"}
+    values = {}
+    head = head.strip().rstrip(",")
+    if head and head != "{":
+        values.update(json.loads(head + "}"))
+    tail = tail.strip().lstrip(",").strip()
+    if tail and tail != "}":
+        values.update(json.loads("{" + tail))
+    return values
@@ -20,6 +20,6 @@ class NullDatabase(BaseDatabase):
     def delete_key(self, key):
         pass
 
-    def query_view(self, view_name, **kwargs):
+    def query_view(self, view_name, compact=False, lazy=False, **kwargs):
         return []
 
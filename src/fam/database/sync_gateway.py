@@ -1,26 +1,45 @@
-import simplejson as json
 import hashlib
 import copy
-from fam.fam_json import object_default
+from fam.fam_json import get_json_backend
 
 from base64 import b64encode
 
 
-from fam.utils import requests_shim as requests
+from fam.exceptions import FamError
+
+from .couchdb import CouchDBWrapper, ResultWrapper, VIEW_UPDATE_POLICIES
+from .couchdb_adapter import CouchDBDataAdapter
+
+# the Couchbase stale option for each view update policy
+STALE_FOR_UPDATE = {"true": "false", "lazy": "update_after", "false": "ok"}
 
-from .couchdb import CouchDBWrapper, ResultWrapper
 
 class SyncGatewayWrapper(CouchDBWrapper):
 
     ## the option stale=false forces the view to be indexed on read. Sync_gateway does not index on write!!
     # VIEW_URL = "%s/%s/_design/%s/_view/%s?stale=false&key=\"%s\""
 
-    # this function is different from the base version in that it adds the rev from the meta into the doc
+    # this function is different from the base version in that it takes the rev from the meta, and emits it like the base one
     FOREIGN_KEY_MAP_STRING = '''function(doc, meta) {
     var resources = %s;
     if (resources.indexOf(doc.type) != -1 && doc.namespace == \"%s\"){
         doc._rev = meta.rev;
-        emit(doc.%s, null);
+        emit(doc.%s, meta.rev);
+    }
+}'''
+
+    AGGREGATE_MAP_STRING = '''function(doc, meta) {
+    var resources = %s;
+    if (resources.indexOf(doc.type) != -1 && doc.namespace == \"%s\" && typeof doc.%s == \"number\"){
+        emit(doc.type, doc.%s);
+    }
+}'''
+
+    PROJECTION_MAP_STRING = '''function(doc, meta) {
+    var resources = %s;
+    if (resources.indexOf(doc.type) != -1 && doc.namespace == \"%s\"){
+        doc._rev = meta.rev;
+        emit(doc.type, {%s});
     }
 }'''
 
@@ -32,19 +51,31 @@ class SyncGatewayWrapper(CouchDBWrapper):
                  username=None,
                  password=None,
                  validator=None,
-                 read_only=False):
+                 read_only=False,
+                 optimistic_save=False,
+                 json_backend=None,
+                 thread_safe=False,
+                 pool_connections=10,
+                 pool_maxsize=10,
+                 pool_block=False,
+                 keep_alive=True,
+                 connect_timeout=None,
+                 read_timeout=None):
 
 
         self.mapper = mapper
         self.validator = validator
         self.read_only = read_only
+        self.optimistic_save = optimistic_save
 
         self.db_name = db_name
         self.db_url = db_url
         self.username = username
         self.password = password
         self.auth_url = auth_url
-        self.session = requests.Session()
+        self._init_session(thread_safe, pool_connections, pool_maxsize, pool_block, keep_alive, connect_timeout, read_timeout)
+        self.data_adapter = CouchDBDataAdapter(mapper)
+        self.json = get_json_backend(json_backend)
 
         url = "%s/%s" % (db_url, db_name)
         rsp = self.session.get(url)
@@ -71,6 +102,8 @@ class SyncGatewayWrapper(CouchDBWrapper):
     def _wrapper_from_view_json(self, as_json):
         return ResultWrapper.from_gateway_view_json(as_json)
 
+    _raw_wrapper_from_view_json = _wrapper_from_view_json
+
 
     # def changes(self, since=None, channels=None, limit=None):
     #     raise NotImplementedError("Haven't done changes for sync gateway yet")
@@ -92,7 +125,7 @@ class SyncGatewayWrapper(CouchDBWrapper):
             key: ["*"]
         }
 
-        rsp = self.session.post("%s/%s/_purge" % (self.db_url, self.db_name), data=json.dumps(data))
+        rsp = self.session.post("%s/%s/_purge" % (self.db_url, self.db_name), data=self.json.encode(data))
 
         if rsp.status_code == 200 or rsp.status_code == 202:
             return
@@ -102,7 +135,7 @@ class SyncGatewayWrapper(CouchDBWrapper):
         url = "%s/%s/_user/%s" % (self.db_url, self.db_name, username)
         rsp = self.session.get(url)
         if rsp.status_code == 200:
-            return rsp.json()
+            return self.json.loads(rsp.content)
         else:
             return None
 
@@ -110,7 +143,7 @@ class SyncGatewayWrapper(CouchDBWrapper):
         url = "%s/%s/_role/%s" % (self.db_url, self.db_name, role_name)
         rsp = self.session.get(url)
         if rsp.status_code == 200:
-            return rsp.json()
+            return self.json.loads(rsp.content)
         else:
             return None
 
@@ -126,7 +159,7 @@ class SyncGatewayWrapper(CouchDBWrapper):
 
             url = "%s/%s/_role/%s" % (self.db_url, self.db_name, role_name)
 
-            rsp = self.session.put(url, data=json.dumps(data, indent=4, sort_keys=True, default=object_default),
+            rsp = self.session.put(url, data=self.json.encode(data),
                                    headers={"Content-Type": "application/json", "Accept": "application/json"})
             if rsp.status_code == 200 or rsp.status_code == 201:
                return True
@@ -146,7 +179,7 @@ class SyncGatewayWrapper(CouchDBWrapper):
 
             url = "%s/%s/_user/%s" % (self.db_url, self.db_name, username)
 
-            rsp = self.session.put(url, data=json.dumps(user_info, indent=4, sort_keys=True, default=object_default),
+            rsp = self.session.put(url, data=self.json.encode(user_info),
                                    headers={"Content-Type": "application/json", "Accept": "application/json"})
             if rsp.status_code == 200 or rsp.status_code == 201:
                return True
@@ -156,8 +189,13 @@ class SyncGatewayWrapper(CouchDBWrapper):
             return True
 
 
-    def view(self, name, **kwargs):
-        return super(SyncGatewayWrapper, self).view(name, stale="false", **kwargs)
+    def _set_view_update(self, update, params):
+        # the gateway doesn't index on write so by default it has to on read, with stale=false
+        if update is None:
+            update = "true"
+        if update not in VIEW_UPDATE_POLICIES:
+            raise FamError("view update should be one of %s not %s" % (", ".join(VIEW_UPDATE_POLICIES), update))
+        params["stale"] = STALE_FOR_UPDATE[update]
 
     # @auth
     def get_design(self, key):
@@ -167,7 +205,7 @@ class SyncGatewayWrapper(CouchDBWrapper):
         rsp = self.session.get(url)
 
         if rsp.status_code == 200:
-            return rsp.json()
+            return self.json.loads(rsp.content)
         if rsp.status_code == 500:
             return None
         if rsp.status_code == 400:
@@ -199,8 +237,36 @@ class SyncGatewayWrapper(CouchDBWrapper):
         return True
 
 
-    def ensure_design_doc(self, key, doc):
+    def update_designs(self, warm=False):
+        # the gateway's design docs aren't in _all_docs so they are checked one at a time
+        updated = [doc["_id"] for doc in self._design_docs() if self.ensure_design_doc(doc["_id"], doc)]
+        if warm and updated:
+            self.warm_views(updated)
+        return updated
+
+
+    def warm_views(self, keys=None):
+        # stale=update_after returns straight away and builds the index after
+        if keys is None:
+            keys = [doc["_id"] for doc in self._design_docs()]
+        for key in keys:
+            doc = self.get_design(key)
+            views = doc.get("views") if doc is not None else None
+            if views:
+                view_name = sorted(views)[0]
+                url = self.VIEW_URL % (self.db_url, self.db_name, key[len("_design/"):], view_name)
+                params = {"limit": 0, "stale": "update_after"}
+                if "reduce" in views[view_name]:
+                    params["reduce"] = "false"
+                self.session.get(url, params=params)
+
 
+    def index_progress(self):
+        raise FamError("Sync Gateway doesn't report how far its indexes have been built")
+
+
+    def ensure_design_doc(self, key, doc):
+        # returns whether it was written
         if self.read_only:
             raise Exception("This db is read only")
 
@@ -209,8 +275,10 @@ class SyncGatewayWrapper(CouchDBWrapper):
         if existing is None or not self._new_matches_existing(doc, existing):
             print("************  updating design doc %s ************" % key)
             self._set(key, doc, backoff=True)
+            return True
         else:
             print("************  design doc %s up to date **********" % key)
+            return False
 
 
     def _raw_design_doc(self):
@@ -220,7 +288,7 @@ class SyncGatewayWrapper(CouchDBWrapper):
                 "all": {
                     "map": """function(doc, meta) {
                         doc._rev = meta.rev;
-                        emit(doc.type, null);
+                        emit(doc.type, meta.rev);
                     }
                     """
                 }
@@ -0,0 +1,68 @@
+"""
+Keeps views' indexes up to date in the background so that queries with update="false" or
+"lazy" answer straight away from an index at most about one interval behind.
+"""
+
+import threading
+import time
+
+
+class ViewRefresher(object):
+    """
+    Every interval seconds brings each of the views up to date with a query that waits for
+    its index, one view per design doc is enough as they are indexed together. Before each
+    refresh it records how many changes behind the index was in lags, by view name.
+    Use it as a context manager or call start and stop.
+    """
+
+    def __init__(self, db, views, interval=5.0):
+        self.db = db
+        self.views = list(views)
+        self.interval = interval
+        self.lags = {}
+        self.errors = 0
+        self._stopping = threading.Event()
+        self._thread = None
+
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="fam-view-refresher")
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+    def refresh(self):
+        for name in self.views:
+            try:
+                self.lags[name] = self.db.view_lag(name)
+                self.db.view(name, raw=True, limit=0, update="true")
+            except Exception:
+                # a server that's down now may not be later, keep going
+                self.errors += 1
+
+
+    def _run(self):
+        while not self._stopping.is_set():
+            started = time.monotonic()
+            self.refresh()
+            self._stopping.wait(max(0.0, self.interval - (time.monotonic() - started)))
@@ -4,6 +4,9 @@ class FamDbConnectionException(Exception):
 class FamResourceConflict(Exception):
     pass
 
+class FamRevisionConflict(FamResourceConflict):
+    pass
+
 class FamViewError(Exception):
     pass
 
@@ -1,11 +1,96 @@
 
 
+import json as stdlib_json
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
 def object_default(o):
     if hasattr(o, "to_json"):
         return o.to_json()
     raise TypeError(repr(o) + " is not JSON serializable")
 
 
+class JsonBackend(object):
+    """
+    Encodes what is sent to the db and decodes what comes back.
+
+    encode gives compact output for the wire, dumps with pretty=True gives the indented and sorted
+    form for people to read. This one uses simplejson if it is installed, which also knows about
+    Decimals, and the stdlib json if not.
+    """
+
+    name = "json"
+
+    def __init__(self):
+        self.json = simplejson if simplejson is not None else stdlib_json
+
+    # a str or bytes body ready to send
+    def encode(self, value, default=object_default):
+        return self.json.dumps(value, separators=(",", ":"), default=default)
+
+    def dumps(self, value, default=object_default, pretty=False):
+        if pretty:
+            return self.json.dumps(value, sort_keys=True, indent=4, default=default, separators=(",", ": "))
+        return self.json.dumps(value, separators=(",", ":"), default=default)
+
+    def loads(self, data):
+        return self.json.loads(data)
+
+
+class OrjsonBackend(JsonBackend):
+    """Uses orjson where it can, anything it won't do, like ints over 64 bits, goes to JsonBackend"""
+
+    name = "orjson"
+
+    def encode(self, value, default=object_default):
+        try:
+            return orjson.dumps(value, default=default)
+        except TypeError:
+            return super(OrjsonBackend, self).encode(value, default=default)
+
+    def dumps(self, value, default=object_default, pretty=False):
+        if pretty:
+            # orjson only indents by 2 so leave the readable form as it was
+            return super(OrjsonBackend, self).dumps(value, default=default, pretty=True)
+        encoded = self.encode(value, default=default)
+        return encoded.decode("utf-8") if isinstance(encoded, bytes) else encoded
+
+    def loads(self, data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return super(OrjsonBackend, self).loads(data)
+
+
+JSON_BACKENDS = {
+    JsonBackend.name: JsonBackend,
+    OrjsonBackend.name: OrjsonBackend
+}
+
+
+def get_json_backend(backend=None):
+    # takes a backend, the name of one or None for the fastest one installed
+    if backend is None:
+        backend = OrjsonBackend.name if orjson is not None else JsonBackend.name
+    if isinstance(backend, str):
+        if backend == OrjsonBackend.name and orjson is None:
+            raise ImportError("orjson isn't installed")
+        return JSON_BACKENDS[backend]()
+    return backend
+
+
+default_json = get_json_backend()
+
+
 # class PatchedJson(object):
 #     import simplejson as json
 #
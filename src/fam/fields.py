@@ -143,6 +143,13 @@ class BytesField(Field):
     else:
         _types = [bytes, bytearray, str]
 
+    def __init__(self, required=False, immutable=False, default=None, unique=False, attachment=False):
+        # with attachment=True CouchDB keeps the value as an attachment rather than in the doc
+        if unique and attachment:
+            raise FamError("An attachment isn't in the doc so it can't be unique")
+        self.attachment = attachment
+        super(BytesField, self).__init__(required=required, immutable=immutable, default=default, unique=unique)
+
     def get_default(self):
         return self.default.copy()
 
@@ -12,7 +12,7 @@ VIEW_FUNCTION_NAMES = ["map", "reduce"]
 
 class ClassMapper(object):
 
-    def __init__(self, classes, modules=None, designs=None):
+    def __init__(self, classes, modules=None, designs=None, counts=False, unique_views=True):
 
         input_modules = modules if modules else []
 
@@ -26,6 +26,10 @@ class ClassMapper(object):
         self._work_out_sub_classes()
         self.design_js_paths = designs if designs is not None else []
         self._buffer_views = None
+        # puts a _count reduce on the reference and unique views so they can be counted without reading them
+        self.counts = counts
+        # a CouchDB using unique_reservations doesn't need the views on unique fields
+        self.unique_views = unique_views
 
 
     # def extra_design_docs(self):
@@ -159,20 +163,32 @@ class ClassMapper(object):
 
 
 
-    def get_design(self, namespace, namespace_name, foreign_key_str):
+    def get_design(self, namespace, namespace_name, foreign_key_str, projection_str=None, aggregate_str=None):
 
         views = {}
         for type_name, cls in namespace.items():
+            if cls.projected_fields and projection_str is not None:
+                views["%s_projection" % type_name] = {"map": self._get_projection_map(type_name, namespace_name, cls.projected_fields, projection_str)}
+
+            if cls.aggregated_fields and aggregate_str is not None:
+                for field_name in cls.aggregated_fields:
+                    views["%s_%s_stats" % (type_name, field_name)] = {"map": self._get_aggregate_map(type_name, namespace_name, field_name, aggregate_str),
+                                                                       "reduce": "_stats"}
+
             for field_name, field in cls.cls_fields.items():
                 if isinstance(field, ReferenceFrom):
                     view_key = "%s_%s" % (type_name, field_name)
                     # if view_key in ["person_dogs", "person_animals"]:
                     views[view_key] = {"map" : self._get_fk_map(field.refcls, field.refns, field.fkey, foreign_key_str)}
+                    if self.counts:
+                        views[view_key]["reduce"] = "_count"
 
-                if field.unique:
+                if field.unique and self.unique_views:
                     view_key = "%s_%s" % (type_name, field_name)
                     # if view_key in ["person_dogs", "person_animals"]:
                     views[view_key] = {"map": self._get_fk_map(type_name, namespace_name, field_name, foreign_key_str)}
+                    if self.counts:
+                        views[view_key]["reduce"] = "_count"
 
         design = {
            "views": views
@@ -197,6 +213,23 @@ class ClassMapper(object):
 
 
 
+    def _get_projection_map(self, class_name, namespace, field_names, projection_str):
+
+        all_sub_class_names = self.get_all_subclass_names(namespace, class_name)
+
+        arrayStr = '["%s"]' % '", "'.join(all_sub_class_names)
+        valuesStr = ", ".join(['"_rev": doc._rev'] + ['"%s": doc.%s' % (name, name) for name in field_names])
+        return projection_str % (arrayStr, namespace, valuesStr)
+
+
+    def _get_aggregate_map(self, class_name, namespace, field_name, aggregate_str):
+
+        all_sub_class_names = self.get_all_subclass_names(namespace, class_name)
+
+        arrayStr = '["%s"]' % '", "'.join(all_sub_class_names)
+        return aggregate_str % (arrayStr, namespace, field_name, field_name)
+
+
     def _get_fk_map(self, class_name, namespace, ref_to_field_name, foreign_key_str):
 
         all_sub_class_names = self.get_all_subclass_names(namespace, class_name)
@@ -0,0 +1,106 @@
+"""
+A query on one class and its sub classes that works the same on CouchDB and Firestore.
+
+It is built up with where, order_by and limit, checking the field names against the class's
+fields, and the database compiles it when it is run. CouchDB makes it a _find selector and
+Firestore a query on each collection. Iterating over it gives the objects a page at a time.
+"""
+
+from .fields import ReferenceFrom
+from .exceptions import FamError
+
+
+OPERATORS = ("==", "!=", "<", "<=", ">", ">=", "in", "not-in", "array-contains", "array-contains-any")
+LIST_OPERATORS = ("in", "not-in", "array-contains-any")
+
+
+class Query(object):
+
+    def __init__(self, cls, db, compact=False, lazy=False):
+        self.cls = cls
+        self.db = db
+        self.compact = compact
+        self.lazy = lazy
+        # (field name, operator, value)
+        self.conditions = []
+        # (field name, descending)
+        self.ordering = []
+        self.max_results = None
+        self.index = None
+
+
+    def where(self, field_name, op, value):
+        self._check_field(field_name)
+        if op not in OPERATORS:
+            raise FamError("%s isn't a query operator, use one of %s" % (op, ", ".join(OPERATORS)))
+        if op in LIST_OPERATORS and not isinstance(value, (list, tuple)):
+            raise FamError("%s needs a list of values" % op)
+        self.conditions.append((field_name, op, value))
+        return self
+
+
+    def order_by(self, field_name, descending=False):
+        self._check_field(field_name)
+        self.ordering.append((field_name, descending))
+        return self
+
+
+    def limit(self, count):
+        self.max_results = count
+        return self
+
+
+    def use_index(self, index):
+        # a design doc name or [design doc, index name] for CouchDB to use, Firestore picks its own
+        self.index = index
+        return self
+
+
+    def ensure_index(self):
+        # makes the index the backend needs to order by the order_by fields and uses it
+        index = self.db.create_query_index(self.cls, [field_name for field_name, descending in self.ordering])
+        if index is not None:
+            self.index = index
+        return self
+
+
+    def _check_field(self, field_name):
+        field = self.cls.fields.get(field_name)
+        if field is None or isinstance(field, ReferenceFrom):
+            raise FamError("%s has no field %s to query" % (self.cls.__name__, field_name))
+
+
+    def encoded_conditions(self, data_adapter):
+        # the conditions with their values encoded as they are in the db
+        codec = data_adapter.codec_for(self.cls)
+        encoded = []
+        for field_name, op, value in self.conditions:
+            if op in ("array-contains", "array-contains-any"):
+                encode = data_adapter._serialise_value
+            else:
+                encode = codec.encoders.get(field_name, data_adapter._serialise_value)
+            if op in LIST_OPERATORS:
+                value = [None if v is None else encode(v) for v in value]
+            elif value is not None:
+                value = encode(value)
+            encoded.append((field_name, op, value))
+        return encoded
+
+
+    def __iter__(self):
+        return iter(self.db.run_query(self))
+
+
+    def all(self):
+        return list(self)
+
+
+    def first(self):
+        for obj in self.db.run_query(self):
+            return obj
+        return None
+
+
+    def explain(self):
+        # the backend's plan for the query
+        return self.db.explain_query(self)
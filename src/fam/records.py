@@ -0,0 +1,125 @@
+"""
+Compact read only representations of fam objects for bulk loads.
+
+Each fam class gets a record class with __slots__ generated from its fields so a loaded
+row costs a handful of pointers rather than an object, its __dict__ and a _properties dict.
+Records have no db and can't resolve references, use to_object to get a full FamObject.
+"""
+
+import sys
+
+from .constants import *
+from .exceptions import FamError
+from .fields import ReferenceFrom, ReferenceTo
+
+
+_record_classes = {}
+RECORD_RESERVED_NAMES = frozenset(("type", "namespace", "key", "rev", "extra"))
+
+
+class FamRecord(object):
+
+    __slots__ = ("key", "rev", "extra")
+
+    fam_class = None
+    type = None
+    namespace = None
+    _field_names = ()
+    _ref_to_names = ()
+    _coercers = ()
+
+    def __init__(self, key, rev, doc):
+        self.key = key
+        self.rev = rev
+        for name in self._field_names:
+            setattr(self, name, doc.pop(name, None))
+        for name in self._ref_to_names:
+            value = getattr(self, name)
+            if value is not None:
+                setattr(self, name, sys.intern(value))
+        for name, coerce in self._coercers:
+            value = getattr(self, name)
+            if value is not None:
+                setattr(self, name, coerce(value))
+        doc.pop(TYPE_STR, None)
+        doc.pop(NAMESPACE_STR, None)
+        doc.pop("_id", None)
+        doc.pop("_rev", None)
+        # anything left over is additional properties or metadata like schema
+        self.extra = doc if doc else None
+
+
+    @property
+    def properties(self):
+        props = {}
+        for name in self._field_names:
+            value = getattr(self, name)
+            if value is not None:
+                props[name] = value
+        if self.extra is not None:
+            props.update(self.extra)
+        return props
+
+
+    def as_dict(self):
+        d = self.properties
+        d[NAMESPACE_STR] = self.namespace
+        d[TYPE_STR] = self.type
+        d["_id"] = self.key
+        if self.rev is not None:
+            d["_rev"] = self.rev
+        return d
+
+
+    def to_object(self, db=None):
+        props = self.properties
+        props[NAMESPACE_STR] = self.namespace
+        props[TYPE_STR] = self.type
+        obj = self.fam_class(key=self.key, rev=self.rev, **props)
+        obj._db = db
+        obj._changed = set()
+        return obj
+
+
+    def __eq__(self, other):
+        if not isinstance(other, FamRecord):
+            return False
+        return self.key == other.key and self.rev == other.rev and self.type == other.type and \
+               self.properties == other.properties
+
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.key)
+
+
+def record_class_for(cls):
+    record_cls = _record_classes.get(cls)
+    if record_cls is not None:
+        return record_cls
+
+    field_names = tuple(name for name, field in cls.fields.items() if not isinstance(field, ReferenceFrom))
+    # these are already taken on a record so a field with one of their names would hide it
+    clashes = sorted(set(field_names) & RECORD_RESERVED_NAMES)
+    if clashes:
+        raise FamError("%s can't have a record, its fields %s clash with the record's own" % (cls.__name__, ", ".join(clashes)))
+    ref_to_names = tuple(name for name in field_names if isinstance(cls.fields[name], ReferenceTo))
+    # only the accessors that convert values, ie for ObjectFields, need to be run on load
+    coercers = tuple((name, coerce) for name, coerce in cls._coercers if name in field_names)
+
+    attrs = {
+        "__slots__": field_names,
+        "fam_class": cls,
+        "type": sys.intern(cls.type),
+        "namespace": sys.intern(cls.namespace),
+        "_field_names": field_names,
+        "_ref_to_names": ref_to_names,
+        "_coercers": coercers
+    }
+
+    record_cls = type("%sRecord" % cls.__name__, (FamRecord,), attrs)
+    _record_classes[cls] = record_cls
+    return record_cls
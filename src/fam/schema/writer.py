@@ -31,6 +31,12 @@ FIELD_TYPE_LOOKUP = {
     },
     "DecimalField": {
         "type": "string"
+    },
+    "LatLongField": {
+        "type": "string"
+    },
+    "BytesField": {
+        "type": "string"
     }
 }
 
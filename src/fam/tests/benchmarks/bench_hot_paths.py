@@ -0,0 +1,190 @@
+"""
+Microbenchmarks for the hot paths, serialisation, object construction and attribute access.
+
+They need no database so can be run anywhere:
+
+    python -m fam.tests.benchmarks.bench_hot_paths [--output results.json] [--compare old.json] [--only name]
+
+Each benchmark reports ops per second, the best of several timed runs, and the peak bytes
+allocated during a single call, measured with tracemalloc. The results are written as json
+with the fam and python versions so runs from different releases can be compared.
+"""
+
+import sys
+import json
+import timeit
+import argparse
+import datetime
+import platform
+import tracemalloc
+from decimal import Decimal
+from fractions import Fraction
+
+import pytz
+
+from fam.mapper import ClassMapper
+from fam.extra_types.lat_long import LatLong
+from fam.database.base import BaseDatabase
+from fam.database.couchdb_adapter import CouchDBDataAdapter
+from fam.database.firestore_adapter import FirestoreDataAdapter
+from fam.schema.validator import ModelValidator
+from fam.tests.models.test04 import Aquarium, Pump
+from fam.tests.models.test01 import Dog, Cat, Person
+
+MIN_RUN_SECONDS = 0.2
+REPEATS = 5
+
+
+def aquarium_properties():
+    return {
+        "type": "aquarium",
+        "namespace": Aquarium.namespace,
+        "name": "The Deep",
+        "open": True,
+        "volume": 12000.5,
+        "species": ["clown fish", "blue tang", "moray eel", "sea horse"],
+        "notes": {"feeding": "twice a day", "cleaner": "bob", "tanks": [1, 2, 3]},
+        "pump": Pump(litres_per_hour=3000, on=True),
+        "location": LatLong(53.7448, -0.3306),
+        "opened": datetime.datetime(2002, 3, 1, 10, 30, tzinfo=pytz.utc),
+        "photo": b"\x89PNG not really a photo of an aquarium" * 4,
+        "depth": Decimal("10.75"),
+        "salt_fraction": Fraction(7, 200),
+        "email": "info@thedeep.co.uk",
+        "star_fish_id": "fish_nemo"
+    }
+
+
+class OfflineDatabase(BaseDatabase):
+    # just enough of a db for _from_doc to find classes
+    database_type = "offline"
+
+    def __init__(self, mapper):
+        self.mapper = mapper
+
+
+def version():
+    try:
+        from importlib.metadata import version as package_version
+        return package_version("fam")
+    except Exception:
+        return None
+
+
+def measure(func):
+    timer = timeit.Timer(func)
+    loops, seconds = timer.autorange()
+    while seconds < MIN_RUN_SECONDS:
+        loops *= 2
+        seconds = timer.timeit(loops)
+    best = min(timer.repeat(repeat=REPEATS, number=loops))
+
+    tracemalloc.start()
+    try:
+        func()
+        tracemalloc.clear_traces()
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        func()
+        end, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "ops_per_sec": round(loops / best, 1),
+        "loops": loops,
+        "seconds": round(best, 6),
+        "peak_bytes": peak - start,
+        "retained_bytes": end - start
+    }
+
+
+def benchmarks():
+    # name -> a function doing one op
+    mapper = ClassMapper([Aquarium, Dog, Cat, Person])
+    db = OfflineDatabase(mapper)
+    couchdb_adapter = CouchDBDataAdapter(mapper)
+    firestore_adapter = FirestoreDataAdapter(mapper)
+    uncompiled_adapter = CouchDBDataAdapter()
+
+    properties = aquarium_properties()
+    couchdb_doc = couchdb_adapter.serialise(properties)
+    firestore_doc = firestore_adapter.serialise(properties)
+    decoded = couchdb_adapter.deserialise(dict(couchdb_doc))
+
+    aquarium = Aquarium._from_doc(db, "aquarium_1", "1-abc", dict(decoded))
+    dog = Dog(key="dog_1", name="fly", owner_id="person_1", breed="collie")
+    cat = Cat(key="cat_1", name="tiddles", colour="black", legs=4, owner_id="person_1", email="tiddles@glowinthedark.co.uk")
+
+    validator = ModelValidator(None, classes=[Aquarium, Cat])
+    cat_doc = couchdb_adapter.serialise(cat._properties)
+
+    # the docs are decoded in place so each op gets its own top level dict, nothing nested is changed by decoding
+    return {
+        "couchdb_serialise": lambda: couchdb_adapter.serialise(properties),
+        "couchdb_deserialise": lambda: couchdb_adapter.deserialise(dict(couchdb_doc)),
+        "couchdb_serialise_uncompiled": lambda: uncompiled_adapter.serialise(properties),
+        "couchdb_deserialise_uncompiled": lambda: uncompiled_adapter.deserialise(dict(couchdb_doc)),
+        "firestore_serialise": lambda: firestore_adapter.serialise(properties),
+        "firestore_deserialise": lambda: firestore_adapter.deserialise(dict(firestore_doc)),
+        "from_doc": lambda: Aquarium._from_doc(db, "aquarium_1", "1-abc", dict(decoded)),
+        "from_doc_lazy": lambda: Aquarium._lazy_from_doc(db, "aquarium_1", "1-abc", dict(couchdb_doc)),
+        "field_access": lambda: (aquarium.name, aquarium.volume, aquarium.opened, aquarium.star_fish_id),
+        "getattr_additional_property": lambda: dog.breed,
+        "as_json": lambda: cat.as_json(),
+        "validate": lambda: validator.validate(cat_doc),
+        "validate_all_fields": lambda: validator.validate(couchdb_doc),
+    }
+
+
+def run(only=None):
+    results = []
+    for name, func in benchmarks().items():
+        if only and name not in only:
+            continue
+        result = {"name": name}
+        result.update(measure(func))
+        results.append(result)
+    return {
+        "fam_version": version(),
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "results": results
+    }
+
+
+def compare(report, previous):
+    # ops per second now as a ratio of the previous run, over 1 is faster
+    before = dict((r["name"], r) for r in previous["results"])
+    ratios = {}
+    for result in report["results"]:
+        old = before.get(result["name"])
+        if old is not None and old["ops_per_sec"]:
+            ratios[result["name"]] = round(result["ops_per_sec"] / old["ops_per_sec"], 3)
+    return ratios
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="fam hot path microbenchmarks")
+    parser.add_argument("--output", help="write the results as json to this file")
+    parser.add_argument("--compare", help="a previous results file to compare with")
+    parser.add_argument("--only", action="append", help="just run this benchmark, can be repeated")
+    args = parser.parse_args(argv)
+
+    report = run(args.only)
+    if args.compare:
+        with open(args.compare) as f:
+            report["compared_with"] = args.compare
+            report["speedup"] = compare(report, json.load(f))
+
+    as_json = json.dumps(report, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(as_json)
+    print(as_json)
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,111 @@
+"""
+Peak memory and time for decoding a large view response and encoding a lot of docs.
+
+Each path is measured as fam does it now and as it was done with a defensive deepcopy at
+every step, so the difference is the cost of the copies. Run it with:
+
+    python -m fam.tests.benchmarks.bench_memory [rows]
+
+It prints one line of json per measurement.
+"""
+
+import sys
+import json
+import time
+import datetime
+import tracemalloc
+from copy import deepcopy
+from decimal import Decimal
+from fractions import Fraction
+
+import pytz
+
+from fam.mapper import ClassMapper
+from fam.extra_types.lat_long import LatLong
+from fam.database.couchdb import ResultWrapper
+from fam.database.couchdb_adapter import CouchDBDataAdapter
+from fam.tests.models.test04 import Fish
+
+
+def make_fish(i):
+    return {
+        "type": "fish",
+        "namespace": Fish.namespace,
+        "name": "fish_%s" % i,
+        "location": LatLong(51.2345, -1.4533),
+        "born": datetime.datetime(2020, 1, 1, 12, tzinfo=pytz.utc),
+        "length": Decimal("45.7"),
+        "edible_fraction": Fraction(1, 3),
+        "image": b"not really a picture of a fish",
+        "tags": ["orange", "white", "stripy"],
+        "notes": {"tank": "big", "friends": ["dory", "gill"]}
+    }
+
+
+def view_response(adapter, count):
+    rows = []
+    for i in range(count):
+        doc = adapter.serialise(make_fish(i))
+        doc["_id"] = "fish_%s" % i
+        doc["_rev"] = "1-abc"
+        rows.append({"id": doc["_id"], "key": "fish", "value": None, "doc": doc})
+    return json.dumps({"total_rows": count, "offset": 0, "rows": rows})
+
+
+def read_now(adapter, text):
+    results = []
+    for row in json.loads(text)["rows"]:
+        row["doc"] = adapter.deserialise(row["doc"])
+        results.append(ResultWrapper.from_couchdb_view_json(row))
+    return results
+
+
+def read_copying(adapter, text):
+    results = []
+    for row in json.loads(text)["rows"]:
+        row = adapter._deserialise_walk(deepcopy(row))
+        value = deepcopy(row["doc"])
+        rev = value.pop("_rev")
+        del value["_id"]
+        results.append(ResultWrapper(row["id"], rev, value))
+    return results
+
+
+def write_now(adapter, docs):
+    return [adapter.serialise(doc) for doc in docs]
+
+
+def write_copying(adapter, docs):
+    return [adapter._serialise_walk(deepcopy(doc)) for doc in docs]
+
+
+def measure(name, func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {"name": name, "seconds": round(seconds, 4), "peak_bytes": peak, "retained_bytes": current}
+
+
+def main(count=10000):
+    adapter = CouchDBDataAdapter(ClassMapper([Fish]))
+    text = view_response(adapter, count)
+    docs = [make_fish(i) for i in range(count)]
+
+    results = [
+        measure("view_read", read_now, adapter, text),
+        measure("view_read_copying", read_copying, adapter, text),
+        measure("write", write_now, adapter, docs),
+        measure("write_copying", write_copying, adapter, docs),
+    ]
+    for result in results:
+        result["rows"] = count
+        print(json.dumps(result))
+    return results
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -66,6 +66,9 @@ class Cat(GenericObject):
         "email": EmailField()
         }
 
+    projected_fields = ("name", "legs")
+    aggregated_fields = ("legs",)
+
 
     @classmethod
     def all_with_n_legs(cls, db, legs):
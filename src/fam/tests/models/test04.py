@@ -11,7 +11,8 @@ from fam.blud import (GenericObject,
                       DateTimeField,
                       FractionField,
                       DecimalField,
-                      BytesField)
+                      BytesField,
+                      EmailField)
 
 
 NAMESPACE = "glowinthedark.co.uk/test"
@@ -43,4 +44,46 @@ class Fish(GenericObject):
         "length": DecimalField(),
         "edible_fraction": FractionField(),
         "image": BytesField()
-        }
\ No newline at end of file
+        }
+
+class Photo(GenericObject):
+
+    fields = {
+        "name": StringField(),
+        "image": BytesField(attachment=True)
+        }
+
+
+class Pump(object):
+
+    def __init__(self, litres_per_hour=0, on=False):
+        self.litres_per_hour = litres_per_hour
+        self.on = on
+
+    def to_json(self):
+        return {"litres_per_hour": self.litres_per_hour, "on": self.on}
+
+    @classmethod
+    def from_json(cls, as_json):
+        return cls(**as_json)
+
+
+class Aquarium(GenericObject):
+
+    # has every type of field
+    fields = {
+        "name": StringField(),
+        "open": BoolField(),
+        "volume": NumberField(),
+        "species": ListField(),
+        "notes": DictField(),
+        "pump": ObjectField(cls=Pump),
+        "location": LatLongField(),
+        "opened": DateTimeField(),
+        "photo": BytesField(),
+        "depth": DecimalField(),
+        "salt_fraction": FractionField(),
+        "email": EmailField(),
+        "star_fish_id": ReferenceTo(NAMESPACE, "fish")
+        }
+
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import unittest
+
+try:
+    import httpx
+    from fam.database import AsyncCouchDBWrapper
+except ImportError:
+    httpx = None
+from fam.mapper import ClassMapper
+from fam.exceptions import *
+from fam.tests.test_couchdb.config import *
+from fam.tests.models.test01 import Dog, Cat, Person, JackRussell
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@unittest.skipIf(httpx is None, "needs httpx")
+class AsyncTests(unittest.TestCase):
+
+    def setUp(self):
+        self.mapper = ClassMapper([Dog, Cat, Person, JackRussell])
+
+
+    async def make_db(self):
+        db = AsyncCouchDBWrapper(self.mapper, COUCHDB_URL, COUCHDB_NAME)
+        await db.ensure_database(reset=True)
+        await db.update_designs()
+        return db
+
+
+    def test_get_save_and_delete(self):
+        async def go():
+            async with await self.make_db() as db:
+                paul = await Person.create(db, name="paul")
+                dog = await Dog.create(db, name="fly", owner=paul)
+
+                got = await Dog.get(db, dog.key)
+                self.assertEqual(got.name, "fly")
+                self.assertEqual(got.rev, dog.rev)
+                self.assertEqual((await db.get(got.owner_id)).name, "paul")
+
+                got.name = "flyer"
+                self.assertTrue(await got.save(db))
+                self.assertNotEqual(got.rev, dog.rev)
+                # the old copy has the old rev
+                dog.name = "fido"
+                with self.assertRaises(FamResourceConflict):
+                    await dog.save(db)
+
+                await got.delete(db)
+                self.assertIsNone(await Dog.get(db, dog.key))
+        run(go())
+
+
+    def test_concurrent_gets_and_views(self):
+        async def go():
+            async with await self.make_db() as db:
+                paul = await Person.create(db, name="paul")
+                dogs = await asyncio.gather(*[Dog.create(db, name="dog_%s" % i, owner=paul) for i in range(30)])
+                got = await asyncio.gather(*[Dog.get(db, dog.key) for dog in dogs])
+                self.assertEqual([dog.name for dog in got], [dog.name for dog in dogs])
+
+                refs = await db.query_view("%s/person_dogs" % Person.namespace.replace("/", "_"), key=paul.key)
+                self.assertEqual(len(refs), 30)
+                names = [dog.name async for dog in db.iter_view("raw/all", key="dog", page_size=7)]
+                self.assertEqual(sorted(names), sorted(dog.name for dog in dogs))
+
+                last_seq, changed = await db.changes()
+                self.assertEqual(len(changed), 31)
+        run(go())
+
+
+    def test_delete_cascades(self):
+        async def go():
+            async with await self.make_db() as db:
+                paul = await Person.create(db, name="paul")
+                cats = [await Cat.create(db, name="cat_%s" % i, legs=4, owner=paul) for i in range(2)]
+                dog = await Dog.create(db, name="fly", owner=paul)
+
+                await paul.delete(db)
+                self.assertIsNone(await db.get(paul.key))
+                for cat in cats:
+                    self.assertIsNone(await db.get(cat.key))
+                # its reference to paul is cleared rather than it being deleted
+                got = await db.get(dog.key)
+                self.assertIsNotNone(got)
+                self.assertIsNone(got.owner_id)
+        run(go())
+
+
+    def test_unique_fields(self):
+        async def go():
+            async with await self.make_db() as db:
+                await Dog.create(db, name="rufus", kennel_club_membership="123456")
+                with self.assertRaises(FamUniqueError):
+                    await Dog.create(db, name="fly", kennel_club_membership="123456")
+        run(go())
+
+
+@unittest.skipIf(httpx is None, "needs httpx")
+class AsyncBackoffTests(unittest.TestCase):
+
+    def test_retries_server_errors(self):
+        calls = []
+        def handler(request):
+            calls.append(request.url.path)
+            if len(calls) < 3:
+                return httpx.Response(503)
+            return httpx.Response(200, json={"_id": "dog_1", "_rev": "1-abc", "type": "dog",
+                                             "namespace": Dog.namespace, "name": "fly"})
+
+        async def go():
+            db = AsyncCouchDBWrapper(ClassMapper([Dog]), "http://couchdb", "test",
+                                     transport=httpx.MockTransport(handler), backoff_seconds=0)
+            async with db:
+                return await Dog.get(db, "dog_1")
+
+        dog = run(go())
+        self.assertEqual(dog.name, "fly")
+        self.assertEqual(len(calls), 3)
+
+
+    def test_gives_up(self):
+        def handler(request):
+            raise httpx.ConnectError("refused", request=request)
+
+        async def go():
+            db = AsyncCouchDBWrapper(ClassMapper([Dog]), "http://couchdb", "test",
+                                     transport=httpx.MockTransport(handler), retries=2, backoff_seconds=0)
+            async with db:
+                await Dog.get(db, "dog_1")
+
+        self.assertRaises(httpx.ConnectError, run, go())
+
+
+    def test_write_applied_before_a_retry(self):
+        stored = {}
+        calls = []
+        def handler(request):
+            calls.append(request.method)
+            if request.method == "PUT":
+                if not stored:
+                    # written but the response is lost
+                    stored.update(json.loads(request.content), _rev="1-abc")
+                    return httpx.Response(503)
+                return httpx.Response(409, json={"error": "conflict"})
+            if request.method == "GET":
+                return httpx.Response(200, json=stored)
+            # anything else should only be the uniqueness check
+            return httpx.Response(200, json={"rows": []})
+
+        async def go():
+            db = AsyncCouchDBWrapper(ClassMapper([Dog]), "http://couchdb", "test",
+                                     transport=httpx.MockTransport(handler), backoff_seconds=0)
+            async with db:
+                return await Dog.create(db, name="fly")
+
+        dog = run(go())
+        self.assertEqual(dog.rev, "1-abc")
+        self.assertEqual(calls.count("PUT"), 2)
+
+
+    def test_other_posts_are_not_retried(self):
+        calls = []
+        def handler(request):
+            calls.append(request.url.path)
+            return httpx.Response(503)
+
+        async def go():
+            db = AsyncCouchDBWrapper(ClassMapper([Dog]), "http://couchdb", "test",
+                                     transport=httpx.MockTransport(handler), backoff_seconds=0)
+            async with db:
+                rsp = await db._request("POST", "http://couchdb/test/_bulk_docs")
+                return rsp.status_code
+
+        self.assertEqual(run(go()), 503)
+        self.assertEqual(len(calls), 1)
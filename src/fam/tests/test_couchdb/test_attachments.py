@@ -0,0 +1,95 @@
+import os
+import unittest
+from mock import patch
+
+import fam
+from fam.attachments import AttachmentStub
+from fam.database import CouchDBWrapper
+from fam.exceptions import FamError
+from fam.fields import BytesField
+from fam.mapper import ClassMapper
+from fam.tests.test_couchdb.config import *
+from fam.tests.models.test04 import Photo
+
+DATA_DIR = os.path.join(os.path.dirname(fam.__file__), "tests", "data")
+
+
+class AttachmentTests(unittest.TestCase):
+
+    def setUp(self):
+        mapper = ClassMapper([Photo])
+        self.db = CouchDBWrapper(mapper, COUCHDB_URL, COUCHDB_NAME, reset=True)
+        self.db.update_designs()
+        with open(os.path.join(DATA_DIR, "goldfish.jpg"), "rb") as f:
+            self.image_data = f.read()
+
+    def tearDown(self):
+        self.db.session.close()
+
+
+    def test_stored_as_attachment(self):
+        photo = Photo.create(self.db, name="nemo", image=self.image_data)
+        rsp = self.db.session.get("%s/%s/%s" % (self.db.db_url, self.db.db_name, photo.key))
+        doc = rsp.json()
+        self.assertFalse("image" in doc)
+        self.assertTrue(doc["_attachments"]["image"]["stub"])
+        self.assertEqual(doc["_attachments"]["image"]["length"], len(self.image_data))
+
+
+    def test_fetched_when_read(self):
+        photo = Photo.create(self.db, name="nemo", image=self.image_data)
+        got = Photo.get(self.db, photo.key)
+        self.assertIsInstance(got._properties["image"], AttachmentStub)
+
+        with patch.object(self.db, "get_attachment", wraps=self.db.get_attachment) as get_attachment:
+            self.assertEqual(got.image, self.image_data)
+            self.assertEqual(got.image, self.image_data)
+            self.assertEqual(get_attachment.call_count, 1)
+
+
+    def test_view_rows_only_have_stubs(self):
+        Photo.create(self.db, name="nemo", image=self.image_data)
+        for lazy in (False, True):
+            photos = list(Photo.all(self.db, lazy=lazy))
+            self.assertIsInstance(photos[0]._values.get("image"), AttachmentStub)
+            self.assertEqual(photos[0].image, self.image_data)
+
+
+    def test_open_attachment(self):
+        photo = Photo.create(self.db, name="nemo", image=self.image_data)
+        self.assertEqual(photo.open_attachment("image").read(), self.image_data)
+        got = Photo.get(self.db, photo.key)
+        with got.open_attachment("image") as f:
+            start = f.read(10)
+            self.assertEqual(start + f.read(), self.image_data)
+
+
+    def test_update_keeps_attachment(self):
+        photo = Photo.create(self.db, name="nemo", image=self.image_data)
+        got = Photo.get(self.db, photo.key)
+        got.name = "dory"
+        got.save(self.db)
+        again = Photo.get(self.db, photo.key)
+        self.assertEqual(again.name, "dory")
+        self.assertEqual(again.image, self.image_data)
+
+        again.image = b"a different fish"
+        again.save(self.db)
+        self.assertEqual(Photo.get(self.db, photo.key).image, b"a different fish")
+
+        bulk = Photo.get(self.db, photo.key)
+        bulk.name = "gill"
+        self.assertTrue(self.db.put_many([bulk])[0].ok)
+        self.assertEqual(Photo.get(self.db, photo.key).image, b"a different fish")
+
+
+    def test_remove_attachment(self):
+        photo = Photo.create(self.db, name="nemo", image=self.image_data)
+        photo.image = None
+        photo.save(self.db)
+        self.assertIsNone(Photo.get(self.db, photo.key).image)
+
+
+    def test_field_options(self):
+        self.assertTrue(BytesField(unique=True).unique)
+        self.assertRaises(FamError, BytesField, unique=True, attachment=True)
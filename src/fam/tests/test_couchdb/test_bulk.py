@@ -0,0 +1,84 @@
+import unittest
+from mock import patch
+from fam.database import CouchDBWrapper
+from fam.mapper import ClassMapper
+from fam.exceptions import *
+from fam.tests.test_couchdb.config import *
+from fam.tests.models.test01 import Dog, Cat, Person
+
+
+class BulkTests(unittest.TestCase):
+
+    def setUp(self):
+        mapper = ClassMapper([Dog, Cat, Person])
+        self.db = CouchDBWrapper(mapper, COUCHDB_URL, COUCHDB_NAME, reset=True)
+        self.db.update_designs()
+
+    def tearDown(self):
+        self.db.session.close()
+
+
+    def test_bulk_create(self):
+        results = Person.bulk_create(self.db, [{"name": "person_%s" % i} for i in range(20)])
+        self.assertEqual(len(results), 20)
+        for result in results:
+            self.assertTrue(result.ok)
+            self.assertIsNotNone(result.obj.rev)
+            got = self.db.get(result.key)
+            self.assertEqual(got.name, result.obj.name)
+            self.assertEqual(got.rev, result.obj.rev)
+
+
+    def test_put_many_updates(self):
+        people = [r.obj for r in Person.bulk_create(self.db, [{"name": "person_%s" % i} for i in range(5)])]
+        for person in people:
+            person.name = person.name + "_changed"
+        results = self.db.put_many(people)
+        self.assertTrue(all(r.ok for r in results))
+        for person in people:
+            self.assertTrue(self.db.get(person.key).name.endswith("_changed"))
+
+
+    def test_put_many_reports_each_error(self):
+        paul = Person(name="paul")
+        self.db.put(paul)
+        stale = self.db.get(paul.key)
+        paul.name = "paul harter"
+        self.db.put(paul)
+
+        stale.name = "stale"
+        fresh = Person(name="fresh")
+        results = self.db.put_many([stale, fresh])
+        self.assertIsInstance(results[0].error, FamResourceConflict)
+        self.assertTrue(results[1].ok)
+        self.assertEqual(self.db.get(paul.key).name, "paul harter")
+        self.assertEqual(self.db.get(fresh.key).name, "fresh")
+
+
+    def test_put_many_uniqueness(self):
+        self.db.put(Dog(name="fly", kennel_club_membership="123"))
+        results = self.db.put_many([Dog(name="rufus", kennel_club_membership="123"),
+                                    Dog(name="jess", kennel_club_membership="456"),
+                                    Dog(name="bob", kennel_club_membership="456")])
+        self.assertIsInstance(results[0].error, FamUniqueError)
+        self.assertTrue(results[1].ok)
+        self.assertIsInstance(results[2].error, FamUniqueError)
+
+
+    def test_put_many_callbacks(self):
+        with patch.object(Dog, "pre_save_new_cb", return_value=None) as pre_new:
+            with patch.object(Dog, "post_save_new_cb", return_value=None) as post_new:
+                self.db.put_many([Dog(name="dog_%s" % i) for i in range(3)])
+                self.assertEqual(pre_new.call_count, 3)
+                self.assertEqual(post_new.call_count, 3)
+
+
+    def test_delete_many(self):
+        paul = Person(name="paul")
+        self.db.put(paul)
+        cats = [r.obj for r in Cat.bulk_create(self.db, [{"name": "cat_%s" % i, "legs": 4, "owner_id": paul.key} for i in range(4)])]
+        results = self.db.delete_many(cats)
+        self.assertTrue(all(r.ok for r in results))
+        for cat in cats:
+            self.assertIsNone(self.db.get(cat.key))
+        self.assertEqual(list(paul.cats), [])
@@ -0,0 +1,60 @@
+import unittest
+from fam.database import CouchDBWrapper
+from fam.mapper import ClassMapper
+from fam.tests.test_couchdb.config import *
+from fam.tests.models.test01 import Dog, Cat, Person
+
+
+class CascadeTests(unittest.TestCase):
+
+    def setUp(self):
+        mapper = ClassMapper([Dog, Cat, Person])
+        self.db = CouchDBWrapper(mapper, COUCHDB_URL, COUCHDB_NAME, reset=True)
+        self.db.update_designs()
+
+    def tearDown(self):
+        self.db.session.close()
+
+
+    def _family(self):
+        paul = Person(name="paul")
+        self.db.put(paul)
+        cats = [r.obj for r in Cat.bulk_create(self.db, [{"name": "cat_%s" % i, "legs": 4, "owner_id": paul.key} for i in range(3)])]
+        dogs = [r.obj for r in Dog.bulk_create(self.db, [{"name": "dog_%s" % i, "owner_id": paul.key} for i in range(2)])]
+        return paul, cats, dogs
+
+
+    def test_dry_run(self):
+        paul, cats, dogs = self._family()
+        plan = paul.delete(self.db, dry_run=True)
+        self.assertEqual(set(o.key for o in plan.deletes), set([paul.key] + [c.key for c in cats]))
+        self.assertEqual(set(plan.updates.keys()), set(d.key for d in dogs))
+        self.assertEqual(len(plan), 6)
+        # nothing has changed
+        self.assertEqual(self.db.get(paul.key).name, "paul")
+        self.assertEqual(len(list(paul.cats)), 3)
+
+
+    def test_delete_applies_plan(self):
+        paul, cats, dogs = self._family()
+        paul.delete(self.db)
+        self.assertIsNone(self.db.get(paul.key))
+        for cat in cats:
+            self.assertIsNone(self.db.get(cat.key))
+        for dog in dogs:
+            got = self.db.get(dog.key)
+            self.assertIsNotNone(got)
+            self.assertIsNone(got.owner_id)
+
+
+    def test_cascade_to_parent(self):
+        # deleting a dog deletes its owner which deletes the owner's cats
+        paul, cats, dogs = self._family()
+        plan = dogs[0].delete(self.db, dry_run=True)
+        self.assertEqual(len(plan.deletes), 5)
+        self.assertEqual(list(plan.updates.keys()), [dogs[1].key])
+        self.assertEqual(plan.levels, 3)
+
+        dogs[0].delete(self.db)
+        self.assertIsNone(self.db.get(paul.key))
+        self.assertIsNone(self.db.get(dogs[1].key).owner_id)
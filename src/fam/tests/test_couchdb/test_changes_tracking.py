@@ -0,0 +1,92 @@
+import unittest
+from mock import patch
+from fam.database import CouchDBWrapper
+from fam.mapper import ClassMapper
+from fam.exceptions import FamWriteError
+from fam.tests.test_couchdb.config import *
+from fam.tests.models.test01 import Dog, Cat, Person
+
+
+class ChangeTrackingTests(unittest.TestCase):
+
+    def setUp(self):
+        mapper = ClassMapper([Dog, Cat, Person])
+        self.db = CouchDBWrapper(mapper, COUCHDB_URL, COUCHDB_NAME, reset=True)
+        self.db.update_designs()
+
+    def tearDown(self):
+        self.db.session.close()
+
+
+    def test_changed_fields(self):
+        paul = Person(name="paul")
+        self.assertEqual(paul.changed_fields, {"name", "type", "namespace"})
+        self.db.put(paul)
+        self.assertEqual(paul.changed_fields, set())
+        paul.name = "paul harter"
+        self.assertEqual(paul.changed_fields, {"name"})
+
+        got = self.db.get(paul.key)
+        self.assertEqual(got.changed_fields, set())
+
+
+    def test_unchanged_save_is_skipped(self):
+        paul = Person(name="paul")
+        self.db.put(paul)
+        rev = paul.rev
+
+        with patch.object(self.db, "set_object", side_effect=AssertionError("nothing to save")):
+            self.assertTrue(paul.save(self.db))
+            self.assertTrue(self.db.get(paul.key).save(self.db))
+
+        self.assertEqual(paul.rev, rev)
+
+
+    def test_list_changed_in_place(self):
+        dog = Dog(name="fly")
+        self.db.put(dog)
+        dog.channels.append("another")
+        self.assertEqual(dog.changed_fields, {"channels"})
+        dog.save(self.db)
+        self.assertEqual(self.db.get(dog.key).channels, ["callbacks", "another"])
+
+
+    def test_reading_isnt_a_change(self):
+        dog = Dog(name="fly", collar={"colour": "red"})
+        self.db.put(dog)
+
+        got = self.db.get(dog.key)
+        self.assertEqual(got.channels, ["callbacks"])
+        self.assertEqual(got.collar, {"colour": "red"})
+        self.assertEqual(got.changed_fields, set())
+        with patch.object(self.db, "set_object", side_effect=AssertionError("nothing to save")):
+            self.assertTrue(got.save(self.db))
+
+        got.collar["colour"] = "blue"
+        self.assertEqual(got.changed_fields, {"collar"})
+
+
+    def test_failed_save_isnt_skipped_next_time(self):
+        paul = Person(name="paul")
+        self.db.put(paul)
+
+        mapper = ClassMapper([Dog, Cat, Person])
+        other_db = CouchDBWrapper(mapper, COUCHDB_URL, COUCHDB_NAME + "_other", reset=True)
+        paul.rev = None
+        with patch.object(other_db, "set_object", side_effect=FamWriteError("down")):
+            self.assertRaises(FamWriteError, paul.save, other_db)
+        paul.save(other_db)
+        self.assertEqual(other_db.get(paul.key).name, "paul")
+        other_db.session.close()
+
+
+    def test_saved_to_another_db(self):
+        paul = Person(name="paul")
+        self.db.put(paul)
+
+        mapper = ClassMapper([Dog, Cat, Person])
+        other_db = CouchDBWrapper(mapper, COUCHDB_URL, COUCHDB_NAME + "_other", reset=True)
+        paul.rev = None
+        paul.save(other_db)
+        self.assertEqual(other_db.get(paul.key).name, "paul")
+        other_db.session.close()
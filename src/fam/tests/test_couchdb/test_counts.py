@@ -0,0 +1,59 @@
+import unittest
+from fam.database import CouchDBWrapper
+from fam.mapper import ClassMapper
+from fam.exceptions import *
+from fam.tests.test_couchdb.config import *
+from fam.tests.models.test01 import Dog, Cat, Person
+
+
+class CountTests(unittest.TestCase):
+
+    def make_db(self, counts):
+        mapper = ClassMapper([Dog, Cat, Person], counts=counts)
+        db = CouchDBWrapper(mapper, COUCHDB_URL, COUCHDB_NAME, reset=True)
+        db.update_designs()
+        self.addCleanup(db.session.close)
+
+        self.calls = []
+        view = db.view
+        def recording_view(name, **kwargs):
+            self.calls.append(dict(kwargs))
+            return view(name, **kwargs)
+        db.view = recording_view
+        return db
+
+
+    def test_count_refs(self):
+        for counts in (True, False):
+            db = self.make_db(counts)
+            paul = Person.create(db, name="paul")
+            sol = Person.create(db, name="sol")
+            Dog.bulk_create(db, [{"name": "dog_%s" % i, "owner_id": paul.key} for i in range(5)])
+            del self.calls[:]
+
+            self.assertEqual(paul.count_refs("dogs"), 5)
+            self.assertEqual(sol.count_refs("dogs"), 0)
+            self.assertEqual(len(list(paul.dogs)), 5)
+            # reduced, or just the keys without the docs
+            self.assertEqual(self.calls[0].get("reduce", False), counts)
+            self.assertIsNot(self.calls[0].get("include_docs"), True)
+            self.assertRaises(FamError, paul.count_refs, "name")
+
+
+    def test_count_with_value(self):
+        db = self.make_db(True)
+        Dog.create(db, name="rufus", kennel_club_membership="123456")
+        self.assertEqual(Dog.count_with_value(db, "kennel_club_membership", "123456"), 1)
+        self.assertEqual(Dog.count_with_value(db, "kennel_club_membership", "654321"), 0)
+
+
+    def test_aggregate(self):
+        db = self.make_db(True)
+        paul = Person.create(db, name="paul")
+        for legs in (4, 3, 4):
+            Cat.create(db, name="tiddles", legs=legs, owner=paul)
+
+        stats = Cat.aggregate(db, "legs")
+        self.assertEqual(stats, {"sum": 11, "count": 3, "min": 3, "max": 4, "sumsqr": 41})
+        self.assertTrue(self.calls[-1]["reduce"])
+        self.assertRaises(FamError, Cat.aggregate, db, "name")
@@ -0,0 +1,40 @@
+import unittest
+from fam.database import CouchDBWrapper
+from fam.database.couchdb import DESIGN_FINGERPRINT
+from fam.mapper import ClassMapper
+from fam.tests.test_couchdb.config import *
+from fam.tests.models.test01 import Dog, Cat, Person, NAMESPACE
+
+
+class DesignSyncTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = CouchDBWrapper(ClassMapper([Dog, Cat, Person]), COUCHDB_URL, COUCHDB_NAME, reset=True)
+
+    def tearDown(self):
+        self.db.session.close()
+
+
+    def test_only_changed_designs_are_written(self):
+        namespace_key = "_design/%s" % NAMESPACE.replace("/", "_")
+        self.assertEqual(sorted(self.db.update_designs()), sorted(["_design/raw", namespace_key]))
+        self.assertEqual(self.db.update_designs(), [])
+
+        design = self.db.get_design(namespace_key)
+        self.assertEqual(design.value[DESIGN_FINGERPRINT], self.db._design_fingerprint(design.value))
+
+        # a count reduce on the reference views only changes the namespace's design doc
+        self.db.mapper = ClassMapper([Dog, Cat, Person], counts=True)
+        self.assertEqual(self.db.update_designs(), [namespace_key])
+        # no dev copies
+        self.assertIsNone(self.db.get_design(namespace_key.replace("_design/", "_design/dev_")))
+
+
+    def test_warm_views(self):
+        for i in range(50):
+            Dog.create(self.db, name="dog_%s" % i)
+        self.db.update_designs(warm=True)
+        progress = self.db.index_progress()
+        for value in progress.values():
+            self.assertTrue(0 <= value <= 100)
+        self.assertEqual(len(Dog.all(self.db)), 50)
@@ -0,0 +1,96 @@
+import unittest
+from fam.database import CouchDBWrapper
+from fam.mapper import ClassMapper
+from fam.tests.test_couchdb.config import *
+from fam.tests.models.test01 import Dog, Cat, Person
+
+
+class IdentityMapTests(unittest.TestCase):
+
+    def setUp(self):
+        mapper = ClassMapper([Dog, Cat, Person])
+        self.db = CouchDBWrapper(mapper, COUCHDB_URL, COUCHDB_NAME, reset=True)
+        self.db.update_designs()
+
+    def tearDown(self):
+        self.db.session.close()
+
+
+    def test_shared_owner_is_only_loaded_once(self):
+
+        paul = Person(name="paul")
+        self.db.put(paul)
+        for i in range(10):
+            self.db.put(Dog(name="dog_%s" % i, owner=paul))
+
+        with self.db.identity_session() as session:
+            dogs = list(paul.dogs)
+            owners = [dog.owner for dog in dogs]
+            self.assertEqual(len(owners), 10)
+            for owner in owners:
+                self.assertTrue(owner is owners[0])
+                self.assertEqual(owner, paul)
+            self.assertEqual(session.misses, 11)
+            self.assertEqual(session.hits, 9)
+
+        self.assertIsNone(self.db.identity_map)
+
+
+    def test_get_returns_same_object(self):
+
+        paul = Person(name="paul")
+        self.db.put(paul)
+
+        with self.db.identity_session() as session:
+            first = self.db.get(paul.key)
+            second = Person.get(self.db, paul.key)
+            self.assertTrue(first is second)
+            self.assertEqual(session.hits, 1)
+            self.assertEqual(session.misses, 1)
+
+
+    def test_invalidated_on_save_and_delete(self):
+
+        paul = Person(name="paul")
+        self.db.put(paul)
+
+        with self.db.identity_session() as session:
+            first = self.db.get(paul.key)
+            first.name = "paul harter"
+            first.save(self.db)
+            self.assertFalse(paul.key in session)
+
+            second = self.db.get(paul.key)
+            self.assertFalse(first is second)
+            self.assertEqual(second.name, "paul harter")
+            self.assertEqual(second.rev, first.rev)
+
+            second.delete(self.db)
+            self.assertIsNone(self.db.get(paul.key))
+
+
+    def test_invalidated_on_update(self):
+
+        paul = Person(name="paul")
+        self.db.put(paul)
+
+        with self.db.identity_session():
+            first = self.db.get(paul.key)
+            first.update({"name": "sol"})
+            second = self.db.get(paul.key)
+            self.assertEqual(second.name, "sol")
+
+
+    def test_changed_rev_replaces_cached_object(self):
+
+        paul = Person(name="paul")
+        self.db.put(paul)
+
+        with self.db.identity_session():
+            first = self.db.get(paul.key)
+            # change it behind the session's back
+            self.db._set(paul.key, {"name": "jake", "type": "person", "namespace": paul.namespace}, rev=paul.rev)
+            people = list(Person.all(self.db))
+            self.assertEqual(len(people), 1)
+            self.assertEqual(people[0].name, "jake")
+            self.assertFalse(people[0] is first)
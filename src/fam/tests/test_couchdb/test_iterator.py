@@ -3,6 +3,10 @@ import os
 import unittest
 from fam.database import CouchDBWrapper
 from fam.mapper import ClassMapper
+from fam.blud import GenericObject
+from fam.fields import StringField
+from fam.exceptions import FamError
+from fam.records import record_class_for
 from fam.tests.test_couchdb.config import *
 from fam.tests.models.test01 import Dog, Cat, Person
 
@@ -34,4 +38,87 @@ class CacheTests(unittest.TestCase):
         for dog in me.dogs:
             counter += 1
 
-        self.assertEqual(counter, 500)
\ No newline at end of file
+        self.assertEqual(counter, 500)
+
+    def test_iterate_dogs_compact(self):
+
+        me = Person(name="paul")
+        self.db.put(me)
+
+        for i in range(150):
+            dog = Dog(name="dog_%s" % i, owner=me)
+            self.db.put(dog)
+
+        names = set()
+        for dog in Dog.view_iterator(self.db, "raw/all", key="dog", compact=True):
+            self.assertTrue(isinstance(dog, Dog.record_class()))
+            self.assertFalse(hasattr(dog, "__dict__"))
+            self.assertEqual(dog.type, "dog")
+            self.assertEqual(dog.owner_id, me.key)
+            names.add(dog.name)
+
+        self.assertEqual(len(names), 150)
+
+
+    def test_all_compact(self):
+
+        me = Person(name="paul")
+        self.db.put(me)
+        dog = Dog(name="fly", owner=me, collar="leather")
+        self.db.put(dog)
+
+        records = list(Dog.all(self.db, compact=True))
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertEqual(record.key, dog.key)
+        self.assertEqual(record.rev, dog.rev)
+        self.assertEqual(record.extra, {"collar": "leather"})
+
+        as_object = record.to_object(self.db)
+        self.assertEqual(as_object, dog)
+        self.assertEqual(as_object.owner, me)
+
+
+    def test_record_field_clash(self):
+
+        class Tag(GenericObject):
+            fields = {"name": StringField(), "rev": StringField()}
+
+        self.assertRaises(FamError, record_class_for, Tag)
+
+
+    def test_pages_by_key_not_skip(self):
+
+        Dog.bulk_create(self.db, [{"name": "dog_%s" % i} for i in range(250)])
+
+        calls = []
+        view = self.db.view
+        def recording_view(name, **kwargs):
+            calls.append(dict(kwargs))
+            return view(name, **kwargs)
+        self.db.view = recording_view
+
+        names = [dog.name for dog in Dog.view_iterator(self.db, "raw/all", key="dog", page_size=10)]
+        self.assertEqual(len(names), 250)
+        self.assertEqual(len(set(names)), 250)
+
+        self.assertTrue(all("skip" not in call for call in calls))
+        self.assertEqual(calls[0]["limit"], 10)
+        self.assertTrue(calls[-1]["limit"] > 11)
+        self.assertEqual(calls[1]["startkey"], "dog")
+        self.assertEqual(calls[1]["endkey"], "dog")
+        self.assertTrue("startkey_docid" in calls[1])
+
+
+    def test_paging_when_the_last_row_goes(self):
+
+        Dog.bulk_create(self.db, [{"name": "dog_%s" % i} for i in range(30)])
+
+        names = []
+        for dog in Dog.view_iterator(self.db, "raw/all", key="dog", page_size=10, max_page_size=10):
+            names.append(dog.name)
+            if len(names) == 10:
+                # the row the next page would start from
+                dog.delete(self.db)
+
+        self.assertEqual(len(set(names)), 30)
@@ -0,0 +1,75 @@
+import unittest
+import simplejson
+from decimal import Decimal
+
+from fam.fam_json import JsonBackend, OrjsonBackend, get_json_backend, orjson
+from fam.database import CouchDBWrapper
+from fam.mapper import ClassMapper
+from fam.tests.test_couchdb.config import *
+from fam.tests.models.test01 import Dog, Cat, Person, Monster, Weapons
+
+
+class JsonBackendTests(unittest.TestCase):
+
+    def backends(self):
+        backends = [JsonBackend()]
+        if orjson is not None:
+            backends.append(OrjsonBackend())
+        return backends
+
+
+    def test_compact_encoding(self):
+        for backend in self.backends():
+            encoded = backend.encode({"name": "fly", "legs": [1, 2]})
+            if isinstance(encoded, bytes):
+                encoded = encoded.decode("utf-8")
+            self.assertFalse(" " in encoded)
+            self.assertEqual(backend.loads(encoded), {"name": "fly", "legs": [1, 2]})
+
+
+    def test_object_default(self):
+        weapons = Weapons(wings=True, fire=False, claws=True)
+        for backend in self.backends():
+            self.assertEqual(backend.loads(backend.encode({"weapons": weapons})),
+                             {"weapons": {"wings": True, "fire": False, "claws": True}})
+
+
+    def test_falls_back(self):
+        # orjson does neither of these
+        for backend in self.backends():
+            self.assertEqual(backend.loads(backend.encode({"big": 2 ** 70})), {"big": 2 ** 70})
+            self.assertEqual(simplejson.loads(backend.encode({"d": Decimal("1.5")}), use_decimal=True), {"d": Decimal("1.5")})
+
+
+    def test_pretty_is_unchanged(self):
+        d = {"b": 1, "a": [1, 2]}
+        expected = simplejson.dumps(d, sort_keys=True, indent=4, separators=(",", ": "))
+        for backend in self.backends():
+            self.assertEqual(backend.dumps(d, pretty=True), expected)
+
+
+    def test_get_backend(self):
+        self.assertEqual(get_json_backend("json").name, "json")
+        backend = JsonBackend()
+        self.assertIs(get_json_backend(backend), backend)
+
+
+class JsonBackendDatabaseTests(unittest.TestCase):
+
+    def test_round_trip_with_each_backend(self):
+        mapper = ClassMapper([Dog, Cat, Person, Monster])
+        for name in ("json", "orjson"):
+            if name == "orjson" and orjson is None:
+                continue
+            db = CouchDBWrapper(mapper, COUCHDB_URL, COUCHDB_NAME, reset=True, json_backend=name)
+            db.update_designs()
+            try:
+                paul = Person.create(db, name="paul")
+                Dog.create(db, name="fly", owner=paul)
+                Monster.create(db, name="dragon", weapons=Weapons(wings=True, fire=True, claws=False))
+                got = Person.get(db, paul.key)
+                self.assertEqual(got.name, "paul")
+                self.assertEqual(list(got.dogs)[0].name, "fly")
+                self.assertTrue(list(Monster.all(db))[0].weapons.fire)
+            finally:
+                db.session.close()
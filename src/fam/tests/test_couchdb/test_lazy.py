@@ -0,0 +1,70 @@
+import unittest
+import datetime
+import pytz
+from fractions import Fraction
+from fam.database import CouchDBWrapper
+from fam.mapper import ClassMapper
+from fam.tests.test_couchdb.config import *
+from fam.tests.models.test01 import Dog, Cat, Person, Monster, Weapons, Event
+
+
+class LazyTests(unittest.TestCase):
+
+    def setUp(self):
+        mapper = ClassMapper([Dog, Cat, Person, Monster, Event])
+        self.db = CouchDBWrapper(mapper, COUCHDB_URL, COUCHDB_NAME, reset=True)
+        self.db.update_designs()
+
+    def tearDown(self):
+        self.db.session.close()
+
+
+    def test_lazy_matches_eager(self):
+        paul = Person(name="paul")
+        self.db.put(paul)
+        for i in range(5):
+            self.db.put(Dog(name="dog_%s" % i, owner=paul, kennel_club_membership="k%s" % i))
+
+        eager = sorted(Dog.all(self.db), key=lambda d: d.key)
+        lazy = sorted(Dog.all(self.db, lazy=True), key=lambda d: d.key)
+        self.assertEqual(len(lazy), 5)
+        for e, l in zip(eager, lazy):
+            self.assertEqual(l.name, e.name)
+            self.assertEqual(l.owner.key, paul.key)
+            self.assertEqual(l.channels, ["callbacks"])
+            self.assertEqual(l.rev, e.rev)
+            self.assertEqual(l, e)
+            self.assertEqual(l.as_dict(), e.as_dict())
+
+
+    def test_fields_decoded_as_read(self):
+        now = datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=pytz.utc)
+        self.db.put(Event(name="party", created=now, chance=Fraction(1, 3)))
+        self.db.put(Monster(name="dragon", weapons=Weapons(True, True, False)))
+
+        event = list(Event.all(self.db, lazy=True))[0]
+        self.assertFalse("_properties" in event.__dict__)
+        self.assertEqual(event.created, now)
+        self.assertTrue("chance" in event._values.raw)
+        self.assertEqual(event.chance, Fraction(1, 3))
+        self.assertFalse("_properties" in event.__dict__)
+
+        monster = list(Monster.all(self.db, lazy=True))[0]
+        self.assertTrue(isinstance(monster.weapons, Weapons))
+        self.assertTrue(monster.weapons.wings)
+
+
+    def test_whole_properties_decode_everything(self):
+        now = datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=pytz.utc)
+        self.db.put(Event(name="party", created=now))
+        event = list(Event.all(self.db, lazy=True))[0]
+        self.assertEqual(event._properties["created"], now)
+        self.assertTrue(event._values is event._properties)
+
+
+    def test_lazy_save(self):
+        self.db.put(Event(name="party"))
+        event = list(Event.all(self.db, lazy=True))[0]
+        event.name = "wake"
+        event.save(self.db)
+        self.assertEqual(self.db.get(event.key).name, "wake")
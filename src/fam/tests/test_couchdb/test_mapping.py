@@ -1,8 +1,9 @@
 import unittest
 
 
-from fam.tests.models.test01 import Dog, Cat, Person, JackRussell, Monarch
+from fam.tests.models.test01 import Dog, Cat, Person, JackRussell, Monarch, Monster, Weapons
 from fam.mapper import ClassMapper
+from fam.blud import FieldAccessor, ReferenceToAccessor, ReferenceFromAccessor
 
 class MapperTests(unittest.TestCase):
 
@@ -22,3 +23,47 @@ class MapperTests(unittest.TestCase):
         self.assertEqual(set(Monarch.cls_fields.keys()), {"country"})
 
 
+
+
+    def test_type_with_ref(self):
+
+        self.assertEqual(Monarch._type_with_ref("country"), "monarch")
+        self.assertEqual(Monarch._type_with_ref("dogs"), "person")
+        self.assertEqual(JackRussell._type_with_ref("owner_id"), "dog")
+        self.assertEqual(Monarch._type_with_ref("colour"), None)
+
+
+    def test_field_accessors(self):
+
+        self.assertTrue(isinstance(Dog.__dict__["name"], FieldAccessor))
+        self.assertTrue(isinstance(Dog.__dict__["owner"], ReferenceToAccessor))
+        self.assertTrue(isinstance(Person.__dict__["dogs"], ReferenceFromAccessor))
+        self.assertEqual(Monarch.__dict__["dogs"].type_name, "person")
+
+        # accessors don't hide methods defined on the class
+        self.assertEqual(Dog(name="fly").talk(), "woof")
+
+        paul = Person(key="person_paul", name="paul")
+        dog = Dog(name="fly", owner=paul)
+        self.assertEqual(dog.owner_id, "person_paul")
+        self.assertEqual(dog.kennel_club_membership, None)
+        self.assertEqual(dog.__dict__.get("name"), None)
+        self.assertEqual(dog._properties["name"], "fly")
+
+
+    def test_trusted_constructor(self):
+
+        dog = Dog(key="dog_fly", rev="1-abc", name="fly", owner_id="person_paul")
+        doc = {"name": "fly", "owner_id": "person_paul", "type": "dog",
+               "namespace": Dog.namespace, "_attachments": {}}
+        trusted = Dog._from_trusted(None, "dog_fly", "1-abc", doc)
+        self.assertEqual(trusted, dog)
+        self.assertEqual(trusted.changed_fields, set())
+        self.assertFalse("_attachments" in trusted._properties)
+        self.assertEqual(trusted.channels, ["callbacks"])
+
+        monster = Monster._from_trusted(None, "monster_1", None, {"name": "dragon", "type": "monster",
+                                                                   "namespace": Monster.namespace,
+                                                                   "weapons": {"wings": True, "fire": True, "claws": False}})
+        self.assertTrue(isinstance(monster.weapons, Weapons))
+        self.assertEqual(monster.rev, None)
@@ -0,0 +1,122 @@
+import unittest
+from mock import patch
+from fam.database import CouchDBWrapper
+from fam.mapper import ClassMapper
+from fam.exceptions import *
+from fam.tests.test_couchdb.config import *
+from fam.tests.models.test01 import Dog, Cat, Person
+
+
+class OptimisticSaveTests(unittest.TestCase):
+
+    def setUp(self):
+        mapper = ClassMapper([Dog, Cat, Person])
+        self.db = CouchDBWrapper(mapper, COUCHDB_URL, COUCHDB_NAME, reset=True, optimistic_save=True)
+        self.db.update_designs()
+
+    def tearDown(self):
+        self.db.session.close()
+
+
+    def test_update_doesnt_get(self):
+        paul = Person(name="paul")
+        self.db.put(paul)
+        first_rev = paul.rev
+
+        paul.name = "paul harter"
+        with patch.object(self.db, "_get", side_effect=AssertionError("optimistic save shouldn't get")):
+            self.assertTrue(paul.save(self.db))
+
+        self.assertNotEqual(paul.rev, first_rev)
+        got = self.db.get(paul.key)
+        self.assertEqual(got.name, "paul harter")
+        self.assertEqual(got.rev, paul.rev)
+
+
+    def test_stale_rev_conflicts(self):
+        paul = Person(name="paul")
+        self.db.put(paul)
+
+        other = self.db.get(paul.key)
+        other.name = "someone else"
+        self.db.put(other)
+
+        paul.name = "paul harter"
+        self.assertRaises(FamResourceConflict, paul.save, self.db)
+        self.assertEqual(self.db.get(paul.key).name, "someone else")
+
+
+    def test_conflict_resolved(self):
+        paul = Person(name="paul")
+        self.db.put(paul)
+
+        other = self.db.get(paul.key)
+        other.name = "someone else"
+        self.db.put(other)
+
+        paul.name = "paul harter"
+        with patch.object(Person, "resolve_write_conflict", return_value=True, create=True):
+            paul.save(self.db)
+        self.assertEqual(self.db.get(paul.key).name, "paul harter")
+
+
+    def test_conflict_checks_immutable(self):
+        paul = Person(name="paul")
+        self.db.put(paul)
+        cat = Cat(name="whiskers", colour="black", legs=4, owner=paul)
+        self.db.put(cat)
+
+        other = self.db.get(cat.key)
+        other.name = "tiddles"
+        self.db.put(other)
+
+        # sneak round the accessor to change an immutable field
+        cat._properties["colour"] = "white"
+        cat.mark_changed("colour")
+        with patch.object(Cat, "resolve_write_conflict", return_value=True, create=True):
+            self.assertRaises(FamImmutableError, cat.save, self.db)
+
+
+    def test_immutable_checked_without_a_conflict(self):
+        paul = Person(name="paul")
+        self.db.put(paul)
+        cat = Cat(name="whiskers", colour="black", legs=4, owner=paul)
+        self.db.put(cat)
+
+        cat._properties["colour"] = "white"
+        cat.mark_changed("colour")
+        self.assertRaises(FamImmutableError, cat.save, self.db)
+
+        # made with a key and rev there is nothing to say what has changed
+        again = Cat(key=cat.key, rev=cat.rev, name="whiskers", colour="white", legs=4, owner=paul)
+        self.assertRaises(FamImmutableError, again.save, self.db)
+        self.assertEqual(self.db.get(cat.key).colour, "black")
+
+
+    def test_deleted_elsewhere_is_a_create(self):
+        paul = Person(name="paul")
+        self.db.put(paul)
+        self.db.get(paul.key).delete(self.db)
+
+        paul.name = "paul harter"
+        with patch.object(Person, "post_save_new_cb", create=True) as new_cb, \
+                patch.object(Person, "post_save_update_cb", create=True) as update_cb:
+            self.assertFalse(paul.save(self.db))
+        self.assertEqual(new_cb.call_count, 1)
+        self.assertEqual(update_cb.call_count, 0)
+        self.assertEqual(self.db.get(paul.key).name, "paul harter")
+
+
+    def test_pre_save_update_gets_old_properties(self):
+        paul = Person(name="paul")
+        self.db.put(paul)
+
+        seen = {}
+        def pre_save_update_cb(db, old_properties):
+            seen["name"] = old_properties["name"]
+
+        paul.name = "paul harter"
+        with patch.object(Person, "pre_save_update_cb", side_effect=pre_save_update_cb, create=True):
+            paul.save(self.db)
+
+        self.assertEqual(seen["name"], "paul")
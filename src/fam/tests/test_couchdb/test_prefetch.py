@@ -0,0 +1,84 @@
+import unittest
+from mock import patch
+from fam.database import CouchDBWrapper
+from fam.mapper import ClassMapper
+from fam.blud import LazyValues
+from fam.exceptions import FamError
+from fam.tests.test_couchdb.config import *
+from fam.tests.models.test01 import Dog, Cat, Person
+
+
+class PrefetchTests(unittest.TestCase):
+
+    def setUp(self):
+        mapper = ClassMapper([Dog, Cat, Person])
+        self.db = CouchDBWrapper(mapper, COUCHDB_URL, COUCHDB_NAME, reset=True)
+        self.db.update_designs()
+
+    def tearDown(self):
+        self.db.session.close()
+
+
+    def _people_with_dogs(self):
+        people = []
+        for i in range(3):
+            person = Person(name="person_%s" % i)
+            self.db.put(person)
+            people.append(person)
+            for j in range(i):
+                self.db.put(Dog(name="dog_%s_%s" % (i, j), owner=person))
+        return people
+
+
+    def test_prefetch_ref_to(self):
+        self._people_with_dogs()
+        dogs = list(Dog.all(self.db))
+        self.assertEqual(len(dogs), 3)
+        self.db.prefetch(dogs, "owner")
+
+        with patch.object(self.db, "_get", side_effect=AssertionError("should be prefetched")):
+            for dog in dogs:
+                self.assertEqual(dog.owner.key, dog.owner_id)
+                self.assertTrue(dog.name.startswith("dog_%s" % dog.owner.name[-1]))
+
+
+    def test_prefetch_ref_from(self):
+        self._people_with_dogs()
+        people = list(Person.all(self.db))
+        self.db.prefetch(people, "dogs", "cats")
+
+        with patch.object(self.db, "get_refs_from", side_effect=AssertionError("should be prefetched")):
+            for person in people:
+                self.assertEqual(len(person.dogs), int(person.name[-1]))
+                self.assertEqual(person.cats, [])
+                for dog in person.dogs:
+                    self.assertEqual(dog.owner_id, person.key)
+
+
+    def test_prefetch_keeps_lazy_objects_lazy(self):
+        self._people_with_dogs()
+        dogs = list(Dog.all(self.db, lazy=True))
+        self.db.prefetch(dogs, "owner")
+        for dog in dogs:
+            self.assertTrue(isinstance(dog._values, LazyValues))
+            self.assertEqual(dog.owner.key, dog.owner_id)
+
+
+    def test_changed_ref_isnt_hidden(self):
+        people = self._people_with_dogs()
+        dog = list(Dog.all(self.db))[0]
+        self.db.prefetch([dog], "owner")
+        other = [p for p in people if p.key != dog.owner_id][0]
+        dog.owner = other
+        self.assertEqual(dog.owner.key, other.key)
+
+
+    def test_missing_ref_to(self):
+        dog = Dog(name="fly", owner_id="person_missing")
+        self.db.prefetch([dog], "owner")
+        self.assertIsNone(dog.owner)
+
+
+    def test_prefetch_unknown_name(self):
+        dog = Dog(name="fly")
+        self.assertRaises(FamError, self.db.prefetch, [dog], "name")
@@ -0,0 +1,70 @@
+import unittest
+from fam.database import CouchDBWrapper
+from fam.mapper import ClassMapper
+from fam.exceptions import *
+from fam.tests.test_couchdb.config import *
+from fam.tests.models.test01 import Dog, Cat, Person, JackRussell
+
+
+class QueryTests(unittest.TestCase):
+
+    def setUp(self):
+        mapper = ClassMapper([Dog, Cat, Person, JackRussell])
+        self.db = CouchDBWrapper(mapper, COUCHDB_URL, COUCHDB_NAME, reset=True)
+        self.db.update_designs()
+        self.paul = Person.create(self.db, name="paul")
+
+    def tearDown(self):
+        self.db.session.close()
+
+
+    def test_where_order_and_limit(self):
+        for name, legs in (("tiddles", 4), ("stumpy", 3), ("felix", 4), ("pickles", 4)):
+            Cat.create(self.db, name=name, legs=legs, owner=self.paul)
+        # sorting needs an index
+        Cat.query(self.db).order_by("name").ensure_index()
+
+        cats = Cat.query(self.db).where("legs", ">", 3).order_by("name").all()
+        self.assertEqual([cat.name for cat in cats], ["felix", "pickles", "tiddles"])
+        self.assertIsInstance(cats[0], Cat)
+
+        cats = Cat.query(self.db).where("legs", "==", 4).where("name", "!=", "felix").order_by("name", descending=True).limit(1).all()
+        self.assertEqual([cat.name for cat in cats], ["tiddles"])
+
+        cats = Cat.query(self.db, compact=True).where("name", "in", ["stumpy", "felix"]).order_by("name").all()
+        self.assertEqual([cat.name for cat in cats], ["felix", "stumpy"])
+
+
+    def test_pages_and_sub_classes(self):
+        Dog.bulk_create(self.db, [{"name": "dog_%03d" % i, "owner_id": self.paul.key} for i in range(230)])
+        JackRussell.create(self.db, name="jack", owner_id=self.paul.key)
+
+        dogs = list(Dog.query(self.db).where("owner_id", "==", self.paul.key))
+        self.assertEqual(len(dogs), 231)
+        self.assertEqual(len(set(dog.key for dog in dogs)), 231)
+        self.assertEqual(len([dog for dog in dogs if isinstance(dog, JackRussell)]), 1)
+
+        self.assertEqual(len(Dog.query(self.db).limit(150).all()), 150)
+        self.assertEqual(len(JackRussell.query(self.db).all()), 1)
+
+
+    def test_validates_fields(self):
+        self.assertRaises(FamError, Cat.query(self.db).where, "whiskers", "==", 12)
+        self.assertRaises(FamError, Cat.query(self.db).where, "legs", "~", 4)
+        self.assertRaises(FamError, Cat.query(self.db).where, "legs", "in", 4)
+        self.assertRaises(FamError, Person.query(self.db).order_by, "dogs")
+
+
+    def test_explain(self):
+        query = Cat.query(self.db).where("legs", ">=", 3).order_by("legs").ensure_index()
+        plan = query.explain()
+        self.assertEqual(plan["selector"], {"type": "cat", "namespace": Cat.namespace, "legs": {"$gte": 3}})
+        self.assertEqual(plan["opts"]["use_index"], ["fam_query", "%s_cat__legs" % Cat.namespace.replace("/", "_")])
+        self.assertEqual(plan["opts"]["sort"], [{"legs": "asc"}])
+        self.assertEqual(plan["index"]["name"], "%s_cat__legs" % Cat.namespace.replace("/", "_"))
+
+
+    def test_sort_field_not_in_selector(self):
+        body = self.db._mango_query(Cat.query(self.db).where("legs", "==", 4).order_by("name"))
+        self.assertEqual(body["selector"]["name"], {"$exists": True})
+        self.assertEqual(body["selector"]["legs"], {"$eq": 4})
@@ -17,6 +17,7 @@ from fam.database.couchdb_adapter import CouchDBDataAdapter
 import fam
 from fam.exceptions import *
 from fam.tests.models.test04 import Fish
+from fam.fields import BoolField, NumberField
 
 from fam.database import CouchDBWrapper
 from fam.mapper import ClassMapper
@@ -150,6 +151,88 @@ class TestDeSerialisation(unittest.TestCase):
 
 
 
+class TestClassCodecs(unittest.TestCase):
+
+
+    def setUp(self):
+        self.adapter = CouchDBDataAdapter(ClassMapper([Fish]))
+
+
+    def test_codec_round_trip(self):
+
+        born = datetime.datetime(1964, 12, 5, 12, tzinfo=pytz.UTC)
+        doc = {"type": "fish",
+               "namespace": Fish.namespace,
+               "name": "Nemo",
+               "location": LatLong(51.2345, -1.4533),
+               "born": born,
+               "length": Decimal("45.7"),
+               "edible_fraction": Fraction(1, 3),
+               "image": b"fishy",
+               "extra": {"caught": born}}
+
+        serialised = self.adapter.serialise(doc)
+        self.assertEqual(serialised["born"], "::datetime::1964-12-05T12:00:00Z")
+        self.assertEqual(serialised["extra"]["caught"], "::datetime::1964-12-05T12:00:00Z")
+        # the original is left alone
+        self.assertEqual(doc["extra"]["caught"], born)
+
+        deserialised = self.adapter.deserialise(serialised)
+        self.assertEqual(deserialised.pop("location").latitude, 51.2345)
+        doc.pop("location")
+        self.assertEqual(deserialised, doc)
+
+
+    def test_bool_and_number_use_direct_codec(self):
+
+        def walked(value):
+            raise AssertionError("%r went through the generic walk" % (value,))
+
+        self.adapter._serialise_value = walked
+        self.adapter.deserialise_value = walked
+        for field, value in ((BoolField(), True), (NumberField(), 3), (NumberField(), 4.5)):
+            encode, decode = self.adapter.field_codec(field)
+            self.assertIs(encode(value), value)
+            self.assertIs(decode(value), value)
+
+
+    def test_serialise_only_copies_what_changes(self):
+
+        doc = {"name": "Paul",
+               "children": ["Sol", "Jake"],
+               "favorites": {"drink": "coffee", "food": Decimal("4.2")}}
+
+        serialised = self.adapter.serialise(doc)
+        self.assertIsNot(serialised, doc)
+        self.assertIs(serialised["children"], doc["children"])
+        self.assertIsNot(serialised["favorites"], doc["favorites"])
+        self.assertEqual(doc["favorites"]["food"], Decimal("4.2"))
+
+
+    def test_deserialise_in_place(self):
+
+        doc = {"type": "fish",
+               "namespace": Fish.namespace,
+               "length": "::decimal::45.7",
+               "other": {"length": "::decimal::45.7"}}
+
+        deserialised = self.adapter.deserialise(doc)
+        self.assertIs(deserialised, doc)
+        self.assertEqual(doc["length"], Decimal("45.7"))
+        self.assertEqual(doc["other"]["length"], Decimal("45.7"))
+
+
+    def test_string_fields_arent_scanned(self):
+
+        doc = {"type": "fish",
+               "namespace": Fish.namespace,
+               "name": "::decimal::45.7",
+               "other": "::decimal::45.7"}
+
+        deserialised = self.adapter.deserialise(doc)
+        self.assertEqual(deserialised["name"], "::decimal::45.7")
+        self.assertEqual(deserialised["other"], Decimal("45.7"))
+
 
 
 class TestDatabase(unittest.TestCase):
@@ -0,0 +1,77 @@
+import json
+import unittest
+from fam.database import CouchDBWrapper
+from fam.database.json_stream import iter_array_items
+from fam.mapper import ClassMapper
+from fam.tests.test_couchdb.config import *
+from fam.tests.models.test01 import Dog, Cat, Person
+
+
+class JsonStreamTests(unittest.TestCase):
+
+    def test_items_across_chunks(self):
+        response = {"total_rows": 3, "offset": 0,
+                    "rows": [{"id": "dog_1", "doc": {"name": "fly ünï", "legs": [1, 2]}}, 12345, "last"]}
+        body = json.dumps(response, ensure_ascii=False).encode("utf-8")
+        for size in (1, 2, 5, 64):
+            meta = {}
+            chunks = (body[i:i + size] for i in range(0, len(body), size))
+            self.assertEqual(list(iter_array_items(chunks, "rows", meta)), response["rows"])
+            self.assertEqual(meta, {"total_rows": 3, "offset": 0})
+
+
+    def test_number_split_in_the_middle(self):
+        self.assertEqual(list(iter_array_items([b'{"rows":[12.', b'5]}'], "rows")), [12.5])
+        self.assertEqual(list(iter_array_items([b'{"rows":[1e', b'3, 2]}'], "rows")), [1000.0, 2])
+        self.assertEqual(list(iter_array_items([b'{"rows":[-', b'7,', b'12', b'3]}'], "rows")), [-7, 123])
+
+
+    def test_item_bigger_than_chunks(self):
+        row = {"id": "dog_1", "doc": {"name": "fly \\\"}]", "tags": [[i, {"n": i}] for i in range(2000)]}}
+        body = json.dumps({"rows": [row, row]}).encode("utf-8")
+        chunks = (body[i:i + 100] for i in range(0, len(body), 100))
+        self.assertEqual(list(iter_array_items(chunks, "rows")), [row, row])
+
+
+    def test_truncated(self):
+        body = b'{"rows": [{"id": "dog_1"}, {"id": '
+        self.assertRaises(ValueError, list, iter_array_items([body], "rows"))
+
+
+class StreamingTests(unittest.TestCase):
+
+    def setUp(self):
+        mapper = ClassMapper([Dog, Cat, Person])
+        self.db = CouchDBWrapper(mapper, COUCHDB_URL, COUCHDB_NAME, reset=True)
+        self.db.update_designs()
+
+    def tearDown(self):
+        self.db.session.close()
+
+
+    def test_stream_view(self):
+        Dog.bulk_create(self.db, [{"name": "dog_%s" % i} for i in range(150)])
+        dogs = Dog.view(self.db, "raw/all", key="dog", stream=True)
+        first = next(dogs)
+        self.assertIsInstance(first, Dog)
+        names = set([first.name] + [dog.name for dog in dogs])
+        self.assertEqual(names, set(dog.name for dog in Dog.all(self.db)))
+        self.assertEqual(len(names), 150)
+
+
+    def test_stream_lazy_view(self):
+        Dog.bulk_create(self.db, [{"name": "dog_%s" % i} for i in range(3)])
+        dogs = list(Dog.view(self.db, "raw/all", key="dog", stream=True, lazy=True))
+        self.assertEqual(sorted(dog.name for dog in dogs), ["dog_0", "dog_1", "dog_2"])
+
+
+    def test_stream_changes(self):
+        paul = Person.create(self.db, name="paul")
+        Dog.create(self.db, name="fly", owner=paul)
+        last_seq, objs = self.db.changes()
+
+        changes = self.db.changes(stream=True)
+        self.assertIsNone(changes.last_seq)
+        streamed = list(changes)
+        self.assertEqual(sorted(obj.key for obj in streamed), sorted(obj.key for obj in objs))
+        self.assertEqual(changes.last_seq, last_seq)
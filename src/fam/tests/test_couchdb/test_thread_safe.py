@@ -0,0 +1,82 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from fam.database import CouchDBWrapper
+from fam.mapper import ClassMapper
+from fam.tests.test_couchdb.config import *
+from fam.tests.models.test01 import Dog, Cat, Person
+
+
+class ThreadSafeTests(unittest.TestCase):
+
+    def setUp(self):
+        mapper = ClassMapper([Dog, Cat, Person])
+        self.db = CouchDBWrapper(mapper, COUCHDB_URL, COUCHDB_NAME, reset=True, thread_safe=True,
+                                 pool_maxsize=4, pool_block=True, connect_timeout=5, read_timeout=30)
+        self.db.update_designs()
+
+    def tearDown(self):
+        self.db.session.close()
+
+
+    def test_shared_between_threads(self):
+
+        paul = Person(name="paul")
+        self.db.put(paul)
+        dogs = [Dog(name="dog_%s" % i, owner=paul) for i in range(40)]
+        for dog in dogs:
+            self.db.put(dog)
+        self.db.session.metrics.reset()
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            got = list(executor.map(lambda dog: self.db.get(dog.key), dogs))
+
+        self.assertEqual([dog.name for dog in got], [dog.name for dog in dogs])
+        metrics = self.db.pool_metrics
+        self.assertEqual(metrics["checkouts"], 40)
+        self.assertTrue(metrics["max_wait"] >= metrics["mean_wait"] >= 0)
+
+
+    def test_identity_session_per_thread(self):
+
+        paul = Person(name="paul")
+        self.db.put(paul)
+        seen = []
+
+        def other_thread():
+            seen.append(self.db.identity_map)
+
+        with self.db.identity_session():
+            self.assertIsNotNone(self.db.identity_map)
+            thread = threading.Thread(target=other_thread)
+            thread.start()
+            thread.join()
+
+        self.assertEqual(seen, [None])
+
+
+    def test_authenticates_once(self):
+
+        calls = []
+        failing = set(range(8))
+        lock = threading.Lock()
+        barrier = threading.Barrier(8)
+
+        def authenticate():
+            calls.append(1)
+            failing.clear()
+
+        def request(i):
+            generation = self.db._auth_generation
+            barrier.wait()
+            with lock:
+                failed = i in failing
+            if failed:
+                self.db._refresh_auth(generation)
+
+        self.db.authenticate = authenticate
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(request, range(8)))
+
+        self.assertEqual(len(calls), 1)
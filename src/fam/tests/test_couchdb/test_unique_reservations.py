@@ -0,0 +1,85 @@
+import unittest
+from mock import patch
+from fam.database import CouchDBWrapper
+from fam.mapper import ClassMapper
+
+from fam.exceptions import *
+from fam.tests.test_couchdb.config import *
+from fam.tests.models.test01 import Dog, Cat, Person, JackRussell
+
+
+class UniqueReservationTests(unittest.TestCase):
+
+    def setUp(self):
+        mapper = ClassMapper([Dog, Cat, Person, JackRussell], unique_views=False)
+        self.db = CouchDBWrapper(mapper, COUCHDB_URL, COUCHDB_NAME, reset=True, unique_reservations=True)
+        self.db.update_designs()
+
+    def tearDown(self):
+        self.db.session.close()
+
+
+    def reservation(self, value):
+        return self.db._get_many(["unique:dog:kennel_club_membership:%s" % value]).get("unique:dog:kennel_club_membership:%s" % value)
+
+
+    def test_no_unique_views(self):
+        design = self.db.get_design("_design/%s" % Dog.namespace.replace("/", "_"))
+        self.assertFalse("dog_kennel_club_membership" in design.value["views"])
+
+
+    def test_create_and_clash(self):
+        dog = Dog.create(self.db, name="rufus", kennel_club_membership="123456")
+        self.assertEqual(self.reservation("123456").value["owner"], dog.key)
+        self.assertRaises(FamUniqueError, Dog.create, self.db, name="fly", kennel_club_membership="123456")
+        # sub classes share them
+        self.assertRaises(FamUniqueError, JackRussell.create, self.db, name="jack", kennel_club_membership="123456")
+        self.assertEqual(Dog.get_unique_instance(self.db, "kennel_club_membership", "123456"), dog)
+        self.assertEqual(Dog.count_with_value(self.db, "kennel_club_membership", "123456"), 1)
+
+
+    def test_change_releases(self):
+        dog = Dog.create(self.db, name="rufus", kennel_club_membership="123456")
+        dog.kennel_club_membership = "654321"
+        dog.save(self.db)
+        self.assertIsNone(self.reservation("123456"))
+        self.assertEqual(self.reservation("654321").value["owner"], dog.key)
+        Dog.create(self.db, name="fly", kennel_club_membership="123456")
+
+
+    def test_save_and_delete_dont_get_the_doc_again(self):
+        dog = Dog.create(self.db, name="rufus", kennel_club_membership="123456")
+        dog.kennel_club_membership = "654321"
+        with patch.object(self.db, "_get_many", wraps=self.db._get_many) as get_many:
+            dog.save(self.db)
+            dog.delete(self.db)
+        self.assertFalse([dog.key] in [args[0] for args, kwargs in get_many.call_args_list])
+        self.assertIsNone(self.reservation("654321"))
+        Dog.create(self.db, name="fly", kennel_club_membership="123456")
+
+
+    def test_delete_releases(self):
+        dog = Dog.create(self.db, name="rufus", kennel_club_membership="123456")
+        dog.delete(self.db)
+        self.assertIsNone(self.reservation("123456"))
+        Dog.create(self.db, name="fly", kennel_club_membership="123456")
+
+
+    def test_stale_reservation_taken_over(self):
+        dog = Dog.create(self.db, name="rufus", kennel_club_membership="123456")
+        # as if it had been deleted without releasing its reservation
+        self.db.session.delete("%s/%s/%s?rev=%s" % (self.db.db_url, self.db.db_name, dog.key, dog.rev))
+        fly = Dog.create(self.db, name="fly", kennel_club_membership="123456")
+        self.assertEqual(self.reservation("123456").value["owner"], fly.key)
+
+
+    def test_bulk(self):
+        dogs = [Dog(name="dog_%s" % i, kennel_club_membership="k%s" % i) for i in range(5)]
+        dogs.append(Dog(name="again", kennel_club_membership="k0"))
+        results = self.db.put_many(dogs)
+        self.assertEqual([result.ok for result in results], [True] * 5 + [False])
+        self.assertTrue(isinstance(results[5].error, FamUniqueError))
+
+        self.db.delete_many(dogs[:5])
+        for i in range(5):
+            self.assertIsNone(self.reservation("k%s" % i))
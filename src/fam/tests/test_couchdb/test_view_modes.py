@@ -0,0 +1,54 @@
+import unittest
+from fam.database import CouchDBWrapper
+from fam.mapper import ClassMapper
+from fam.exceptions import *
+from fam.tests.test_couchdb.config import *
+from fam.tests.models.test01 import Dog, Cat, Person
+
+
+class ViewModeTests(unittest.TestCase):
+
+    def setUp(self):
+        mapper = ClassMapper([Dog, Cat, Person])
+        self.db = CouchDBWrapper(mapper, COUCHDB_URL, COUCHDB_NAME, reset=True)
+        self.db.update_designs()
+
+        self.calls = []
+        view = self.db.view
+        def recording_view(name, **kwargs):
+            self.calls.append(dict(kwargs))
+            return view(name, **kwargs)
+        self.db.view = recording_view
+
+    def tearDown(self):
+        self.db.session.close()
+
+
+    def test_view_values(self):
+        dogs = Dog.bulk_create(self.db, [{"name": "dog_%s" % i} for i in range(25)])
+        values = list(Dog.view_values(self.db, "raw/all", key="dog", page_size=10))
+        self.assertEqual(sorted(values), sorted((result.key, result.obj.rev) for result in dogs))
+        self.assertTrue(all(call["include_docs"] is False for call in self.calls))
+
+
+    def test_projection(self):
+        paul = Person.create(self.db, name="paul")
+        Cat.create(self.db, name="tiddles", legs=4, colour="black", owner=paul)
+        cat = Cat.create(self.db, name="stumpy", legs=3, colour="white", owner=paul)
+
+        projected = sorted(Cat.projection(self.db), key=lambda p: p["name"])
+        self.assertEqual(len(projected), 2)
+        self.assertEqual(projected[0], {"key": cat.key, "rev": cat.rev, "name": "stumpy", "legs": 3})
+        self.assertRaises(FamError, list, Dog.projection(self.db))
+
+
+    def test_uniqueness_checks_fetch_no_docs(self):
+        Dog.create(self.db, name="rufus", kennel_club_membership="123456")
+        dog = Dog.create(self.db, name="fly")
+        del self.calls[:]
+
+        self.assertRaises(FamUniqueError, dog.update, {"kennel_club_membership": "123456"})
+        results = Dog.bulk_create(self.db, [{"name": "steve", "kennel_club_membership": "123456"}])
+        self.assertIsInstance(results[0].error, FamUniqueError)
+        self.assertEqual(len(self.calls), 2)
+        self.assertTrue(all(call["include_docs"] is False for call in self.calls))
@@ -0,0 +1,63 @@
+import time
+import unittest
+from fam.database import CouchDBWrapper
+from fam.database.view_refresher import ViewRefresher
+from fam.exceptions import *
+from fam.mapper import ClassMapper
+from fam.tests.test_couchdb.config import *
+from fam.tests.models.test01 import Dog, Cat, Person
+
+
+class ViewUpdateTests(unittest.TestCase):
+
+    def setUp(self):
+        mapper = ClassMapper([Dog, Cat, Person])
+        self.db = CouchDBWrapper(mapper, COUCHDB_URL, COUCHDB_NAME, reset=True)
+        self.db.update_designs()
+
+    def tearDown(self):
+        self.db.session.close()
+
+
+    def test_stale_reads(self):
+        Dog.create(self.db, name="fly")
+        self.assertEqual(len(Dog.view(self.db, "raw/all", key="dog")), 1)
+
+        Dog.create(self.db, name="rufus")
+        # the index isn't updated so the new one isn't there yet
+        self.assertEqual(self.db.view_lag("raw/all"), 1)
+        self.assertEqual(len(Dog.view(self.db, "raw/all", key="dog", update="false")), 1)
+        self.assertEqual(len(Dog.view(self.db, "raw/all", key="dog")), 2)
+        self.assertEqual(self.db.view_lag("raw/all"), 0)
+
+
+    def test_db_policy(self):
+        self.db.view_update = "false"
+        Dog.create(self.db, name="fly")
+        self.assertEqual(len(Dog.all(self.db)), 0)
+        self.assertEqual(len(Dog.view(self.db, "raw/all", key="dog", update="true")), 1)
+        self.assertRaises(FamError, self.db.view, "raw/all", update="sometimes")
+
+
+    def test_unique_checks_stay_strict(self):
+        self.db.view_update = "false"
+        Dog.create(self.db, name="rufus", kennel_club_membership="123456")
+        self.assertRaises(FamUniqueError, Dog.create, self.db, name="fly", kennel_club_membership="123456")
+
+
+    def test_reserve_existing_sees_everything(self):
+        self.db.view_update = "false"
+        dog = Dog.create(self.db, name="rufus", kennel_club_membership="123456")
+        self.db.reserve_existing_unique_values()
+        key = "unique:dog:kennel_club_membership:123456"
+        self.assertEqual(self.db._get_many([key])[key].value["owner"], dog.key)
+
+
+    def test_refresher(self):
+        self.db.view_update = "false"
+        with ViewRefresher(self.db, ["raw/all"], interval=0.1) as refresher:
+            Dog.create(self.db, name="fly")
+            time.sleep(0.5)
+            self.assertEqual(len(Dog.all(self.db)), 1)
+            self.assertTrue("raw/all" in refresher.lags)
+        self.assertEqual(refresher.errors, 0)
@@ -1,5 +1,6 @@
 import unittest
 import os
+from mock import patch
 
 os.environ["FIRESTORE_EMULATOR_HOST"] = "localhost:8080"
 os.environ["GCLOUD_PROJECT"] = "localtest"
@@ -270,6 +271,81 @@ class TestDB(unittest.TestCase):
         self.assertEqual(got.name, "blackie")
 
 
+    def test_update_only_sends_changes(self):
+        paul = Person(name="paul")
+        paul.save(self.db)
+        cat = Cat(name="whiskers", owner_id=paul.key, legs=2)
+        cat.save(self.db)
+
+        cat.name = "blackie"
+        self.assertEqual(cat.changed_fields, {"name"})
+        with patch.object(self.db, "_set_ref", side_effect=AssertionError("should update not set")):
+            with patch.object(self.db, "_update_ref", wraps=self.db._update_ref) as update_ref:
+                cat.save(self.db)
+                self.assertEqual(update_ref.call_args[0][1], {"name": "blackie"})
+
+        self.assertEqual(cat.changed_fields, set())
+        got = Cat.get(self.db, cat.key)
+        self.assertEqual(got.name, "blackie")
+        self.assertEqual(got.legs, 2)
+
+
+    def test_put_and_delete_many(self):
+        results = Monkey.bulk_create(self.db, [{"name": "monkey_%s" % i} for i in range(10)])
+        self.assertTrue(all(r.ok for r in results))
+        monkeys = [r.obj for r in results]
+        for monkey in monkeys:
+            self.assertEqual(Monkey.get(self.db, monkey.key).name, monkey.name)
+
+        results = self.db.delete_many(monkeys)
+        self.assertTrue(all(r.ok for r in results))
+        for monkey in monkeys:
+            self.assertIsNone(Monkey.get(self.db, monkey.key))
+
+
+    def test_put_many_updates(self):
+        paul = Person(name="paul")
+        paul.save(self.db)
+        fly = Dog(name="fly", owner_id=paul.key)
+        fly.save(self.db)
+        fly.name = "flyer"
+        rufus = Dog(name="rufus", owner_id=paul.key)
+
+        with patch.object(Dog, "pre_save_new_cb") as pre_new, patch.object(Dog, "pre_save_update_cb") as pre_update:
+            with patch.object(Dog, "post_save_new_cb") as post_new, patch.object(Dog, "post_save_update_cb") as post_update:
+                results = self.db.put_many([fly, rufus])
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual((pre_new.call_count, post_new.call_count), (1, 1))
+        self.assertEqual((pre_update.call_count, post_update.call_count), (1, 1))
+        self.assertEqual(Dog.get(self.db, fly.key).name, "flyer")
+
+        cat = Cat(name="whiskers", owner_id=paul.key, legs=2, colour="black")
+        cat.save(self.db)
+        repainted = Cat(key=cat.key, name="whiskers", owner_id=paul.key, legs=2, colour="white")
+        results = self.db.put_many([repainted])
+        self.assertTrue(isinstance(results[0].error, FamImmutableError))
+        self.assertEqual(Cat.get(self.db, cat.key).colour, "black")
+
+
+    def test_save_after_deleted_elsewhere(self):
+        paul = Person(name="paul")
+        paul.save(self.db)
+        cat = Cat(name="whiskers", owner_id=paul.key, legs=2)
+        cat.save(self.db)
+
+        loaded = Cat.get(self.db, cat.key)
+        loaded.name = "blackie"
+        cat.delete(self.db)
+
+        # with the checks it finds it gone and writes it all back rather than updating
+        with patch.object(self.db, "check_on_save", True):
+            self.assertFalse(loaded.save(self.db))
+
+        got = Cat.get(self.db, cat.key)
+        self.assertEqual(got.name, "blackie")
+        self.assertEqual(got.legs, 2)
+
+
     def test_update_cat_fails(self):
         paul = Person(name="paul")
         paul.save(self.db)
@@ -370,6 +446,17 @@ class TestDB(unittest.TestCase):
         count = self.db.query_count(query)
         self.assertEqual(count, 2)
 
+    def test_query_items_compact(self):
+
+        Dog.create(self.db, name="rufus")
+        query = self.db.db.collection("dog").where(filter=FieldFilter("name", "==", "rufus"))
+        records = self.db.query_items(query, compact=True)
+        self.assertEqual([record.name for record in records], ["rufus"])
+        self.assertTrue(isinstance(records[0], Dog.record_class()))
+        dogs = self.db.query_items(query, lazy=True)
+        self.assertTrue(isinstance(dogs[0], Dog))
+        self.assertEqual(dogs[0].name, "rufus")
+
     def test_page(self):
 
         paul = Person(name="paul")
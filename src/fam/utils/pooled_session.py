@@ -0,0 +1,126 @@
+"""
+A requests Session with a sized connection pool, default timeouts and a record of how long
+requests wait to get a connection from the pool, for sharing one CouchDBWrapper between threads.
+"""
+
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.poolmanager import PoolManager
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class PoolMetrics(object):
+    """How many connections have been taken from the pool and how long it took to get them"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += seconds
+            if seconds > self.max_wait:
+                self.max_wait = seconds
+
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "total_wait": self.total_wait,
+                "max_wait": self.max_wait,
+                "mean_wait": self.total_wait / self.checkouts if self.checkouts else 0.0
+            }
+
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.total_wait = 0.0
+            self.max_wait = 0.0
+
+
+class _TimedPoolMixin(object):
+
+    metrics = None
+
+    def _get_conn(self, timeout=None):
+        started = time.monotonic()
+        try:
+            return super(_TimedPoolMixin, self)._get_conn(timeout=timeout)
+        finally:
+            if self.metrics is not None:
+                self.metrics.record_wait(time.monotonic() - started)
+
+
+class TimedHTTPConnectionPool(_TimedPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class TimedHTTPSConnectionPool(_TimedPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class TimedPoolManager(PoolManager):
+
+    def __init__(self, *args, **kwargs):
+        self.metrics = kwargs.pop("metrics", None)
+        super(TimedPoolManager, self).__init__(*args, **kwargs)
+        self.pool_classes_by_scheme = {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super(TimedPoolManager, self)._new_pool(scheme, host, port, request_context=request_context)
+        pool.metrics = self.metrics
+        return pool
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+
+    def __init__(self, metrics, **kwargs):
+        self.metrics = metrics
+        super(TimedHTTPAdapter, self).__init__(**kwargs)
+
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = TimedPoolManager(num_pools=connections, maxsize=maxsize, block=block,
+                                            metrics=self.metrics, **pool_kwargs)
+
+
+class PooledSession(requests.Session):
+    """
+    Sends every request through pools of pool_maxsize connections per host. With pool_block
+    a request waits for a free connection rather than opening one that won't be kept. timeout
+    is used for any request that doesn't give its own, as requests takes either a number or a
+    (connect, read) pair. Without keep_alive each connection is closed after its request.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False, timeout=None, keep_alive=True, max_retries=0):
+        super(PooledSession, self).__init__()
+        self.timeout = timeout
+        self.metrics = PoolMetrics()
+        adapter = TimedHTTPAdapter(self.metrics,
+                                   pool_connections=pool_connections,
+                                   pool_maxsize=pool_maxsize,
+                                   pool_block=pool_block,
+                                   max_retries=max_retries)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        if not keep_alive:
+            self.headers["Connection"] = "close"
+
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super(PooledSession, self).request(method, url, **kwargs)